@@ -0,0 +1,26 @@
+# ملف تكوين الأوامر والاختصارات النصية لبوت المستخدمين
+# يمكن إضافة مرادفات جديدة هنا بدون تعديل الكود (تُطبّع تلقائياً: حالة الأحرف، التشكيل، أشكال الألف...)
+
+# الأوامر: تُنفذ حتى أثناء وجود خطوة إدخال مفتوحة (مثل إدخال رقم الهاتف)
+USER_COMMANDS = {
+    "start": ["/start"],
+    "menu": ["/menu"],
+    "help": ["/help", "/مساعدة", "مساعدة", "help"],
+    "shop": ["/shop", "shop"],
+    "wallet": ["/wallet", "wallet"],
+    "orders": ["/orders", "orders"],
+    "support": ["/support", "support"],
+}
+
+# الاختصارات: تُنفذ فقط عندما لا توجد خطوة إدخال تنتظر النص
+# الأرقام هي أرقام القائمة الرئيسية (تقبل الأرقام العربية ١-٨ أيضاً)
+USER_SHORTCUTS = {
+    "shop": ["1", "متجر", "منتجات", "shopping"],
+    "wallet": ["2", "محفظة", "رصيد", "balance"],
+    "orders": ["3", "طلبات", "طلباتي", "history"],
+    "offers": ["4", "offers", "عروض", "خصومات", "deals"],
+    "support": ["5", "دعم"],
+    "about": ["6", "about", "معلومات", "عنا", "info"],
+    "refresh": ["7", "refresh", "تحديث", "update"],
+    "daily": ["8", "daily", "مفاجآت", "اليوم", "surprises"],
+}
@@ -0,0 +1,140 @@
+"""
+Callback Router - موجّه أزرار البوت
+جدول مسارات لـ callback_data بدلاً من سلسلة if/elif طويلة
+
+- مسارات ثابتة (exact): بحث مباشر في dict
+- مسارات بمعامل (prefix) مثل product_<id>: أطول بادئة مطابقة، والباقي يُمرر كمعامل للمعالج
+- المسار الثابت له الأولوية دائماً على البادئة (مثلاً confirm_delete_test_data قبل confirm_delete_)
+
+التسجيل بالمزخرفات:
+    admin_callbacks = CallbackRouter("admin")
+
+    @admin_callbacks.exact("manage_codes")
+    async def handle_admin_manage_codes(telegram_id: int): ...
+
+    @admin_callbacks.prefix("edit_product_")
+    async def handle_edit_product_selected(telegram_id: int, product_id: str): ...
+"""
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable]
+
+
+class RouteConflict(ValueError):
+    """تعارض في جدول المسارات (تسجيل مكرر أو بادئات متداخلة)"""
+
+
+class CallbackRouter:
+    """جدول مسارات callback_data لبوت واحد"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._exact: Dict[str, Handler] = {}
+        self._prefixes: Dict[str, Handler] = {}
+        # أطوال البادئات المسجلة من الأطول للأقصر
+        self._prefix_lengths: List[int] = []
+        self._unmatched = metrics.counter("callback_unmatched_total", bot=name)
+
+    def add_exact(self, key: str, handler: Handler):
+        if key in self._exact:
+            raise RouteConflict(f"{self.name}: callback '{key}' registered twice")
+        self._exact[key] = handler
+
+    def add_prefix(self, prefix: str, handler: Handler):
+        if prefix in self._prefixes:
+            raise RouteConflict(f"{self.name}: callback prefix '{prefix}' registered twice")
+        self._prefixes[prefix] = handler
+        self._prefix_lengths = sorted({len(key) for key in self._prefixes}, reverse=True)
+
+    def exact(self, *keys: str):
+        """مزخرف: تسجيل المعالج لمسار ثابت أو أكثر، ويُستدعى بـ (telegram_id)"""
+        def decorator(handler: Handler) -> Handler:
+            for key in keys:
+                self.add_exact(key, handler)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str):
+        """مزخرف: تسجيل المعالج لبادئة أو أكثر، ويُستدعى بـ (telegram_id, باقي النص)"""
+        def decorator(handler: Handler) -> Handler:
+            for prefix in prefixes:
+                self.add_prefix(prefix, handler)
+            return handler
+        return decorator
+
+    def validate(self):
+        """
+        فحص الجدول عند بدء التشغيل: رفض البادئات المتداخلة
+
+        بادئة تبدأ ببادئة أخرى (مثل order_ و order_details_) تجعل معنى المعامل غامضاً
+        """
+        prefixes = sorted(self._prefixes)
+        conflicts = [
+            (shorter, longer)
+            for index, shorter in enumerate(prefixes)
+            for longer in prefixes[index + 1:]
+            if longer.startswith(shorter)
+        ]
+        if conflicts:
+            details = ", ".join(f"'{shorter}' / '{longer}'" for shorter, longer in conflicts)
+            raise RouteConflict(f"{self.name}: ambiguous callback prefixes: {details}")
+
+        shadowed = [key for key in self._exact if self.match_prefix(key)]
+        if shadowed:
+            logger.info(f"Callback router '{self.name}': exact routes take precedence over prefixes for {shadowed}")
+        logger.info(f"Callback router '{self.name}': {len(self._exact)} exact routes, {len(self._prefixes)} prefixes")
+
+    def match_prefix(self, data: str) -> Optional[str]:
+        """أطول بادئة مسجلة تطابق data"""
+        for length in self._prefix_lengths:
+            if length <= len(data) and data[:length] in self._prefixes:
+                return data[:length]
+        return None
+
+    def resolve(self, data: str) -> Optional[Tuple[str, Handler, Optional[str]]]:
+        """
+        Returns:
+            tuple: (اسم المسار، المعالج، المعامل أو None) أو None إذا لم يطابق أي مسار
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return data, handler, None
+        prefix = self.match_prefix(data)
+        if prefix is not None:
+            return prefix + "*", self._prefixes[prefix], data[len(prefix):]
+        return None
+
+    def route_name(self, data: str) -> str:
+        """اسم المسار الثابت (يُستخدم كتسمية في المقاييس)"""
+        resolved = self.resolve(data or "")
+        return resolved[0] if resolved else "unmatched"
+
+    async def dispatch(self, telegram_id: int, data: str) -> bool:
+        """
+        تنفيذ المعالج المطابق مع تسجيل عدد الاستدعاءات والزمن لكل مسار
+
+        Returns:
+            bool: False إذا لم يطابق أي مسار
+        """
+        resolved = self.resolve(data or "")
+        if resolved is None:
+            self._unmatched.inc()
+            logger.warning(f"Callback router '{self.name}': no route for '{data}'")
+            return False
+
+        route, handler, argument = resolved
+        start = time.perf_counter()
+        try:
+            if argument is None:
+                await handler(telegram_id)
+            else:
+                await handler(telegram_id, argument)
+        finally:
+            metrics.histogram("callback_route_seconds", bot=self.name, route=route).observe(time.perf_counter() - start)
+        return True
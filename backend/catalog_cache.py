@@ -0,0 +1,216 @@
+"""
+Catalog Cache - ذاكرة الكتالوج
+نسخة كاملة من المنتجات والفئات في الذاكرة مع فهارس ثانوية (حسب id، حسب المنتج، حسب نوع التسليم)
+
+الكتالوج لا يتغير إلا عند تعديل الإدارة: كل عملية كتابة تستدعي bump() لزيادة رقم الإصدار في
+catalog_meta، وكل عملية تفحص رقم الإصدار دورياً وتعيد التحميل عند تغيره
+
+فهرس البحث (search_index.py) يُحدّث تدريجياً مع كل إعادة تحميل، وشعبية الفئات (طلبات آخر
+POPULARITY_DAYS يوماً من التجميعات اليومية) تُحدّث كل POPULARITY_INTERVAL ثانية لترتيب الاقتراحات
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+import metrics
+from inventory import category_in_stock
+from rollups import category_popularity, day_key
+from search_index import SearchIndex, Suggestion
+
+logger = logging.getLogger(__name__)
+
+CATALOG_META_COLLECTION = "catalog_meta"
+CATALOG_VERSION_ID = "catalog"
+DEFAULT_POLL_INTERVAL = float(os.environ.get('CATALOG_POLL_INTERVAL', '5'))
+POPULARITY_INTERVAL = float(os.environ.get('CATALOG_POPULARITY_INTERVAL', '600'))
+POPULARITY_DAYS = 30
+
+
+class CatalogSnapshot:
+    """لقطة ثابتة من الكتالوج (لا تُعدل بعد إنشائها)"""
+
+    def __init__(self, version: int, products: List[dict], categories: List[dict]):
+        self.version = version
+        self.loaded_at = time.time()
+        self.products = products
+        self.categories = categories
+        self.products_by_id: Dict[str, dict] = {product["id"]: product for product in products}
+        self.categories_by_id: Dict[str, dict] = {category["id"]: category for category in categories}
+        self.categories_by_product: Dict[str, List[dict]] = {}
+        self.categories_by_delivery_type: Dict[str, List[dict]] = {}
+        for category in categories:
+            self.categories_by_product.setdefault(category.get("product_id"), []).append(category)
+            self.categories_by_delivery_type.setdefault(category.get("delivery_type"), []).append(category)
+
+        # ملخص ثابت لكل منتج (عدد الفئات وأقل سعر) يُحسب مرة واحدة لكل إصدار
+        self.product_summaries: Dict[str, dict] = {}
+        for product_id, product_categories in self.categories_by_product.items():
+            prices = [category["price"] for category in product_categories if category.get("price") is not None]
+            self.product_summaries[product_id] = {
+                "categories_count": len(product_categories),
+                "min_price": min(prices) if prices else None
+            }
+
+
+class CatalogCache:
+    """ذاكرة الكتالوج لعملية واحدة"""
+
+    def __init__(self, db, poll_interval: Optional[float] = None):
+        self.db = db
+        self.poll_interval = poll_interval or DEFAULT_POLL_INTERVAL
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._load_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.search_index = SearchIndex()
+        self._popularity_loaded_at: Optional[float] = None
+
+        self._reloads = metrics.counter("catalog_reloads_total")
+        self._load_time = metrics.histogram("catalog_load_seconds")
+        self._version_gauge = metrics.gauge("catalog_version")
+
+    async def _read_version(self) -> int:
+        meta = await self.db[CATALOG_META_COLLECTION].find_one({"_id": CATALOG_VERSION_ID})
+        return meta.get("version", 0) if meta else 0
+
+    async def reload(self) -> CatalogSnapshot:
+        """تحميل الكتالوج كاملاً من قاعدة البيانات"""
+        async with self._load_lock:
+            start = time.perf_counter()
+            # قراءة الإصدار أولاً: أي تعديل لاحق سيرفع الإصدار ويؤدي لإعادة تحميل جديدة
+            version = await self._read_version()
+            products = await self.db.products.find({}, {"_id": 0}).to_list(None)
+            categories = await self.db.categories.find({}, {"_id": 0}).to_list(None)
+            self._snapshot = CatalogSnapshot(version, products, categories)
+            reindexed, removed = self.search_index.sync(products, categories)
+
+            self._reloads.inc()
+            self._load_time.observe(time.perf_counter() - start)
+            self._version_gauge.set(version)
+            logger.info(
+                f"Catalog loaded: v{version}, {len(products)} products, {len(categories)} categories "
+                f"(search index: {reindexed} reindexed, {removed} removed)"
+            )
+            return self._snapshot
+
+    async def snapshot(self) -> CatalogSnapshot:
+        """اللقطة الحالية (تُحمّل عند أول استخدام)"""
+        if self._snapshot is None:
+            return await self.reload()
+        return self._snapshot
+
+    async def bump(self):
+        """تسجيل تعديل على الكتالوج: زيادة الإصدار المشترك وإعادة التحميل محلياً"""
+        await self.db[CATALOG_META_COLLECTION].find_one_and_update(
+            {"_id": CATALOG_VERSION_ID},
+            {"$inc": {"version": 1}, "$set": {"updated_at": time.time()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await self.reload()
+
+    async def refresh_popularity(self):
+        """تحديث شعبية الفئات في فهرس البحث من التجميعات اليومية"""
+        since = datetime.now(timezone.utc) - timedelta(days=POPULARITY_DAYS)
+        self.search_index.set_popularity(await category_popularity(self.db, day_key(since)))
+        self._popularity_loaded_at = time.monotonic()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                version = await self._read_version()
+                if self._snapshot is None or version != self._snapshot.version:
+                    await self.reload()
+                if (self._popularity_loaded_at is None
+                        or time.monotonic() - self._popularity_loaded_at >= POPULARITY_INTERVAL):
+                    await self.refresh_popularity()
+            except Exception as e:
+                logger.error(f"Catalog version poll failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            try:
+                await self.reload()
+                await self.refresh_popularity()
+            except Exception as e:
+                logger.error(f"Initial catalog load failed: {e}")
+            self._task = asyncio.create_task(self._poll_loop(), name="catalog-poll")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # دوال القراءة - تعيد نسخاً حتى لا تتأثر اللقطة بتعديل المستدعي
+
+    async def get_product(self, product_id: str) -> Optional[dict]:
+        product = (await self.snapshot()).products_by_id.get(product_id)
+        return dict(product) if product else None
+
+    async def get_category(self, category_id: str) -> Optional[dict]:
+        category = (await self.snapshot()).categories_by_id.get(category_id)
+        return dict(category) if category else None
+
+    async def list_products(self, active_only: bool = False, limit: Optional[int] = None) -> List[dict]:
+        products = (await self.snapshot()).products
+        if active_only:
+            products = [product for product in products if product.get("is_active") is True]
+        return [dict(product) for product in products[:limit]]
+
+    async def list_categories(self, product_id: Optional[str] = None, delivery_type: Optional[str] = None,
+                              limit: Optional[int] = None) -> List[dict]:
+        snapshot = await self.snapshot()
+        if product_id is not None:
+            categories = snapshot.categories_by_product.get(product_id, [])
+            if delivery_type is not None:
+                categories = [category for category in categories if category.get("delivery_type") == delivery_type]
+        elif delivery_type is not None:
+            categories = snapshot.categories_by_delivery_type.get(delivery_type, [])
+        else:
+            categories = snapshot.categories
+        return [dict(category) for category in categories[:limit]]
+
+    async def count_categories(self, product_id: str) -> int:
+        return len((await self.snapshot()).categories_by_product.get(product_id, []))
+
+    async def list_product_summaries(self, stock_levels: Dict[str, dict], active_only: bool = True,
+                                     limit: Optional[int] = None) -> List[dict]:
+        """
+        المنتجات مع ملخص فئاتها بدون أي استعلام إضافي
+
+        Args:
+            stock_levels: مستويات المخزون من InventoryService.stock_levels()
+
+        Returns:
+            list: نسخ من المنتجات مع categories_count و min_price و in_stock
+        """
+        snapshot = await self.snapshot()
+        summaries = []
+        for product in await self.list_products(active_only=active_only, limit=limit):
+            summary = snapshot.product_summaries.get(product["id"], {"categories_count": 0, "min_price": None})
+            product.update(summary)
+            product["in_stock"] = any(
+                category_in_stock(category, stock_levels)
+                for category in snapshot.categories_by_product.get(product["id"], [])
+            )
+            summaries.append(product)
+        return summaries
+
+    async def search(self, query: str, kind: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """البحث في أسماء وأوصاف المنتجات المفعلة والفئات (kind: product أو category)"""
+        await self.snapshot()
+        return [dict(doc) for doc in self.search_index.search(query, kind=kind, limit=limit)]
+
+    async def suggest(self, query: str, limit: int = 5) -> Optional[Suggestion]:
+        """اقتراحات "هل تقصد" لاستعلام بدون نتائج (النتائج نسخ مستقلة)"""
+        await self.snapshot()
+        suggestion = self.search_index.suggest(query, limit=limit)
+        if suggestion is not None:
+            suggestion.results = [(kind, dict(doc)) for kind, doc in suggestion.results]
+        return suggestion
@@ -0,0 +1,397 @@
+"""
+Code Import Pipeline - استيراد الأكواد دفعة واحدة
+تحليل الأكواد والتحقق منها في الذاكرة ثم كتابتها بـ insert_many غير مرتب بدلاً من find_one + insert_one لكل سطر
+
+- التكرار داخل نفس الدفعة يُكتشف أثناء التحليل
+- التكرار مع الأكواد الموجودة يمنعه الفهرس الفريد (category_id, code) - انظر db_indexes.py -
+  وأخطاء duplicate key تُعاد لأرقام أسطرها
+- الكتابة على دفعات CODE_IMPORT_CHUNK_SIZE مع تحديث عداد المخزون بعد كل دفعة وتقرير التقدم
+
+استيراد الملفات (TXT/CSV):
+- الملف يُنزل ويُحلل على أجزاء (import_stream)، فالذاكرة لا تتجاوز دفعة واحدة مهما كان حجم الملف
+- كل ملف له مهمة في code_import_jobs تحفظ آخر سطر تمت كتابة دفعته (committed_line)
+- عند الانقطاع (إعادة تشغيل أو خطأ شبكة) يُكمل الاستيراد من بعد آخر دفعة محفوظة، وإعادة كتابة
+  آخر دفعة غير محفوظة آمنة لأن الفهرس الفريد يرفض ما أُضيف منها
+"""
+import codecs
+import csv
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+import metrics
+from inventory import adjust_stock
+
+logger = logging.getLogger(__name__)
+
+CODE_IMPORT_CHUNK_SIZE = int(os.environ.get('CODE_IMPORT_CHUNK_SIZE', '1000'))
+# الحد الأدنى بين تعديلات رسالة التقدم (حدود تليجرام لتعديل الرسائل)
+PROGRESS_INTERVAL = float(os.environ.get('CODE_IMPORT_PROGRESS_INTERVAL', '2'))
+# عدد الأخطاء المحفوظة للعرض (العدد الكلي في rejected)
+ERROR_SAMPLE_LIMIT = 50
+
+DUPLICATE_KEY_ERROR = 11000
+
+JOBS_COLLECTION = "code_import_jobs"
+DOCUMENT_EXTENSIONS = (".txt", ".csv")
+# حد تنزيل الملفات في Bot API
+MAX_DOCUMENT_SIZE = 20 * 1024 * 1024
+CSV_DELIMITERS = ",;\t"
+CSV_HEADERS = {"code", "codes", "كود", "الكود", "الأكواد"}
+
+# نتيجة open_job
+JOB_NEW = "new"
+JOB_RESUMED = "resumed"
+JOB_RUNNING = "running"
+
+# (رقم السطر، رسالة الخطأ)
+Error = Tuple[int, str]
+
+
+class ParsedCode:
+    """كود صالح مع رقم سطره في النص الأصلي"""
+
+    __slots__ = ("line", "code", "serial")
+
+    def __init__(self, line: int, code: str, serial: Optional[str]):
+        self.line = line
+        self.code = code
+        self.serial = serial
+
+
+class ImportResult:
+    """نتيجة الاستيراد: عدد المضاف والمرفوض وعينة من الأخطاء (رقم السطر، الرسالة)"""
+
+    def __init__(self, inserted: int = 0, rejected: int = 0, errors: Optional[List[Error]] = None, lines: int = 0):
+        self.inserted = inserted
+        self.rejected = rejected
+        self.lines = lines
+        self.errors: List[Error] = [tuple(error) for error in errors or []]
+
+    def add_errors(self, errors: List[Error]):
+        self.rejected += len(errors)
+        room = ERROR_SAMPLE_LIMIT - len(self.errors)
+        if room > 0:
+            self.errors.extend(errors[:room])
+
+    def error_lines(self, limit: int = 5) -> List[str]:
+        """أول الأخطاء مرتبة حسب رقم السطر للعرض"""
+        return [f"سطر {line}: {message}" for line, message in sorted(self.errors)[:limit]]
+
+
+def parse_line(line: str, code_type: str) -> Tuple[Optional[Tuple[str, Optional[str]]], Optional[str]]:
+    """
+    تحليل سطر واحد
+
+    Returns:
+        tuple: ((الكود، السيريال)، None) للسطر الصالح أو (None، رسالة الخطأ)
+    """
+    if code_type != "dual":
+        return (line, None), None
+    if '|' not in line:
+        return None, f"خطأ في التنسيق: {line} - يجب استخدام | للفصل"
+    code_part, serial_part = (part.strip() for part in line.split('|', 1))
+    if not code_part or not serial_part:
+        return None, f"كود أو سيريال فارغ: {line}"
+    return (code_part, serial_part), None
+
+
+def parse_codes(lines: Iterable[Tuple[int, str]], code_type: str) -> Tuple[List[ParsedCode], List[Error]]:
+    """
+    تحليل دفعة أسطر (رقم السطر، النص) مع حذف الأسطر الفارغة والتكرار داخل الدفعة
+
+    Returns:
+        tuple: (الأكواد الصالحة، الأخطاء)
+    """
+    entries: List[ParsedCode] = []
+    errors: List[Error] = []
+    first_seen = {}
+    for number, raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        parsed, error = parse_line(line, code_type)
+        if error:
+            errors.append((number, error))
+            continue
+        code, serial = parsed
+        if code in first_seen:
+            errors.append((number, f"الكود مكرر في نفس الدفعة (السطر {first_seen[code]}): {code}"))
+            continue
+        first_seen[code] = number
+        entries.append(ParsedCode(number, code, serial))
+    return entries, errors
+
+
+def csv_line(line: str, code_type: str) -> str:
+    """
+    تحويل صف CSV لصيغة النص: العمود الأول كود، والثاني سيريال للنوع dual فقط (code|serial)
+
+    الفاصل أول ما يظهر من , ; أو Tab
+    """
+    delimiter = next((char for char in CSV_DELIMITERS if char in line), None)
+    if delimiter is None:
+        return line
+    cells = [cell.strip() for cell in next(csv.reader([line], delimiter=delimiter))]
+    if not cells:
+        return ""
+    if code_type == "dual" and len(cells) > 1 and cells[1]:
+        return f"{cells[0]}|{cells[1]}"
+    return cells[0]
+
+
+async def insert_chunk(db, category_id: str, entries: List[ParsedCode],
+                       build: Callable[[ParsedCode], dict]) -> Tuple[int, List[Error]]:
+    """
+    كتابة دفعة أكواد بعملية insert_many واحدة غير مرتبة
+
+    العملية غير المرتبة تكمل باقي الدفعة عند فشل بعض المستندات، والفشل يُعاد لأرقام الأسطر
+
+    Returns:
+        tuple: (عدد المضاف، الأخطاء)
+    """
+    if not entries:
+        return 0, []
+    documents = [build(entry) for entry in entries]
+    try:
+        result = await db.codes.insert_many(documents, ordered=False)
+        inserted, errors = len(result.inserted_ids), []
+    except BulkWriteError as e:
+        inserted = e.details.get("nInserted", 0)
+        errors = []
+        for write_error in e.details.get("writeErrors", []):
+            entry = entries[write_error["index"]]
+            if write_error.get("code") == DUPLICATE_KEY_ERROR:
+                errors.append((entry.line, f"الكود موجود مسبقاً: {entry.code}"))
+            else:
+                errors.append((entry.line, f"خطأ في حفظ: {entry.code} - {write_error.get('errmsg', '')}"))
+
+    await adjust_stock(db, category_id, added=inserted)
+    return inserted, errors
+
+
+async def _write_batch(db, category_id: str, code_type: str, batch: List[Tuple[int, str]],
+                       build: Callable[[ParsedCode], dict], result: ImportResult):
+    """تحليل وكتابة دفعة أسطر وتحديث النتيجة"""
+    entries, errors = parse_codes(batch, code_type)
+    inserted, write_errors = await insert_chunk(db, category_id, entries, build)
+    result.inserted += inserted
+    result.add_errors(sorted(errors + write_errors))
+    result.lines = batch[-1][0]
+
+
+def _record(source: str, category_id: str, result: ImportResult, elapsed: float):
+    metrics.histogram("code_import_seconds", source=source).observe(elapsed)
+    metrics.counter("code_import_codes_total", source=source).inc(result.inserted)
+    logger.info(
+        f"Code import ({source}) into {category_id}: {result.inserted} inserted, {result.rejected} rejected "
+        f"out of {result.lines} lines in {elapsed * 1000:.0f}ms"
+    )
+
+
+# (المنجز، الإجمالي، عدد المضاف) - أسطر للنص الملصوق وبايتات للملفات
+ProgressCallback = Callable[[int, int, int], Awaitable]
+
+
+async def import_codes(db, category_id: str, code_type: str, text: str, build: Callable[[ParsedCode], dict],
+                       on_progress: Optional[ProgressCallback] = None,
+                       chunk_size: int = CODE_IMPORT_CHUNK_SIZE) -> ImportResult:
+    """
+    استيراد نص ملصوق كامل (سطر لكل كود، أو code|serial للنوع dual)
+
+    Args:
+        build: إنشاء مستند الكود من ParsedCode (نموذج Code في server.py)
+        on_progress: يُستدعى بعد كل دفعة بـ (الأسطر المعالجة، إجمالي الأسطر، عدد المضاف)
+    """
+    start = time.perf_counter()
+    result = ImportResult()
+    lines = text.split('\n')
+
+    for offset in range(0, len(lines), chunk_size):
+        batch = list(enumerate(lines[offset:offset + chunk_size], offset + 1))
+        await _write_batch(db, category_id, code_type, batch, build, result)
+        if on_progress is not None:
+            await on_progress(result.lines, len(lines), result.inserted)
+
+    _record("paste", category_id, result, time.perf_counter() - start)
+    return result
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, str, int]]:
+    """
+    تقسيم تدفق بايتات UTF-8 لأسطر مرقمة دون تحميله كاملاً (BOM و CRLF مدعومان)
+
+    Yields:
+        tuple: (رقم السطر، النص، البايتات المستلمة حتى الآن)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    number = 0
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            yield number, line.rstrip('\r'), received
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield number + 1, pending.rstrip('\r'), received
+
+
+def job_id(category_id: str, file_unique_id: str) -> str:
+    """معرف المهمة: نفس الملف لنفس الفئة يُكمل نفس المهمة"""
+    return f"{category_id}:{file_unique_id}"
+
+
+async def open_job(db, category_id: str, category_name: str, code_type: str, telegram_id: int,
+                   file_id: str, file_unique_id: str, file_name: str, file_size: int) -> Tuple[dict, str]:
+    """
+    إنشاء مهمة استيراد ملف، أو استئناف مهمة فاشلة لنفس الملف
+
+    المهمة running لا تُستأنف هنا (يستأنفها بدء التشغيل فقط) حتى لا تعمل مهمتان على نفس السجل
+
+    Returns:
+        tuple: (مستند المهمة، JOB_NEW أو JOB_RESUMED أو JOB_RUNNING)
+    """
+    now = datetime.now(timezone.utc)
+    identifier = job_id(category_id, file_unique_id)
+    existing = await db[JOBS_COLLECTION].find_one({"id": identifier}, {"_id": 0})
+    if existing and existing["status"] == "running":
+        return existing, JOB_RUNNING
+    if existing and existing["status"] == "failed" and existing["code_type"] == code_type:
+        # file_id قد يتغير بين الرفعات، لذلك يُحدث مع المستخدم الذي يستلم التقدم
+        changes = {"file_id": file_id, "telegram_id": telegram_id, "status": "running", "updated_at": now}
+        claimed = await db[JOBS_COLLECTION].update_one({"id": identifier, "status": "failed"}, {"$set": changes})
+        if not claimed.modified_count:
+            return existing, JOB_RUNNING
+        existing.update(changes)
+        return existing, JOB_RESUMED
+
+    job = {
+        "id": identifier,
+        "category_id": category_id,
+        "category_name": category_name,
+        "code_type": code_type,
+        "telegram_id": telegram_id,
+        "file_id": file_id,
+        "file_name": file_name,
+        "file_size": file_size,
+        "status": "running",
+        "committed_line": 0,
+        "inserted": 0,
+        "rejected": 0,
+        "errors": [],
+        "created_at": now,
+        "updated_at": now
+    }
+    await db[JOBS_COLLECTION].replace_one({"id": identifier}, job, upsert=True)
+    return job, JOB_NEW
+
+
+async def fail_job(db, identifier: str):
+    """تعليم المهمة failed حتى تُستأنف بإعادة رفع الملف"""
+    await db[JOBS_COLLECTION].update_one({"id": identifier}, {"$set": {
+        "status": "failed", "updated_at": datetime.now(timezone.utc)
+    }})
+
+
+async def running_jobs(db) -> List[dict]:
+    """المهام التي انقطعت أثناء التنفيذ (تُستأنف عند بدء التشغيل)"""
+    return await db[JOBS_COLLECTION].find({"status": "running"}, {"_id": 0}).to_list(None)
+
+
+async def import_stream(db, job: dict, chunks: AsyncIterable[bytes], build: Callable[[ParsedCode], dict],
+                        on_progress: Optional[ProgressCallback] = None,
+                        chunk_size: int = CODE_IMPORT_CHUNK_SIZE) -> ImportResult:
+    """
+    استيراد ملف من تدفق بايتات مع حفظ التقدم في مهمته بعد كل دفعة
+
+    الأسطر حتى committed_line تُتخطى (استئناف). عند الفشل تُعلَّم المهمة failed ويُعاد الاستثناء،
+    وعند الإلغاء (إيقاف الخادم) تبقى running لتُستأنف عند التشغيل التالي
+
+    Args:
+        on_progress: يُستدعى بعد كل دفعة بـ (البايتات المستلمة، حجم الملف، عدد المضاف)
+    """
+    start = time.perf_counter()
+    jobs = db[JOBS_COLLECTION]
+    category_id, code_type = job["category_id"], job["code_type"]
+    committed = job["committed_line"]
+    result = ImportResult(job["inserted"], job["rejected"], job["errors"], committed)
+    is_csv = job["file_name"].lower().endswith(".csv")
+
+    async def commit(batch: List[Tuple[int, str]], received: int):
+        await _write_batch(db, category_id, code_type, batch, build, result)
+        await jobs.update_one({"id": job["id"]}, {"$set": {
+            "committed_line": result.lines,
+            "inserted": result.inserted,
+            "rejected": result.rejected,
+            "errors": [list(error) for error in result.errors],
+            "updated_at": datetime.now(timezone.utc)
+        }})
+        if on_progress is not None:
+            await on_progress(received, job["file_size"], result.inserted)
+
+    try:
+        batch: List[Tuple[int, str]] = []
+        received = 0
+        async for number, line, received in iter_lines(chunks):
+            if number <= committed:
+                continue
+            if is_csv:
+                line = csv_line(line, code_type)
+                if number == 1 and line.split('|', 1)[0].strip().lower() in CSV_HEADERS:
+                    continue
+            batch.append((number, line))
+            if len(batch) >= chunk_size:
+                await commit(batch, received)
+                batch = []
+        if batch:
+            await commit(batch, received)
+    except Exception as e:
+        await fail_job(db, job["id"])
+        logger.error(f"Code import job {job['id']} failed after line {result.lines}: {type(e).__name__}")
+        raise
+
+    await jobs.update_one({"id": job["id"]}, {"$set": {
+        "status": "done", "updated_at": datetime.now(timezone.utc)
+    }})
+    _record("document", category_id, result, time.perf_counter() - start)
+    return result
+
+
+class ProgressMessage:
+    """رسالة تقدم واحدة تُرسل مرة ثم تُعدل، بحد أدنى PROGRESS_INTERVAL بين التعديلات"""
+
+    def __init__(self, send: Callable[[str], Awaitable], edit: Callable[[object, str], Awaitable],
+                 interval: float = PROGRESS_INTERVAL):
+        self.send = send
+        self.edit = edit
+        self.interval = interval
+        self._message = None
+        self._updated_at = 0.0
+        self._text = None
+
+    async def update(self, text: str, force: bool = False):
+        now = time.monotonic()
+        if text == self._text:
+            return
+        # بعد أول محاولة: لا إعادة إرسال إذا فشل الإرسال، ولا تعديل قبل انقضاء الفاصل
+        if self._updated_at and (self._message is None or (not force and now - self._updated_at < self.interval)):
+            return
+        try:
+            if self._message is None:
+                self._message = await self.send(text)
+            else:
+                await self.edit(self._message, text)
+            self._text = text
+        except Exception as e:
+            # فشل عرض التقدم لا يوقف الاستيراد
+            logger.warning(f"Progress message update failed: {e}")
+        self._updated_at = now
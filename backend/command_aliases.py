@@ -0,0 +1,97 @@
+"""
+Command Aliases - جدول الأوامر والاختصارات النصية
+مطابقة نص الرسالة مع الأمر المقصود بعملية بحث واحدة في dict بدلاً من سلسلة قوائم text.lower() in [...]
+
+- الجدول يُبنى مرة واحدة عند الاستيراد من aliases_config.py (إضافة مرادف جديد لا تحتاج تعديل الكود)
+- النص يُطبّع قبل البحث (text_normalize.py) مع حذف لاحقة اسم البوت في الأوامر (/start@MyBot)
+- كل مرادف له عداد text_alias_hits_total{bot, action, alias} في /api/metrics
+  (العدادات تُنشأ مع الجدول لذلك تظهر المرادفات غير المستخدمة بقيمة 0)
+
+الاستخدام:
+    user_aliases = AliasTable("user", USER_COMMANDS, USER_SHORTCUTS)
+    user_aliases.bind("shop", lambda message: handle_browse_products(message.chat_id))
+
+    alias = user_aliases.resolve(text)
+    if alias and alias.command:
+        await user_aliases.dispatch(alias, message)
+"""
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import metrics
+from text_normalize import normalize
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable]
+
+
+def normalize_text(text: str) -> str:
+    """تطبيع النص للمقارنة (يُطبق على المرادفات عند البناء وعلى الرسائل عند البحث)"""
+    text = normalize(text)
+    if text.startswith("/"):
+        command, _, rest = text.partition(" ")
+        command = command.split("@", 1)[0]
+        text = f"{command} {rest}" if rest else command
+    return text
+
+
+class Alias:
+    """مرادف واحد في الجدول"""
+
+    __slots__ = ("action", "alias", "command", "hits")
+
+    def __init__(self, action: str, alias: str, command: bool, hits: metrics.Counter):
+        self.action = action
+        self.alias = alias
+        # الأوامر تُنفذ قبل خطوات الإدخال المفتوحة، والاختصارات بعدها
+        self.command = command
+        self.hits = hits
+
+
+class AliasTable:
+    """جدول المرادفات النصية لبوت واحد"""
+
+    def __init__(self, name: str, commands: Dict[str, Iterable[str]], shortcuts: Optional[Dict[str, Iterable[str]]] = None):
+        self.name = name
+        self._aliases: Dict[str, Alias] = {}
+        self._handlers: Dict[str, Handler] = {}
+        self._add_all(commands, command=True)
+        self._add_all(shortcuts or {}, command=False)
+
+    def _add_all(self, table: Dict[str, Iterable[str]], command: bool):
+        for action, aliases in table.items():
+            for alias in aliases:
+                self.add(action, alias, command=command)
+
+    def add(self, action: str, alias: str, command: bool = False):
+        key = normalize_text(alias)
+        existing = self._aliases.get(key)
+        if existing is not None:
+            if existing.action != action:
+                raise ValueError(
+                    f"{self.name}: alias '{alias}' maps to both '{existing.action}' and '{action}'"
+                )
+            # نفس الأمر مسجل كأمر واختصار: يبقى التسجيل الأول (الأوامر تُسجل أولاً)
+            return
+        hits = metrics.counter("text_alias_hits_total", bot=self.name, action=action, alias=key)
+        self._aliases[key] = Alias(action, key, command, hits)
+
+    def bind(self, action: str, handler: Handler):
+        """ربط الأمر بمعالجه، ويُستدعى بـ (message)"""
+        self._handlers[action] = handler
+
+    def validate(self):
+        """فحص عند بدء التشغيل: كل أمر في الجدول له معالج"""
+        actions = {alias.action for alias in self._aliases.values()}
+        missing = sorted(actions - self._handlers.keys())
+        if missing:
+            raise ValueError(f"{self.name}: no handler bound for alias actions {missing}")
+        logger.info(f"Alias table '{self.name}': {len(self._aliases)} aliases for {len(actions)} actions")
+
+    def resolve(self, text: str) -> Optional[Alias]:
+        return self._aliases.get(normalize_text(text or ""))
+
+    async def dispatch(self, alias: Alias, message):
+        alias.hits.inc()
+        await self._handlers[alias.action](message)
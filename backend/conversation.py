@@ -0,0 +1,153 @@
+"""
+Conversation Machine - آلة حالات المحادثة
+جدول حالات لإدخال النصوص متعدد الخطوات (إضافة منتج، فئة، رصيد...) بدلاً من سلسلة if/elif على session.state
+
+- كل حالة لها معالج، ومحوّل/مدقق اختياري للنص، ومهلة (TTL) خاصة بها
+- الإرسال بحث مباشر في dict لذلك إضافة معالج جديد لا تزيد تكلفة باقي الرسائل
+- الانتقال بين الحالات يكتب الحقول المتغيرة فقط (state و data.<key>) عبر SessionStore.patch
+- الجلسة المتروكة بعد انتهاء مهلة حالتها تُحذف عند أول رسالة ولا يُكمل المعالج
+
+التسجيل بالمزخرفات:
+    admin_conversation = ConversationMachine("admin", admin_session_store, send_admin_message)
+
+    @admin_conversation.state("add_category_price", validate=parse_float, error="❌ يرجى إدخال رقم صحيح للسعر:")
+    async def handle_category_price_step(telegram_id: int, price: float, session: TelegramSession): ...
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_TTL = float(os.environ.get('CONVERSATION_STATE_TTL', '1800'))
+
+EXPIRED_MESSAGE = "⏰ انتهت مهلة العملية السابقة، يرجى البدء من جديد."
+
+Handler = Callable[..., Awaitable]
+Validator = Callable[[str], Any]
+
+
+def parse_int(text: str) -> int:
+    return int(text.strip())
+
+
+def parse_float(text: str) -> float:
+    return float(text.strip())
+
+
+class ConversationState:
+    """حالة واحدة في جدول المحادثة"""
+
+    __slots__ = ("name", "handler", "ttl", "validate", "error")
+
+    def __init__(self, name: str, handler: Handler, ttl: float, validate: Optional[Validator], error: Optional[str]):
+        self.name = name
+        self.handler = handler
+        self.ttl = ttl
+        self.validate = validate
+        self.error = error
+
+
+class ConversationMachine:
+    """جدول حالات الإدخال النصي لبوت واحد"""
+
+    def __init__(self, name: str, store, send: Callable[[int, str], Awaitable],
+                 default_ttl: Optional[float] = None, expired_message: str = EXPIRED_MESSAGE):
+        self.name = name
+        self.store = store
+        self.send = send
+        self.default_ttl = DEFAULT_STATE_TTL if default_ttl is None else default_ttl
+        self.expired_message = expired_message
+        self._states: Dict[str, ConversationState] = {}
+        self._expired = metrics.counter("conversation_expired_total", bot=name)
+        self._invalid = metrics.counter("conversation_invalid_input_total", bot=name)
+
+    def __contains__(self, state: str) -> bool:
+        return state in self._states
+
+    def add_state(self, name: str, handler: Handler, ttl: Optional[float] = None,
+                  validate: Optional[Validator] = None, error: Optional[str] = None):
+        if name in self._states:
+            raise ValueError(f"{self.name}: conversation state '{name}' registered twice")
+        self._states[name] = ConversationState(name, handler, self.default_ttl if ttl is None else ttl, validate, error)
+
+    def state(self, *names: str, ttl: Optional[float] = None, validate: Optional[Validator] = None,
+              error: Optional[str] = None):
+        """مزخرف: تسجيل المعالج لحالة أو أكثر، ويُستدعى بـ (telegram_id, القيمة بعد التحقق, session)"""
+        def decorator(handler: Handler) -> Handler:
+            for name in names:
+                self.add_state(name, handler, ttl=ttl, validate=validate, error=error)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _age(session) -> float:
+        updated_at = session.updated_at
+        if updated_at.tzinfo is None:
+            # القيم المقروءة من MongoDB بدون منطقة زمنية مخزنة بتوقيت UTC
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - updated_at).total_seconds()
+
+    def is_expired(self, session) -> bool:
+        state = self._states.get(session.state)
+        return state is not None and self._age(session) > state.ttl
+
+    async def handle(self, telegram_id: int, text: str, session) -> bool:
+        """
+        تمرير النص لمعالج حالة الجلسة
+
+        Returns:
+            bool: False إذا لم تكن للحالة معالج نصي أو انتهت مهلتها (ويُكمل المستدعي كأنه لا توجد جلسة)
+        """
+        state = self._states.get(session.state)
+        if state is None:
+            return False
+
+        if self._age(session) > state.ttl:
+            self.store.delete(telegram_id)
+            self._expired.inc()
+            logger.info(f"Conversation '{self.name}': state '{state.name}' expired for {telegram_id}")
+            if self.expired_message:
+                await self.send(telegram_id, self.expired_message)
+            return False
+
+        value = text
+        if state.validate is not None:
+            try:
+                value = state.validate(text)
+            except ValueError:
+                self._invalid.inc()
+                await self.send(telegram_id, state.error or "❌ قيمة غير صحيحة، يرجى المحاولة مرة أخرى:")
+                return True
+
+        start = time.perf_counter()
+        try:
+            await state.handler(telegram_id, value, session)
+        finally:
+            metrics.histogram("conversation_step_seconds", bot=self.name, state=state.name).observe(
+                time.perf_counter() - start
+            )
+        return True
+
+    async def transition(self, session, state: str, **data):
+        """
+        الانتقال لحالة جديدة مع حفظ الحقول المتغيرة فقط
+
+        Args:
+            session: الجلسة الحالية (تُحدث في الذاكرة أيضاً)
+            state: الحالة التالية
+            data: مفاتيح تُضاف أو تُستبدل في session.data
+        """
+        now = datetime.now(timezone.utc)
+        session.state = state
+        session.updated_at = now
+        session.data.update(data)
+
+        fields = {"state": state, "updated_at": now}
+        for key, value in data.items():
+            fields[f"data.{key}"] = value
+        self.store.patch(session.telegram_id, fields)
@@ -0,0 +1,264 @@
+"""
+Database Index Manifest - بيان فهارس قاعدة البيانات
+يطبق الفهارس المطلوبة لكل الاستعلامات الساخنة عند بدء التشغيل، ويتحقق من خطط التنفيذ
+
+الاستخدام من سطر الأوامر:
+    python db_indexes.py --apply    # تطبيق البيان
+    python db_indexes.py --check    # فحص الاستعلامات الساخنة (يفشل عند وجود COLLSCAN)
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+from update_dedup import DEFAULT_TTL_SECONDS as UPDATE_DEDUP_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# رقم إصدار البيان - يجب زيادته عند أي تعديل على INDEX_MANIFEST
+INDEX_MANIFEST_VERSION = 8
+
+# مجموعة تسجيل عمليات الترحيل المطبقة
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+# مدة بقاء الجلسات غير النشطة في قاعدة البيانات
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+
+# البيان: المجموعة -> قائمة الفهارس (المفاتيح + الخيارات)
+INDEX_MANIFEST = {
+    "users": [
+        {"keys": [("telegram_id", ASCENDING)]},
+        {"keys": [("id", ASCENDING)]},
+    ],
+    "user_sessions": [
+        {"keys": [("telegram_id", ASCENDING)]},
+        # v3: حذف الجلسات غير النشطة تلقائياً بعد 7 أيام
+        {"keys": [("updated_at", ASCENDING)], "expireAfterSeconds": SESSION_TTL_SECONDS},
+    ],
+    "admin_sessions": [
+        {"keys": [("telegram_id", ASCENDING)]},
+        {"keys": [("updated_at", ASCENDING)], "expireAfterSeconds": SESSION_TTL_SECONDS},
+    ],
+    "products": [
+        {"keys": [("id", ASCENDING)]},
+        {"keys": [("is_active", ASCENDING)]},
+    ],
+    "categories": [
+        {"keys": [("id", ASCENDING)]},
+        {"keys": [("product_id", ASCENDING)]},
+        {"keys": [("delivery_type", ASCENDING)]},
+    ],
+    "codes": [
+        # يخدم البحث عن كود متاح مع ترتيب FIFO حسب تاريخ الإضافة
+        {"keys": [("category_id", ASCENDING), ("is_used", ASCENDING), ("created_at", ASCENDING)]},
+        {"keys": [("id", ASCENDING)]},
+        # v6: يمنع تكرار الكود داخل الفئة، ويغني استيراد الأكواد عن find_one لكل سطر (انظر code_import.py)
+        {"keys": [("category_id", ASCENDING), ("code", ASCENDING)], "unique": True},
+    ],
+    "orders": [
+        {"keys": [("id", ASCENDING)]},
+        {"keys": [("telegram_id", ASCENDING), ("order_date", DESCENDING)]},
+        {"keys": [("telegram_id", ASCENDING), ("status", ASCENDING), ("order_date", DESCENDING)]},
+        {"keys": [("status", ASCENDING), ("order_date", DESCENDING)]},
+        {"keys": [("order_date", DESCENDING)]},
+        {"keys": [("order_number", ASCENDING)]},
+        {"keys": [("user_internal_id", ASCENDING)]},
+        # v5: بحث الإدارة بالاسم (order_search.py) - بدون تجذير لغوي لأن MongoDB لا يدعم العربية
+        {"keys": [("product_name", TEXT), ("category_name", TEXT)], "name": "orders_text", "default_language": "none"},
+    ],
+    "payment_methods": [
+        {"keys": [("id", ASCENDING)]},
+    ],
+    # v2: سجل التحديثات المستلمة (منع التكرار في وضع mongo) - حذف تلقائي بعد UPDATE_DEDUP_TTL
+    # v8: المدة من نفس إعداد update_dedup.py (تغييرها يُطبق على الفهرس الموجود عبر collMod)
+    "processed_updates": [
+        {"keys": [("created_at", ASCENDING)], "expireAfterSeconds": int(UPDATE_DEDUP_TTL_SECONDS)},
+    ],
+    # v4: التجميعات اليومية (انظر rollups.py)
+    "orders_daily": [
+        {"keys": [("day", ASCENDING), ("category_id", ASCENDING), ("status", ASCENDING)], "unique": True},
+    ],
+    "users_daily": [
+        {"keys": [("day", ASCENDING)], "unique": True},
+    ],
+    # v7: مهام استيراد ملفات الأكواد (انظر code_import.py)
+    "code_import_jobs": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING)]},
+    ],
+}
+
+# أشكال الاستعلامات الساخنة التي يجب أن تُخدم بفهرس (المجموعة، الفلتر، الترتيب)
+HOT_QUERY_SHAPES = [
+    ("users", {"telegram_id": 0}, None),
+    ("user_sessions", {"telegram_id": 0}, None),
+    ("admin_sessions", {"telegram_id": 0}, None),
+    ("products", {"id": ""}, None),
+    ("products", {"is_active": True}, None),
+    ("categories", {"id": ""}, None),
+    ("categories", {"product_id": ""}, None),
+    ("categories", {"delivery_type": "code"}, None),
+    ("codes", {"category_id": "", "is_used": False}, [("created_at", ASCENDING)]),
+    ("codes", {"id": ""}, None),
+    ("code_import_jobs", {"id": ""}, None),
+    ("orders", {"id": ""}, None),
+    ("orders", {"telegram_id": 0}, [("order_date", DESCENDING)]),
+    ("orders", {"telegram_id": 0, "status": "completed"}, [("order_date", DESCENDING)]),
+    ("orders", {"status": "pending"}, [("order_date", DESCENDING)]),
+    ("orders", {"status": "pending", "order_date": {"$lt": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("orders", {"order_date": {"$gte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("orders", {"order_number": ""}, None),
+    ("orders", {"user_internal_id": ""}, None),
+    ("orders", {"order_number": {"$regex": "^AC2024"}}, [("order_date", DESCENDING)]),
+    ("orders", {"id": {"$regex": "^abcd1234"}}, [("order_date", DESCENDING)]),
+    ("orders", {"$text": {"$search": "x"}}, [("order_date", DESCENDING)]),
+    ("payment_methods", {"id": ""}, None),
+]
+
+
+def _normalize_keys(keys) -> tuple:
+    """تحويل مفاتيح الفهرس لصيغة قابلة للمقارنة"""
+    return tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in keys)
+
+
+async def plan_index_manifest(db) -> list:
+    """
+    حساب الفهارس الناقصة مقارنة بالبيان (بدون تنفيذ)
+
+    Returns:
+        list: (المجموعة، المواصفة، اسم الفهرس الموجود) - الاسم يُملأ فقط لفهرس TTL موجود بمدة مختلفة
+    """
+    plan = []
+    for collection_name, specs in INDEX_MANIFEST.items():
+        existing = await db[collection_name].index_information()
+        existing_by_keys = {_normalize_keys(info["key"]): (name, info) for name, info in existing.items()}
+
+        for spec in specs:
+            # فهارس النص تُخزن بمفاتيح داخلية (_fts) لذلك تُقارن بالاسم
+            if spec.get("name") in existing:
+                continue
+            found = existing_by_keys.get(_normalize_keys(spec["keys"]))
+            if found is None:
+                plan.append((collection_name, spec, None))
+                continue
+            # الفهارس تُقارن بالمفاتيح، لذلك تغيير مدة TTL يحتاج collMod بدلاً من إنشاء فهرس
+            name, info = found
+            ttl = spec.get("expireAfterSeconds")
+            if ttl is not None and info.get("expireAfterSeconds") != ttl:
+                plan.append((collection_name, spec, name))
+    return plan
+
+
+async def apply_index_manifest(db) -> list:
+    """
+    تطبيق بيان الفهارس بشكل آمن للتكرار (idempotent)
+
+    يتم إنشاء الفهارس الناقصة فقط وفي الخلفية، وتعديل مدة فهارس TTL الموجودة، ويُسجل الإصدار المطبق في schema_migrations
+
+    Returns:
+        list: الفهارس التي تم إنشاؤها
+    """
+    plan = await plan_index_manifest(db)
+
+    if not plan:
+        logger.info(f"Index manifest v{INDEX_MANIFEST_VERSION}: all indexes present, nothing to do")
+    else:
+        logger.info(f"Index manifest v{INDEX_MANIFEST_VERSION}: applying {len(plan)} index(es)")
+
+    created = []
+    for collection_name, spec, existing_name in plan:
+        if existing_name is not None:
+            ttl = spec["expireAfterSeconds"]
+            try:
+                await db.command("collMod", collection_name, index={"name": existing_name, "expireAfterSeconds": ttl})
+                created.append(f"{collection_name}.{existing_name}")
+                logger.info(f"  ~ {collection_name}: {existing_name} expireAfterSeconds={ttl}")
+            except OperationFailure as e:
+                logger.error(f"  ! {collection_name}: failed to update TTL of {existing_name}: {e}")
+            continue
+        options = {key: value for key, value in spec.items() if key != "keys"}
+        options.setdefault("background", True)
+        try:
+            name = await db[collection_name].create_index(spec["keys"], **options)
+            created.append(f"{collection_name}.{name}")
+            logger.info(f"  + {collection_name}: {name}")
+        except OperationFailure as e:
+            # لا نوقف التطبيق بسبب فهرس واحد (مثلاً بيانات مكررة تمنع فهرس unique)
+            logger.error(f"  ! {collection_name}: failed to create index {spec['keys']}: {e}")
+
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": "indexes"},
+        {"$set": {
+            "version": INDEX_MANIFEST_VERSION,
+            "applied_at": datetime.now(timezone.utc),
+            "created": created
+        }},
+        upsert=True
+    )
+    return created
+
+
+def _find_collscan(plan_node) -> bool:
+    """البحث عن مرحلة COLLSCAN داخل خطة التنفيذ"""
+    if isinstance(plan_node, dict):
+        if plan_node.get("stage") == "COLLSCAN":
+            return True
+        return any(_find_collscan(value) for value in plan_node.values())
+    if isinstance(plan_node, list):
+        return any(_find_collscan(item) for item in plan_node)
+    return False
+
+
+async def check_query_plans(db) -> list:
+    """
+    تشغيل explain() على كل شكل استعلام ساخن
+
+    Returns:
+        list: الاستعلامات التي ما زالت تستخدم COLLSCAN
+    """
+    failures = []
+    for collection_name, query, sort in HOT_QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+
+        if _find_collscan(winning_plan):
+            failures.append((collection_name, query, sort))
+            logger.error(f"COLLSCAN: {collection_name} {query} sort={sort}")
+        else:
+            logger.info(f"OK: {collection_name} {query} sort={sort}")
+    return failures
+
+
+async def _main(argv: list) -> int:
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    try:
+        if "--apply" in argv or "--check" not in argv:
+            await apply_index_manifest(db)
+        if "--check" in argv:
+            failures = await check_query_plans(db)
+            if failures:
+                print(f"❌ {len(failures)} hot query shape(s) still use COLLSCAN")
+                return 1
+            print("✅ All hot query shapes are served by indexes")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
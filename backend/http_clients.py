@@ -0,0 +1,124 @@
+"""
+HTTP Clients - عملاء HTTP المشتركة
+عميل httpx واحد لكل خدمة خارجية مع اتصالات دائمة (keep-alive) و HTTP/2 عند توفر مكتبة h2،
+يُنشأ عند بدء التشغيل ويُغلق عند الإيقاف بدلاً من فتح اتصال TLS جديد في كل طلب
+"""
+import importlib.util
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _upstream_config(prefix: str, base_url: str, timeout: float, connect_timeout: float, max_connections: int) -> dict:
+    """إعدادات خدمة خارجية قابلة للتعديل من متغيرات البيئة (PREFIX_HTTP_*)"""
+    return {
+        "base_url": base_url,
+        "timeout": float(os.environ.get(f'{prefix}_HTTP_TIMEOUT', timeout)),
+        "connect_timeout": float(os.environ.get(f'{prefix}_HTTP_CONNECT_TIMEOUT', connect_timeout)),
+        "max_connections": int(os.environ.get(f'{prefix}_HTTP_MAX_CONNECTIONS', max_connections)),
+        "max_keepalive": int(os.environ.get(f'{prefix}_HTTP_MAX_KEEPALIVE', max_connections)),
+        "keepalive_expiry": float(os.environ.get(f'{prefix}_HTTP_KEEPALIVE_EXPIRY', 60)),
+    }
+
+
+UPSTREAMS = {
+    # رفع الصور (التقارير) وتنزيل الملفات عبر Bot API
+    "telegram": _upstream_config("TELEGRAM", "https://api.telegram.org", 30.0, 5.0, 20),
+    "ammer_pay": _upstream_config("AMMER_PAY", "https://api.ammer.group", 15.0, 5.0, 10),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    config = UPSTREAMS[name]
+    return httpx.AsyncClient(
+        base_url=config["base_url"],
+        http2=HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive"],
+            keepalive_expiry=config["keepalive_expiry"]
+        )
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """العميل المشترك لخدمة خارجية (يُنشأ عند أول استخدام إذا لم يتم تشغيله مسبقاً)"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _clients[name] = client
+    return client
+
+
+async def start_http_clients():
+    """إنشاء كل العملاء عند بدء التشغيل"""
+    for name in UPSTREAMS:
+        get_client(name)
+    logger.info(f"HTTP clients started: {', '.join(UPSTREAMS)} (http2={HTTP2_AVAILABLE})")
+
+
+async def close_http_clients():
+    """إغلاق كل العملاء عند الإيقاف"""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing HTTP client '{name}': {e}")
+    _clients.clear()
+
+
+def _timing_trace(upstream: str):
+    """تسجيل زمن الاتصال و TLS عبر امتداد trace في httpcore"""
+    started = {}
+
+    async def trace(event_name: str, info: dict):
+        if event_name.endswith(".started"):
+            started[event_name[:-len(".started")]] = time.perf_counter()
+        elif event_name.endswith(".complete"):
+            step = event_name[:-len(".complete")]
+            if step not in started:
+                return
+            elapsed = time.perf_counter() - started.pop(step)
+            if step == "connection.connect_tcp":
+                metrics.histogram("http_connect_seconds", upstream=upstream).observe(elapsed)
+                metrics.counter("http_new_connections_total", upstream=upstream).inc()
+            elif step == "connection.start_tls":
+                metrics.histogram("http_tls_seconds", upstream=upstream).observe(elapsed)
+
+    return trace
+
+
+async def request(upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """تنفيذ طلب عبر العميل المشترك مع تسجيل أزمنة الاتصال والطلب"""
+    extensions = dict(kwargs.pop("extensions", None) or {})
+    extensions["trace"] = _timing_trace(upstream)
+
+    start = time.perf_counter()
+    try:
+        return await get_client(upstream).request(method, url, extensions=extensions, **kwargs)
+    finally:
+        metrics.histogram("http_request_seconds", upstream=upstream).observe(time.perf_counter() - start)
+
+
+async def stream_bytes(upstream: str, url: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """تنزيل استجابة على أجزاء دون تحميلها كاملة في الذاكرة (ملفات كبيرة)"""
+    start = time.perf_counter()
+    try:
+        async with get_client(upstream).stream("GET", url, extensions={"trace": _timing_trace(upstream)}) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+    finally:
+        metrics.histogram("http_request_seconds", upstream=upstream).observe(time.perf_counter() - start)
@@ -0,0 +1,298 @@
+"""
+Code Inventory - مخزون الأكواد
+حجز الأكواد بشكل ذري في رحلة واحدة لقاعدة البيانات لمنع تسليم نفس الكود لمشتريين،
+وإحصائيات المخزون لكل الفئات من عدادات محدّثة تدريجياً (inventory_counters)
+
+- العدادات تزداد عند استيراد الأكواد وتنقص مع كل كود يُحجز (في نفس المعاملة عند الشراء)
+- مطابقة دورية مع العد الفعلي لمجموعة codes لتصحيح أي انحراف
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_COLLECTION = "inventory_counters"
+DEFAULT_STATS_TTL = float(os.environ.get('INVENTORY_STATS_TTL', '10'))
+DEFAULT_RECONCILE_INTERVAL = float(os.environ.get('INVENTORY_RECONCILE_INTERVAL', '300'))
+
+# حدود حالة المخزون المستخدمة في لوحة الإدارة والواجهة
+LOW_STOCK_THRESHOLD = 5
+MEDIUM_STOCK_THRESHOLD = 10
+
+
+async def allocate_code(db, category_id: str, used_by, order_id: Optional[str] = None, session=None) -> Optional[dict]:
+    """
+    حجز أقدم كود متاح في الفئة (FIFO حسب created_at) بعملية find_one_and_update واحدة
+    وإنقاص عداد المخزون للفئة في نفس الجلسة (نفس المعاملة عند الشراء)
+
+    Args:
+        db: قاعدة البيانات
+        category_id: معرف الفئة
+        used_by: معرف المستخدم الذي سيستلم الكود
+        order_id: معرف الطلب المرتبط (اختياري)
+        session: جلسة MongoDB عند التنفيذ داخل معاملة (اختياري)
+
+    Returns:
+        dict: الكود بعد حجزه، أو None إذا نفد المخزون
+    """
+    update = {
+        "is_used": True,
+        "used_by": used_by,
+        "used_at": datetime.now(timezone.utc)
+    }
+    if order_id:
+        update["order_id"] = order_id
+
+    code = await db.codes.find_one_and_update(
+        {"category_id": category_id, "is_used": False},
+        {"$set": update},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if code:
+        await adjust_stock(db, category_id, used=1, session=session)
+    return code
+
+
+async def claim_code(db, code_id: str, used_by, order_id: Optional[str] = None, session=None) -> Optional[dict]:
+    """
+    حجز كود محدد بشرط أنه غير مستخدم
+
+    Returns:
+        dict: الكود بعد حجزه، أو None إذا كان غير موجود أو مستخدماً بالفعل
+    """
+    update = {
+        "is_used": True,
+        "used_by": used_by,
+        "used_at": datetime.now(timezone.utc)
+    }
+    if order_id:
+        update["order_id"] = order_id
+
+    code = await db.codes.find_one_and_update(
+        {"id": code_id, "is_used": False},
+        {"$set": update},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if code:
+        await adjust_stock(db, code.get("category_id"), used=1, session=session)
+    return code
+
+
+async def release_code(db, code: dict, session=None):
+    """إعادة كود محجوز للمخزون (عند التراجع عن عملية شراء فاشلة)"""
+    result = await db.codes.update_one(
+        {"id": code["id"], "is_used": True},
+        {"$set": {"is_used": False}, "$unset": {"used_by": "", "used_at": "", "order_id": ""}},
+        session=session
+    )
+    if result.modified_count:
+        await adjust_stock(db, code.get("category_id"), used=-1, session=session)
+
+
+async def adjust_stock(db, category_id: str, added: int = 0, used: int = 0, session=None):
+    """
+    تعديل عداد المخزون لفئة بعملية $inc واحدة
+
+    Args:
+        added: عدد الأكواد الجديدة المضافة للفئة
+        used: عدد الأكواد التي تم حجزها (قيمة سالبة عند إعادة كود للمخزون)
+    """
+    if not category_id or (not added and not used):
+        return
+    await db[COUNTERS_COLLECTION].update_one(
+        {"_id": category_id},
+        {
+            "$inc": {"total": added, "used": used, "available": added - used},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        },
+        upsert=True,
+        session=session
+    )
+
+
+def empty_stock() -> dict:
+    return {"total": 0, "used": 0, "available": 0}
+
+
+class InventoryService:
+    """إحصائيات المخزون لكل الفئات من عدادات inventory_counters مع ذاكرة قصيرة المدة ومطابقة دورية"""
+
+    def __init__(self, db, ttl: Optional[float] = None, reconcile_interval: Optional[float] = None):
+        self.db = db
+        self.ttl = DEFAULT_STATS_TTL if ttl is None else ttl
+        self.reconcile_interval = reconcile_interval or DEFAULT_RECONCILE_INTERVAL
+        self._levels: Optional[Dict[str, dict]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # انحرافات رُصدت في المطابقة السابقة ولم تُصحح بعد: category_id -> الفرق
+        self._suspected_drift: Dict[str, tuple] = {}
+
+        self._query_time = metrics.histogram("inventory_stats_seconds")
+        self._hits = metrics.counter("inventory_stats_total", result="hit")
+        self._misses = metrics.counter("inventory_stats_total", result="miss")
+        self._corrections = metrics.counter("inventory_counter_corrections_total")
+        self._reconcile_time = metrics.histogram("inventory_reconcile_seconds")
+
+    async def _read_counters(self) -> Dict[str, dict]:
+        levels: Dict[str, dict] = {}
+        async for row in self.db[COUNTERS_COLLECTION].find({}):
+            levels[row["_id"]] = {
+                "total": row.get("total", 0),
+                "used": row.get("used", 0),
+                "available": row.get("available", 0)
+            }
+        return levels
+
+    async def _aggregate(self) -> Dict[str, dict]:
+        """العد الفعلي من مجموعة codes (للمطابقة فقط)"""
+        pipeline = [
+            {"$group": {
+                "_id": {"category_id": "$category_id", "is_used": "$is_used"},
+                "count": {"$sum": 1}
+            }}
+        ]
+        levels: Dict[str, dict] = {}
+        async for row in self.db.codes.aggregate(pipeline):
+            stock = levels.setdefault(row["_id"].get("category_id"), empty_stock())
+            stock["total"] += row["count"]
+            if row["_id"].get("is_used"):
+                stock["used"] += row["count"]
+            else:
+                stock["available"] += row["count"]
+        return levels
+
+    async def stock_levels(self) -> Dict[str, dict]:
+        """
+        مستوى المخزون لكل فئة
+
+        Returns:
+            dict: category_id -> {"total", "used", "available"}
+        """
+        if self._levels is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self._hits.inc()
+            return self._levels
+
+        async with self._lock:
+            # ربما حدّثها طلب آخر أثناء انتظار القفل
+            if self._levels is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self._hits.inc()
+                return self._levels
+
+            self._misses.inc()
+            start = time.perf_counter()
+            self._levels = await self._read_counters()
+            self._loaded_at = time.monotonic()
+            self._query_time.observe(time.perf_counter() - start)
+            return self._levels
+
+    async def get(self, category_id: str) -> dict:
+        """مستوى المخزون لفئة واحدة"""
+        return (await self.stock_levels()).get(category_id, empty_stock())
+
+    def invalidate(self):
+        """إبطال الإحصائيات (بعد إضافة أو حذف أكواد)"""
+        self._levels = None
+
+    def stats(self) -> dict:
+        """نسبة الإصابة في ذاكرة الإحصائيات"""
+        hits, misses = self._hits.value, self._misses.value
+        total = hits + misses
+        return {"hit_ratio": round(hits / total, 4) if total else 0.0, "db_reads": misses}
+
+    async def reconcile(self) -> int:
+        """
+        مطابقة العدادات مع العد الفعلي وتصحيح الانحراف
+
+        العداد المفقود يُنشأ فوراً، أما الانحراف في عداد موجود فلا يُصحح إلا إذا تكرر بنفس القيمة
+        في مطابقتين متتاليتين، حتى لا نُفسد عداداً صحيحاً بسبب عملية شراء تمت بين القراءتين
+
+        Returns:
+            int: عدد العدادات التي تم تصحيحها
+        """
+        start = time.perf_counter()
+        counters = await self._read_counters()
+        actual = await self._aggregate()
+
+        corrected = 0
+        suspected: Dict[str, tuple] = {}
+        for category_id in set(counters) | set(actual):
+            if category_id is None:
+                continue
+            real = actual.get(category_id, empty_stock())
+            counter = counters.get(category_id)
+            if counter == real:
+                continue
+
+            drift = tuple(real[key] - (counter or empty_stock())[key] for key in ("total", "used", "available"))
+            if counter is not None and self._suspected_drift.get(category_id) != drift:
+                suspected[category_id] = drift
+                continue
+
+            await self.db[COUNTERS_COLLECTION].update_one(
+                {"_id": category_id},
+                {
+                    "$inc": dict(zip(("total", "used", "available"), drift)),
+                    "$set": {"updated_at": datetime.now(timezone.utc), "reconciled_at": datetime.now(timezone.utc)}
+                },
+                upsert=True
+            )
+            corrected += 1
+            logger.warning(f"Inventory counter drift corrected for category {category_id}: {counter} -> {real}")
+
+        self._suspected_drift = suspected
+        self._corrections.inc(corrected)
+        self._reconcile_time.observe(time.perf_counter() - start)
+        if corrected:
+            self.invalidate()
+        return corrected
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Inventory reconcile failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            try:
+                # إنشاء العدادات الناقصة (أول تشغيل أو فئات قديمة)
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Initial inventory reconcile failed: {e}")
+            self._task = asyncio.create_task(self._reconcile_loop(), name="inventory-reconcile")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def category_in_stock(category: dict, stock_levels: Dict[str, dict]) -> bool:
+    """هل الفئة متاحة للشراء؟ فئات التسليم بالكود تعتمد على المخزون، والباقي يُنفذ يدوياً"""
+    if category.get("delivery_type", "code") != "code":
+        return True
+    return stock_levels.get(category["id"], {}).get("available", 0) > 0
+
+
+def stock_status(available: int) -> str:
+    """تصنيف مستوى المخزون: low / medium / good"""
+    if available <= LOW_STOCK_THRESHOLD:
+        return "low"
+    if available <= MEDIUM_STOCK_THRESHOLD:
+        return "medium"
+    return "good"
@@ -0,0 +1,208 @@
+"""
+Metrics Registry - سجل مقاييس الأداء
+عدادات ومدرجات زمنية داخل الذاكرة مع حساب p50/p99 لعرضها عبر /api/metrics (JSON أو صيغة Prometheus)
+
+التسجيل في المسار الساخن مجرد عمليات على الذاكرة (زيادة رقم، إضافة عينة، بحث ثنائي في الحدود)،
+وكل الحسابات الثقيلة (ترتيب العينات، التنسيق) تتم فقط عند قراءة المقاييس
+"""
+import re
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Tuple
+
+# عدد العينات المحفوظة لكل مدرج لحساب النسب المئوية
+DEFAULT_MAX_SAMPLES = 2048
+
+# حدود خانات المدرجات الزمنية بالثواني (صيغة Prometheus)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# حد أقصى لعدد أسماء المسارات المختلفة (حماية من تضخم التسميات)
+MAX_ROUTE_LABELS = 500
+
+_registry: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], object] = {}
+_registry_lock = Lock()
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+    """عداد تراكمي"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def snapshot(self) -> dict:
+        return {"labels": self.labels, "value": self.value}
+
+
+class Gauge:
+    """قيمة لحظية (مثل عمق الطابور)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def snapshot(self) -> dict:
+        return {"labels": self.labels, "value": self.value}
+
+
+class Histogram:
+    """مدرج زمني يحفظ آخر العينات لحساب النسب المئوية"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: dict, max_samples: int = DEFAULT_MAX_SAMPLES, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = buckets
+        # عدد العينات في كل خانة (غير تراكمي) + خانة أخيرة لما بعد آخر حد
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self._samples = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self._samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        """حساب النسبة المئوية q (بين 0 و 1) من العينات الحالية"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    @contextmanager
+    def time(self):
+        """قياس زمن تنفيذ كتلة بالثواني"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        return {
+            "labels": self.labels,
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p99": round(self.quantile(0.99), 6)
+        }
+
+
+def _get_or_create(cls, name: str, labels: dict):
+    key = (name, _label_key(labels))
+    metric = _registry.get(key)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(key)
+            if metric is None:
+                metric = cls(name, dict(labels))
+                _registry[key] = metric
+    return metric
+
+
+def counter(name: str, **labels) -> Counter:
+    """الحصول على عداد (يُنشأ عند أول استخدام)"""
+    return _get_or_create(Counter, name, labels)
+
+
+def gauge(name: str, **labels) -> Gauge:
+    """الحصول على مقياس لحظي (يُنشأ عند أول استخدام)"""
+    return _get_or_create(Gauge, name, labels)
+
+
+def histogram(name: str, **labels) -> Histogram:
+    """الحصول على مدرج زمني (يُنشأ عند أول استخدام)"""
+    return _get_or_create(Histogram, name, labels)
+
+
+def snapshot() -> dict:
+    """لقطة لكل المقاييس مجمعة حسب الاسم"""
+    result = {}
+    for (name, _), metric in sorted(_registry.items(), key=lambda item: item[0]):
+        result.setdefault(name, {"type": metric.kind, "series": []})
+        result[name]["series"].append(metric.snapshot())
+    return result
+
+
+_ID_SEGMENT = re.compile(r"^(-?\d+(\.\d+)?|[0-9a-fA-F-]{8,}|AC\d{8}[0-9A-F]{8})$")
+_route_labels: set = set()
+
+
+def route_label(value: str, prefix: str = "") -> str:
+    """
+    تحويل callback_data أو أمر نصي إلى اسم مسار ثابت صالح كتسمية
+
+    المعرفات (أرقام، UUID، أرقام الطلبات) تُستبدل بـ {id} حتى لا يتضخم عدد السلاسل،
+    وبعد MAX_ROUTE_LABELS اسماً مختلفاً تُجمع الأسماء الجديدة تحت "other"
+    """
+    segments = [("{id}" if _ID_SEGMENT.match(segment) else segment) for segment in value.split("_")]
+    label = prefix + "_".join(segments)[:64]
+    if label not in _route_labels:
+        if len(_route_labels) >= MAX_ROUTE_LABELS:
+            return prefix + "other"
+        _route_labels.add(label)
+    return label
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [(key, str(value)) for key, value in sorted(labels.items())] + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """كل المقاييس بصيغة Prometheus النصية (text exposition format 0.0.4)"""
+    lines = []
+    declared = set()
+    for (name, _), metric in sorted(_registry.items(), key=lambda item: item[0]):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} {metric.kind}")
+
+        if isinstance(metric, Histogram):
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets, metric.bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(metric.labels, (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(metric.labels, (('le', '+Inf'),))} {metric.count}")
+            lines.append(f"{name}_sum{_format_labels(metric.labels)} {metric.sum}")
+            lines.append(f"{name}_count{_format_labels(metric.labels)} {metric.count}")
+        else:
+            lines.append(f"{name}{_format_labels(metric.labels)} {metric.value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """مسح كل المقاييس (للاختبارات)"""
+    with _registry_lock:
+        _registry.clear()
+        _route_labels.clear()
@@ -0,0 +1,58 @@
+"""
+Mongo Command Metrics - مقاييس أوامر MongoDB
+مستمع أوامر PyMongo يسجل زمن كل أمر حسب المجموعة ونوع العملية (find, update, aggregate...)
+
+يُمرر عند إنشاء العميل:
+    AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
+"""
+from typing import Dict, Tuple
+
+from pymongo import monitoring
+
+import metrics
+
+# أوامر الاتصال والمصادقة لا تعبر عن استعلامات التطبيق
+IGNORED_COMMANDS = frozenset({
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo",
+    "saslStart", "saslContinue", "authenticate", "endSessions", "killCursors"
+})
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """تسجيل mongo_command_seconds{collection, command} و mongo_command_failed_total"""
+
+    def __init__(self):
+        # (connection_id, request_id) -> collection
+        self._collections: Dict[tuple, str] = {}
+        self._histograms: Dict[Tuple[str, str], metrics.Histogram] = {}
+
+    @staticmethod
+    def _collection_of(event: monitoring.CommandStartedEvent) -> str:
+        if event.command_name == "getMore":
+            return event.command.get("collection", "-")
+        target = event.command.get(event.command_name)
+        return target if isinstance(target, str) else "-"
+
+    def _histogram(self, collection: str, command: str) -> metrics.Histogram:
+        key = (collection, command)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = metrics.histogram("mongo_command_seconds", collection=collection, command=command)
+            self._histograms[key] = histogram
+        return histogram
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        self._collections[(event.connection_id, event.request_id)] = self._collection_of(event)
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            self._histogram(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            self._histogram(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+            metrics.counter("mongo_command_failed_total", collection=collection, command=event.command_name).inc()
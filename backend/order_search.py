@@ -0,0 +1,90 @@
+"""
+Order Search Planner - مخطط البحث في الطلبات
+تصنيف نص البحث مرة واحدة ثم تنفيذ استعلام واحد مفهرس بدلاً من سلسلة محاولات $regex على كامل المجموعة
+
+الخطط (بالترتيب):
+- order_number: رقم طلب كامل (AC + التاريخ + 8 رموز) أو بادئته AC2024...
+- telegram_id: أرقام فقط
+- user_internal_id: رقم العميل الداخلي (U + 6 رموز)
+- order_id: بادئة معرف الطلب (uuid) - ما يظهر في رسائل الإدارة كـ ID
+- text: اسم المنتج أو الفئة عبر فهرس النص orders_text (انظر db_indexes.py)
+
+كل الخطط مثبتة على فهرس: تطابق تام، أو بادئة مثبتة ^ بدون i (تُخدم بنطاق على الفهرس)، أو $text
+"""
+import logging
+import os
+import re
+import time
+from typing import List, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ORDER_SEARCH_PAGE_SIZE = int(os.environ.get('ORDER_SEARCH_PAGE_SIZE', '10'))
+
+_ORDER_NUMBER = re.compile(r"^AC(\d{8})([0-9A-F]{8})$")
+_ORDER_NUMBER_PREFIX = re.compile(r"^AC\d{1,8}[0-9A-F]{0,8}$")
+_USER_INTERNAL_ID = re.compile(r"^U[0-9A-F]{6}$")
+_ORDER_ID_PREFIX = re.compile(r"^[0-9a-f]{4,8}(-[0-9a-f]{0,4}){0,3}(-[0-9a-f]{0,12})?$")
+
+
+class OrderSearchPlan:
+    """استعلام واحد على orders مع اسم الخطة للسجل والمقاييس"""
+
+    def __init__(self, name: str, query: dict):
+        self.name = name
+        self.query = query
+
+    def __repr__(self):
+        return f"OrderSearchPlan({self.name}, {self.query})"
+
+
+def plan_order_search(term: str) -> OrderSearchPlan:
+    """تصنيف نص البحث واختيار الخطة"""
+    term = term.strip()
+    upper = term.upper()
+
+    match = _ORDER_NUMBER.match(upper)
+    if match:
+        # الطلبات القديمة بدون order_number: الرقم مشتق من أول 8 رموز من المعرف
+        return OrderSearchPlan("order_number", {"$or": [
+            {"order_number": upper},
+            {"id": {"$regex": f"^{match.group(2).lower()}"}}
+        ]})
+    if _ORDER_NUMBER_PREFIX.match(upper):
+        return OrderSearchPlan("order_number_prefix", {"order_number": {"$regex": f"^{upper}"}})
+
+    if term.isdigit():
+        return OrderSearchPlan("telegram_id", {"telegram_id": int(term)})
+
+    if _USER_INTERNAL_ID.match(upper):
+        return OrderSearchPlan("user_internal_id", {"user_internal_id": upper})
+
+    lower = term.lower()
+    if _ORDER_ID_PREFIX.match(lower) and any(char.isdigit() for char in lower):
+        return OrderSearchPlan("order_id", {"id": {"$regex": f"^{lower}"}})
+
+    return OrderSearchPlan("text", {"$text": {"$search": term}})
+
+
+async def search_orders(db, term: str, page: int = 0,
+                        page_size: int = ORDER_SEARCH_PAGE_SIZE) -> Tuple[OrderSearchPlan, List[dict], bool]:
+    """
+    تنفيذ خطة البحث لصفحة واحدة من النتائج (الأحدث أولاً)
+
+    Returns:
+        tuple: (الخطة، طلبات الصفحة، هل توجد صفحة تالية)
+    """
+    plan = plan_order_search(term)
+    start = time.perf_counter()
+    orders = await db.orders.find(plan.query, {"_id": 0}).sort("order_date", -1) \
+        .skip(page * page_size).limit(page_size + 1).to_list(page_size + 1)
+    elapsed = time.perf_counter() - start
+
+    metrics.histogram("order_search_seconds", plan=plan.name).observe(elapsed)
+    logger.info(
+        f"Order search plan={plan.name} page={page} results={min(len(orders), page_size)} "
+        f"in {elapsed * 1000:.1f}ms"
+    )
+    return plan, orders[:page_size], len(orders) > page_size
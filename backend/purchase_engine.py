@@ -0,0 +1,149 @@
+"""
+Purchase Engine - محرك الشراء
+خصم الرصيد المشروط وحجز الكود وتسجيل الطلب في معاملة واحدة متعددة المستندات،
+مع بديل بعمليات تعويضية عند تشغيل MongoDB بدون replica set
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.errors import OperationFailure
+
+import metrics
+from inventory import allocate_code, release_code
+from rollups import record_order
+
+logger = logging.getLogger(__name__)
+
+# رمز الخطأ IllegalOperation الذي يعيده mongod المستقل عند محاولة بدء معاملة
+ILLEGAL_OPERATION_CODE = 20
+
+# يتم تحديده عند أول عملية شراء (None = غير معروف بعد)
+_transactions_supported: Optional[bool] = None
+
+
+class InsufficientBalance(Exception):
+    """الرصيد غير كافٍ لإتمام الشراء"""
+
+
+async def _debit_and_record(db, telegram_id: int, price: float, order: dict, allocate: bool, session=None) -> dict:
+    """خطوات الشراء: خصم مشروط، حجز كود (اختياري)، ثم حفظ الطلب"""
+    debit = await db.users.update_one(
+        {"telegram_id": telegram_id, "balance": {"$gte": price}},
+        {"$inc": {"balance": -price, "orders_count": 1}},
+        session=session
+    )
+    if debit.modified_count == 0:
+        raise InsufficientBalance()
+
+    code = None
+    if allocate:
+        code = await allocate_code(db, order["category_id"], order["user_id"], order["id"], session=session)
+        if code:
+            order["status"] = "completed"
+            order["code_sent"] = code["code"]
+            order["completion_date"] = datetime.now(timezone.utc)
+
+    await db.orders.insert_one(order, session=session)
+    await record_order(db, order, session=session)
+    return code
+
+
+async def _purchase_in_transaction(db, telegram_id: int, price: float, order: dict, allocate: bool):
+    result = {}
+
+    async def callback(session):
+        # نسخة جديدة في كل محاولة لأن with_transaction قد يعيد التنفيذ
+        attempt = dict(order)
+        result["code"] = await _debit_and_record(db, telegram_id, price, attempt, allocate, session=session)
+        result["order"] = attempt
+
+    async with await db.client.start_session() as session:
+        await session.with_transaction(callback)
+    return result["order"], result["code"]
+
+
+async def _purchase_with_compensation(db, telegram_id: int, price: float, order: dict, allocate: bool):
+    order = dict(order)
+    debit = await db.users.update_one(
+        {"telegram_id": telegram_id, "balance": {"$gte": price}},
+        {"$inc": {"balance": -price, "orders_count": 1}}
+    )
+    if debit.modified_count == 0:
+        raise InsufficientBalance()
+
+    code = None
+    try:
+        if allocate:
+            code = await allocate_code(db, order["category_id"], order["user_id"], order["id"])
+            if code:
+                order["status"] = "completed"
+                order["code_sent"] = code["code"]
+                order["completion_date"] = datetime.now(timezone.utc)
+
+        await db.orders.insert_one(order)
+    except Exception:
+        # التراجع: إعادة الرصيد وتحرير الكود المحجوز
+        await db.users.update_one(
+            {"telegram_id": telegram_id},
+            {"$inc": {"balance": price, "orders_count": -1}}
+        )
+        if code:
+            await release_code(db, code)
+        raise
+
+    try:
+        await record_order(db, order)
+    except Exception as e:
+        # الطلب محفوظ بالفعل - الانحراف في التجميع يُصحح بإعادة البناء (rollups.py --rebuild)
+        logger.error(f"Failed to record order {order['id']} in daily rollup: {e}")
+    return order, code
+
+
+async def execute_purchase(db, telegram_id: int, price: float, order: dict, allocate_code_for_order: bool = False,
+                           user_cache=None) -> dict:
+    """
+    تنفيذ عملية شراء كاملة بشكل ذري
+
+    Args:
+        db: قاعدة البيانات
+        telegram_id: معرف المشتري في تليجرام
+        price: السعر المطلوب خصمه
+        order: مستند الطلب (بحالة pending)
+        allocate_code_for_order: حجز كود من المخزون للطلب (لفئات التسليم بالكود)
+        user_cache: ذاكرة المستخدمين لإبطال بيانات المشتري بعد تغيير رصيده (اختياري)
+
+    Returns:
+        dict: {"success", "reason", "order", "code"} حيث code هو الكود المحجوز أو None
+    """
+    global _transactions_supported
+
+    delivery_type = order.get("delivery_type", "code")
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        try:
+            if _transactions_supported is False:
+                saved_order, code = await _purchase_with_compensation(db, telegram_id, price, order, allocate_code_for_order)
+            else:
+                try:
+                    saved_order, code = await _purchase_in_transaction(db, telegram_id, price, order, allocate_code_for_order)
+                    _transactions_supported = True
+                except OperationFailure as e:
+                    if e.code != ILLEGAL_OPERATION_CODE:
+                        raise
+                    logger.warning("MongoDB transactions unavailable (standalone server), using compensating writes")
+                    _transactions_supported = False
+                    saved_order, code = await _purchase_with_compensation(db, telegram_id, price, order, allocate_code_for_order)
+        except InsufficientBalance:
+            outcome = "insufficient_balance"
+            return {"success": False, "reason": "insufficient_balance", "order": None, "code": None}
+
+        outcome = saved_order["status"]
+        return {"success": True, "reason": None, "order": saved_order, "code": code}
+    finally:
+        if user_cache is not None:
+            user_cache.invalidate(telegram_id)
+        metrics.histogram("purchase_latency_seconds", delivery_type=delivery_type).observe(time.perf_counter() - start)
+        metrics.counter("purchases_total", delivery_type=delivery_type, outcome=outcome).inc()
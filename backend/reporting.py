@@ -0,0 +1,188 @@
+"""
+Reporting Engine - محرك التقارير
+كل مؤشرات الطلبات (الإجماليات، العدد حسب الحالة، الإيرادات، طلبات وإيرادات الفترة، الطلبات المتأخرة)
+من التجميعات اليومية (rollups.py) للتقارير العامة بأيام كاملة، أو من استعلام $facet واحد على orders
+للتقارير المفلترة (مستخدم واحد) والفترات المخصصة، مع تشغيل الاستعلامات المستقلة بالتوازي
+
+الفترة الزمنية معامل (يومي، أسبوعي، أو مخصص) لذلك نفس المحرك يخدم كل شاشات التقارير
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import metrics
+from rollups import day_key, order_totals, signup_total
+
+logger = logging.getLogger(__name__)
+
+# الطلب المعلق يعتبر متأخراً بعد هذه المدة
+OVERDUE_AFTER = timedelta(hours=24)
+
+
+class ReportRange:
+    """فترة التقرير [start, end)"""
+
+    def __init__(self, start: datetime, end: Optional[datetime] = None, label: str = "custom"):
+        self.start = start
+        self.end = end
+        self.label = label
+
+    def is_whole_days(self) -> bool:
+        """هل تبدأ وتنتهي الفترة عند منتصف الليل؟ (يمكن حسابها من التجميعات اليومية)"""
+        return all(
+            moment is None or (moment.hour, moment.minute, moment.second, moment.microsecond) == (0, 0, 0, 0)
+            for moment in (self.start, self.end)
+        )
+
+    def match(self) -> dict:
+        condition = {"$gte": self.start}
+        if self.end is not None:
+            condition["$lt"] = self.end
+        return {"order_date": condition}
+
+
+def day_range(now: Optional[datetime] = None) -> ReportRange:
+    """اليوم الحالي (UTC)"""
+    now = now or datetime.now(timezone.utc)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ReportRange(start, start + timedelta(days=1), label="day")
+
+
+def week_range(now: Optional[datetime] = None) -> ReportRange:
+    """آخر 7 أيام بما فيها اليوم الحالي"""
+    today = day_range(now)
+    return ReportRange(today.start - timedelta(days=6), today.end, label="week")
+
+
+def report_range(name: str, now: Optional[datetime] = None) -> ReportRange:
+    """الحصول على فترة التقرير من اسمها (day / week)"""
+    return week_range(now) if name == "week" else day_range(now)
+
+
+def _sum_of(rows: list, field: str = "total") -> float:
+    return rows[0][field] if rows else 0
+
+
+def _overdue_before() -> datetime:
+    return datetime.now(timezone.utc) - OVERDUE_AFTER
+
+
+def _kpis(by_status: dict, revenue: float, period_orders: int, period_revenue: float, overdue: int,
+          last_order: Optional[dict] = None) -> dict:
+    return {
+        "total_orders": sum(by_status.values()),
+        "by_status": by_status,
+        "completed_orders": by_status.get("completed", 0),
+        "pending_orders": by_status.get("pending", 0),
+        "failed_orders": by_status.get("failed", 0),
+        "total_revenue": revenue,
+        "period_orders": period_orders,
+        "period_revenue": period_revenue,
+        "overdue_orders": overdue,
+        "last_order": last_order
+    }
+
+
+async def rollup_kpis(db, period: ReportRange) -> dict:
+    """مؤشرات الطلبات العامة من التجميعات اليومية (تكلفة ثابتة مهما كبر تاريخ الطلبات)"""
+    all_time, in_period, overdue = await asyncio.gather(
+        order_totals(db),
+        order_totals(db, day_key(period.start), day_key(period.end) if period.end else None),
+        db.orders.count_documents({"status": "pending", "order_date": {"$lt": _overdue_before()}})
+    )
+    return _kpis(
+        {status: row["count"] for status, row in all_time.items()},
+        all_time.get("completed", {}).get("revenue", 0),
+        sum(row["count"] for row in in_period.values()),
+        in_period.get("completed", {}).get("revenue", 0),
+        overdue
+    )
+
+
+async def order_kpis(db, period: ReportRange, match: Optional[dict] = None, include_last_order: bool = False) -> dict:
+    """
+    مؤشرات الطلبات في رحلة واحدة لقاعدة البيانات
+
+    Args:
+        db: قاعدة البيانات
+        period: فترة إحصائيات الفترة (طلبات وإيرادات)
+        match: شرط إضافي على الطلبات (مثلاً telegram_id لمستخدم واحد)
+        include_last_order: إرجاع آخر طلب أيضاً
+
+    Returns:
+        dict: total_orders, by_status, completed/pending/failed_orders, total_revenue,
+              period_orders, period_revenue, overdue_orders, last_order
+    """
+    if match is None and not include_last_order and period.is_whole_days():
+        return await rollup_kpis(db, period)
+
+    facets = {
+        "by_status": [
+            {"$group": {
+                "_id": "$status",
+                "count": {"$sum": 1},
+                "revenue": {"$sum": "$price"}
+            }}
+        ],
+        "period": [
+            {"$match": period.match()},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "revenue": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, "$price", 0]}}
+            }}
+        ],
+        "overdue": [
+            {"$match": {"status": "pending", "order_date": {"$lt": _overdue_before()}}},
+            {"$count": "total"}
+        ]
+    }
+    if include_last_order:
+        facets["last_order"] = [{"$sort": {"order_date": -1}}, {"$limit": 1}, {"$project": {"_id": 0}}]
+
+    pipeline = [{"$match": match}] if match else []
+    pipeline.append({"$facet": facets})
+    result = (await db.orders.aggregate(pipeline).to_list(1))[0]
+
+    by_status = {row["_id"]: row["count"] for row in result["by_status"]}
+    revenue_by_status = {row["_id"]: row["revenue"] for row in result["by_status"]}
+    period_row = result["period"][0] if result["period"] else {"count": 0, "revenue": 0}
+    last_order = result.get("last_order") or [None]
+
+    return _kpis(
+        by_status,
+        revenue_by_status.get("completed", 0),
+        period_row["count"],
+        period_row["revenue"],
+        _sum_of(result["overdue"]),
+        last_order[0]
+    )
+
+
+async def build_report(db, name: str, period: ReportRange, match: Optional[dict] = None,
+                       include_last_order: bool = False, include_users: bool = False) -> dict:
+    """
+    بناء تقرير كامل مع تسجيل زمن إنتاجه
+
+    Args:
+        name: اسم التقرير (للسجل والمقاييس)
+        include_users: إضافة عدد المستخدمين (يُحسب بالتوازي مع مؤشرات الطلبات)
+    """
+    start = time.perf_counter()
+    queries = [order_kpis(db, period, match=match, include_last_order=include_last_order)]
+    if include_users:
+        queries.append(signup_total(db))
+
+    results = await asyncio.gather(*queries)
+    report = results[0]
+    if include_users:
+        report["total_users"] = results[1]
+    report["period"] = period.label
+    report["generated_at"] = datetime.now(timezone.utc)
+
+    elapsed = time.perf_counter() - start
+    metrics.histogram("report_seconds", report=name).observe(elapsed)
+    logger.info(f"Report '{name}' ({period.label}) built in {elapsed * 1000:.1f}ms")
+    return report
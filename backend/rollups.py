@@ -0,0 +1,206 @@
+"""
+Daily Rollups - التجميعات اليومية
+ملخصات يومية محدّثة تدريجياً بدلاً من إعادة حساب كل التاريخ في كل تقرير
+
+- orders_daily: مستند لكل (اليوم، الفئة، الحالة) فيه عدد الطلبات ومجموع أسعارها
+- users_daily: مستند لكل يوم فيه عدد المستخدمين الجدد
+
+اليوم هو يوم إنشاء الطلب (order_date) أو التسجيل (join_date) بتوقيت UTC، لذلك تغيير حالة الطلب
+ينقله من خانة الحالة القديمة إلى الجديدة في نفس اليوم
+
+الاستخدام من سطر الأوامر:
+    python rollups.py --rebuild    # إعادة بناء التجميعات من كامل التاريخ
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+from db_indexes import MIGRATIONS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+ORDERS_DAILY = "orders_daily"
+USERS_DAILY = "users_daily"
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def day_key(moment: datetime) -> str:
+    """مفتاح اليوم (UTC) بصيغة YYYY-MM-DD"""
+    return moment.strftime(DAY_FORMAT)
+
+
+async def _inc_orders_bucket(db, order: dict, status: str, count: int, session=None):
+    await db[ORDERS_DAILY].update_one(
+        {"day": day_key(order["order_date"]), "category_id": order.get("category_id"), "status": status},
+        {"$inc": {"count": count, "revenue": count * order.get("price", 0)}},
+        upsert=True,
+        session=session
+    )
+
+
+async def record_order(db, order: dict, session=None):
+    """تسجيل طلب جديد في التجميع (ضمن نفس المعاملة عند تمرير session)"""
+    await _inc_orders_bucket(db, order, order.get("status", "pending"), 1, session=session)
+
+
+async def update_order_status(db, order_id: str, status: str, fields: Optional[dict] = None) -> Optional[dict]:
+    """
+    تغيير حالة الطلب ونقله بين خانات التجميع
+
+    التحديث يتم بعملية find_one_and_update واحدة تعيد الحالة السابقة، لذلك لا يُحسب نفس
+    الانتقال مرتين حتى لو نُفذ الأمر من أكثر من مكان في نفس الوقت
+
+    Args:
+        order_id: معرف الطلب
+        status: الحالة الجديدة
+        fields: حقول إضافية تُحدث مع الحالة
+
+    Returns:
+        dict: الطلب قبل التحديث، أو None إذا لم يكن موجوداً
+    """
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id},
+        {"$set": {"status": status, **(fields or {})}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous and previous.get("status") != status:
+        await _inc_orders_bucket(db, previous, previous.get("status", "pending"), -1)
+        await _inc_orders_bucket(db, previous, status, 1)
+    return previous
+
+
+async def record_signup(db, user: dict):
+    """تسجيل مستخدم جديد في تجميع المستخدمين"""
+    await db[USERS_DAILY].update_one(
+        {"day": day_key(user["join_date"])},
+        {"$inc": {"count": 1}},
+        upsert=True
+    )
+
+
+def _day_filter(start_day: Optional[str], end_day: Optional[str]) -> dict:
+    condition = {}
+    if start_day:
+        condition["$gte"] = start_day
+    if end_day:
+        condition["$lt"] = end_day
+    return {"day": condition} if condition else {}
+
+
+async def order_totals(db, start_day: Optional[str] = None, end_day: Optional[str] = None) -> dict:
+    """
+    مجموع الطلبات والإيرادات حسب الحالة في فترة أيام [start_day, end_day)
+
+    Returns:
+        dict: status -> {"count", "revenue"}
+    """
+    pipeline = [
+        {"$match": _day_filter(start_day, end_day)},
+        {"$group": {"_id": "$status", "count": {"$sum": "$count"}, "revenue": {"$sum": "$revenue"}}}
+    ]
+    totals = {}
+    async for row in db[ORDERS_DAILY].aggregate(pipeline):
+        totals[row["_id"]] = {"count": row["count"], "revenue": row["revenue"]}
+    return totals
+
+
+async def category_popularity(db, start_day: Optional[str] = None) -> dict:
+    """عدد الطلبات المكتملة لكل فئة منذ start_day (لترتيب اقتراحات البحث)"""
+    pipeline = [
+        {"$match": {"status": "completed", **_day_filter(start_day, None)}},
+        {"$group": {"_id": "$category_id", "count": {"$sum": "$count"}}}
+    ]
+    return {row["_id"]: row["count"] async for row in db[ORDERS_DAILY].aggregate(pipeline) if row["_id"]}
+
+
+async def signup_total(db, start_day: Optional[str] = None, end_day: Optional[str] = None) -> int:
+    """عدد المستخدمين الجدد في فترة أيام [start_day, end_day)"""
+    pipeline = [
+        {"$match": _day_filter(start_day, end_day)},
+        {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+    ]
+    rows = await db[USERS_DAILY].aggregate(pipeline).to_list(1)
+    return rows[0]["count"] if rows else 0
+
+
+async def rebuild_rollups(db):
+    """
+    إعادة بناء التجميعات من orders و users
+
+    $out يستبدل المجموعة الهدف بشكل ذري عند نهاية الاستعلام، لذلك لا ترى التقارير تجميعاً ناقصاً
+    """
+    await db.orders.aggregate([
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$order_date"}},
+                "category_id": "$category_id",
+                "status": "$status"
+            },
+            "count": {"$sum": 1},
+            "revenue": {"$sum": "$price"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "category_id": "$_id.category_id",
+            "status": "$_id.status",
+            "count": 1,
+            "revenue": 1
+        }},
+        {"$out": ORDERS_DAILY}
+    ]).to_list(None)
+
+    await db.users.aggregate([
+        {"$group": {
+            "_id": {"$dateToString": {"format": DAY_FORMAT, "date": "$join_date"}},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {"_id": 0, "day": "$_id", "count": 1}},
+        {"$out": USERS_DAILY}
+    ]).to_list(None)
+
+    logger.info("Daily rollups rebuilt")
+
+
+async def ensure_rollups(db):
+    """بناء التجميعات لأول مرة عند الترقية (مرة واحدة، تُسجل في schema_migrations)"""
+    if await db[MIGRATIONS_COLLECTION].find_one({"_id": "rollups"}):
+        return
+    await rebuild_rollups(db)
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": "rollups"},
+        {"$set": {"built_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def _main(argv: list) -> int:
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    if "--rebuild" not in argv:
+        print("Usage: python rollups.py --rebuild")
+        return 2
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    try:
+        await rebuild_rollups(db)
+        print("✅ Rollups rebuilt")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
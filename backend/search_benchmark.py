@@ -0,0 +1,149 @@
+"""
+اختبار أداء البحث - Search Benchmark
+يقارن البحث القديم ($regex غير مثبت على الاسم والوصف) مع فهرس البحث والاقتراحات التقريبية
+على كتالوج وهمي، ويقيس نسبة الاستعلامات التي تجد نتيجة عند وجود أخطاء إملائية
+
+مسار $regex يُحاكى داخل العملية بنفس التعبير على كل المستندات (وهو ما يفعله MongoDB عند
+عدم وجود فهرس)، لذلك أرقامه حد أدنى لا يشمل زمن الشبكة
+
+الاستخدام:
+    python search_benchmark.py [عدد_الفئات] [عدد_الاستعلامات]
+"""
+
+import random
+import re
+import statistics
+import sys
+import time
+
+from search_index import SearchIndex, FUZZY_BUDGET_MS
+
+BRANDS = [
+    "ببجي", "فري فاير", "جوجل بلاي", "ايتونز", "ستيم", "نتفلكس", "شاهد", "سبوتيفاي", "بلايستيشن", "اكس بوكس",
+    "PUBG", "Free Fire", "Google Play", "iTunes", "Steam", "Netflix", "Spotify", "PlayStation", "Xbox", "Roblox",
+    "Fortnite", "Amazon", "Razer Gold", "Yalla Ludo", "Jawaker", "Mobile Legends", "Genshin", "Apple", "Visa", "Shahid"
+]
+UNITS = ["شدة", "جوهرة", "دولار", "رصيد", "اشتراك شهري", "اشتراك سنوي", "UC", "Diamonds", "USD", "Gift Card"]
+REGIONS = ["السعودية", "الإمارات", "أمريكا", "تركيا", "عالمي", "KSA", "UAE", "US", "Global", "EU"]
+
+
+def generate_catalog(count: int):
+    """كتالوج وهمي: منتج لكل علامة تجارية وفئات موزعة عليها"""
+    products = [
+        {"id": f"p{index}", "name": brand, "description": f"بطاقات وشحن {brand}", "is_active": True}
+        for index, brand in enumerate(BRANDS)
+    ]
+    categories = []
+    for index in range(count):
+        product_index = random.randrange(len(BRANDS))
+        brand = BRANDS[product_index]
+        name = f"{brand} {random.choice([10, 25, 50, 60, 100, 325, 660, 1800])} {random.choice(UNITS)} {random.choice(REGIONS)}"
+        categories.append({
+            "id": f"c{index}",
+            "product_id": f"p{product_index}",
+            "name": name,
+            "description": f"كود {brand} رقمي يصل فوراً - {random.choice(REGIONS)}",
+            "price": round(random.uniform(1, 200), 2)
+        })
+    return products, categories
+
+
+def misspell(word: str) -> str:
+    """خطأ إملائي واحد: حذف حرف، تكرار حرف، أو تبديل حرفين متجاورين"""
+    if len(word) < 4:
+        return word
+    position = random.randrange(1, len(word) - 1)
+    mistake = random.choice(["drop", "double", "swap"])
+    if mistake == "drop":
+        return word[:position] + word[position + 1:]
+    if mistake == "double":
+        return word[:position] + word[position] + word[position:]
+    return word[:position - 1] + word[position] + word[position - 1] + word[position + 1:]
+
+
+def generate_queries(count: int):
+    """استعلامات صحيحة (بادئات وأسماء) واستعلامات بها أخطاء إملائية"""
+    exact, typos = [], []
+    for _ in range(count):
+        brand = random.choice(BRANDS)
+        exact.append(random.choice([brand, brand[:4], f"{brand} {random.choice(UNITS)}"]))
+        words = brand.split()
+        index = random.randrange(len(words))
+        words[index] = misspell(words[index])
+        typos.append(" ".join(words))
+    return exact, typos
+
+
+def regex_search(products, categories, query: str):
+    """المسار القديم: تعبير نمطي غير مثبت وغير حساس لحالة الأحرف على الاسم والوصف"""
+    try:
+        pattern = re.compile(query, re.IGNORECASE)
+    except re.error:
+        # في MongoDB يفشل الاستعلام كاملاً ويرى المستخدم رسالة خطأ
+        return []
+    found = [p for p in products if p["is_active"] and (pattern.search(p["name"]) or pattern.search(p["description"]))]
+    found += [c for c in categories if pattern.search(c["name"]) or pattern.search(c["description"])]
+    return found[:20]
+
+
+def measure(function, queries):
+    """الزمن لكل استعلام (ميكروثانية) ونسبة الاستعلامات التي وجدت نتيجة"""
+    timings, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        result = function(query)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+        hits += bool(result)
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return statistics.median(timings), p99, hits / len(queries)
+
+
+def report(label: str, result):
+    p50, p99, hit_rate = result
+    print(f"{label:<34} p50: {p50:9.1f}µs  p99: {p99:9.1f}µs  وجد نتائج: {hit_rate * 100:5.1f}%")
+
+
+def main(count: int = 10000, query_count: int = 300):
+    print("="*80)
+    print("🔍 اختبار أداء البحث")
+    print(f"🏷️ عدد الفئات: {count}")
+    print(f"❓ عدد الاستعلامات: {query_count} صحيحة + {query_count} بأخطاء إملائية")
+    print("="*80)
+
+    random.seed(7)
+    products, categories = generate_catalog(count)
+    exact_queries, typo_queries = generate_queries(query_count)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.sync(products, categories)
+    print(f"🏗️ بناء الفهرس: {(time.perf_counter() - start) * 1000:.0f}ms")
+    index.set_popularity({category["id"]: random.randrange(500) for category in categories})
+
+    # تعديل 1% من الكتالوج لقياس التحديث التدريجي
+    for category in random.sample(categories, count // 100):
+        category["name"] += " جديد"
+    start = time.perf_counter()
+    reindexed, _ = index.sync(products, categories)
+    print(f"♻️ تحديث تدريجي ({reindexed} عنصر): {(time.perf_counter() - start) * 1000:.1f}ms")
+    print("-"*80)
+
+    report("$regex (صحيحة)", measure(lambda query: regex_search(products, categories, query), exact_queries))
+    # الفهرس يحفظ نتائج الاستعلامات المتكررة، لذلك يُقاس التشغيل الأول بفهرس جديد
+    index._results.clear()
+    report("الفهرس (صحيحة)", measure(lambda query: index.search(query, limit=20), exact_queries))
+    print("-"*80)
+    report("$regex (أخطاء إملائية)", measure(lambda query: regex_search(products, categories, query), typo_queries))
+    report("الفهرس (أخطاء إملائية)", measure(lambda query: index.search(query, limit=20), typo_queries))
+    report(
+        "الفهرس + هل تقصد (أخطاء إملائية)",
+        measure(lambda query: index.search(query, limit=20) or index.suggest(query), typo_queries)
+    )
+    print(f"⏱️ ميزانية الاقتراحات: {FUZZY_BUDGET_MS:.0f}ms لكل استعلام")
+    print("="*80)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args)
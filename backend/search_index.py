@@ -0,0 +1,420 @@
+"""
+Search Index - فهرس البحث في الكتالوج
+فهرس معكوس في الذاكرة لأسماء وأوصاف المنتجات والفئات بدلاً من استعلامات $regex غير المثبتة على قاعدة البيانات
+
+- النصوص تُطبّع بنفس قواعد text_normalize.py (أشكال الألف والهمزة، التاء المربوطة، التطويل، التشكيل، حالة الأحرف)
+- كل كلمة تُفهرس كاملة ومع بادئاتها (من MIN_PREFIX حتى MAX_PREFIX حرفاً) لذلك "ببج" تطابق "ببجي"
+- كلمات الاستعلام تُطابق كلها (AND) والترتيب حسب الوزن: الاسم أعلى من الوصف، والكلمة الكاملة أعلى من البادئة
+- عند تغير الكتالوج يُحدّث الفهرس تدريجياً: تُعاد فهرسة العناصر التي تغير نصها فقط
+- نتائج الاستعلامات المتكررة تُحفظ حتى تغير الكتالوج التالي
+- عند عدم وجود نتائج: اقتراحات "هل تقصد" من فهرس ثلاثيات الأحرف (trigrams) لمفردات الكتالوج،
+  مرتبة حسب التشابه ثم الشعبية (عدد الطلبات)، ضمن ميزانية زمنية ثابتة FUZZY_BUDGET_MS
+- لا يُستخدم ما يكتبه المستخدم كتعبير نمطي، لذلك الرموز مثل ( * + لا تؤثر على البحث
+"""
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+from text_normalize import tokenize
+
+logger = logging.getLogger(__name__)
+
+MIN_PREFIX = int(os.environ.get('SEARCH_MIN_PREFIX', '2'))
+MAX_PREFIX = int(os.environ.get('SEARCH_MAX_PREFIX', '12'))
+RESULT_CACHE_SIZE = int(os.environ.get('SEARCH_RESULT_CACHE_SIZE', '2048'))
+
+# البحث التقريبي
+FUZZY_BUDGET_MS = float(os.environ.get('SEARCH_FUZZY_BUDGET_MS', '10'))
+FUZZY_MIN_SIMILARITY = float(os.environ.get('SEARCH_FUZZY_MIN_SIMILARITY', '0.45'))
+# عدد البدائل المفحوصة لكل كلمة، وعدد التركيبات المجربة للاستعلام كاملاً
+FUZZY_CANDIDATES = 3
+FUZZY_COMBINATIONS = 6
+# ثلاثيات شائعة جداً (مثل "ال" في بداية الكلمات) لا تميز بين الكلمات وتكلف وقتاً
+MAX_TRIGRAM_FANOUT = int(os.environ.get('SEARCH_MAX_TRIGRAM_FANOUT', '2000'))
+# وزن الشعبية مقابل التشابه في ترتيب الاقتراحات (0 = التشابه فقط)
+POPULARITY_WEIGHT = 0.2
+
+# أوزان الترتيب
+NAME_TOKEN_WEIGHT = 10.0
+NAME_PREFIX_WEIGHT = 6.0
+DESCRIPTION_TOKEN_WEIGHT = 3.0
+DESCRIPTION_PREFIX_WEIGHT = 1.0
+
+PRODUCT = "product"
+CATEGORY = "category"
+
+EntryKey = Tuple[str, str]
+
+
+def _without_article(token: str) -> Optional[str]:
+    """الكلمة بدون "ال" التعريف (الالعاب -> العاب) إذا بقي منها ما يكفي"""
+    if token.startswith("ال") and len(token) > 4:
+        return token[2:]
+    return None
+
+
+def index_terms(text: str, token_weight: float, prefix_weight: float) -> Dict[str, float]:
+    """المصطلحات المفهرسة لنص واحد مع وزن كل منها"""
+    terms: Dict[str, float] = {}
+    for token in tokenize(text or ""):
+        for variant in (token, _without_article(token)):
+            if not variant:
+                continue
+            for length in range(MIN_PREFIX, min(len(variant) - 1, MAX_PREFIX) + 1):
+                prefix = variant[:length]
+                terms[prefix] = max(terms.get(prefix, 0.0), prefix_weight)
+            terms[variant] = max(terms.get(variant, 0.0), token_weight)
+    return terms
+
+
+def trigrams(word: str) -> Set[str]:
+    """ثلاثيات الأحرف للكلمة مع علامة بداية ونهاية ($gogle$ -> $go, gog, ogl, gle, le$)"""
+    padded = f"${word}$"
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """
+    مسافة التحرير (حذف، إضافة، استبدال، تبديل حرفين متجاورين)
+
+    تتوقف مبكراً وتعيد limit + 1 عندما تتجاوز المسافة الحد
+    """
+    previous_previous: List[int] = []
+    previous = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, 1):
+        current = [row] + [0] * len(second)
+        for column, second_char in enumerate(second, 1):
+            cost = 0 if first_char == second_char else 1
+            current[column] = min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + cost)
+            if (row > 1 and column > 1 and first_char == second[column - 2]
+                    and first[row - 2] == second_char):
+                current[column] = min(current[column], previous_previous[column - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def query_terms(query: str) -> List[str]:
+    """كلمات الاستعلام بعد التطبيع (الحروف المفردة تُتجاهل)"""
+    return [
+        _without_article(token) or token
+        for token in tokenize(query or "")
+        if len(token) >= MIN_PREFIX
+    ]
+
+
+class _Entry:
+    __slots__ = ("key", "doc", "fingerprint", "terms", "words", "name_length")
+
+    def __init__(self, key: EntryKey, doc: dict, fingerprint: tuple, terms: Dict[str, float], words: Set[str]):
+        self.key = key
+        self.doc = doc
+        self.fingerprint = fingerprint
+        self.terms = terms
+        self.words = words
+        self.name_length = len(doc.get("name") or "")
+
+
+class Suggestion:
+    """اقتراح "هل تقصد" لاستعلام بدون نتائج"""
+
+    __slots__ = ("query", "similarity", "results")
+
+    def __init__(self, query: str, similarity: float, results: List[Tuple[str, dict]]):
+        # الاستعلام المصحح (بعد التطبيع)
+        self.query = query
+        self.similarity = similarity
+        # (النوع، المستند) مرتبة حسب التشابه والشعبية
+        self.results = results
+
+
+class SearchIndex:
+    """فهرس معكوس للمنتجات والفئات: مصطلح -> {(النوع، id): الوزن}"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[EntryKey, float]] = {}
+        self._entries: Dict[EntryKey, _Entry] = {}
+        # (المصطلحات، النوع، الحد) -> النتائج، يُفرغ عند كل مزامنة
+        self._results: Dict[tuple, List[dict]] = {}
+        # مفردات الكتالوج الكاملة: كلمة -> عدد العناصر التي تحتويها، وثلاثية -> الكلمات
+        self._vocabulary: Dict[str, int] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        # (النوع، id) -> عدد الطلبات
+        self._popularity: Dict[EntryKey, int] = {}
+        self._max_popularity = 0
+
+        self._search_time = metrics.histogram("search_seconds")
+        self._suggest_time = metrics.histogram("search_suggest_seconds")
+        self._budget_exceeded = metrics.counter("search_fuzzy_budget_exceeded_total")
+        self._terms_gauge = metrics.gauge("search_index_terms")
+        self._entries_gauge = metrics.gauge("search_index_entries")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _fingerprint(doc: dict) -> tuple:
+        return doc.get("name"), doc.get("description")
+
+    def _add(self, key: EntryKey, doc: dict, fingerprint: tuple):
+        terms = index_terms(doc.get("name"), NAME_TOKEN_WEIGHT, NAME_PREFIX_WEIGHT)
+        for term, weight in index_terms(doc.get("description"), DESCRIPTION_TOKEN_WEIGHT, DESCRIPTION_PREFIX_WEIGHT).items():
+            terms[term] = max(terms.get(term, 0.0), weight)
+        for term, weight in terms.items():
+            self._postings.setdefault(term, {})[key] = weight
+
+        words = {
+            word
+            for field in (doc.get("name"), doc.get("description"))
+            for word in tokenize(field or "")
+            if len(word) >= 3 and not word.isdigit()
+        }
+        for word in words:
+            self._add_word(word)
+        self._entries[key] = _Entry(key, doc, fingerprint, terms, words)
+
+    def _add_word(self, word: str):
+        count = self._vocabulary.get(word, 0)
+        self._vocabulary[word] = count + 1
+        if count == 0:
+            for trigram in trigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(word)
+
+    def _remove_word(self, word: str):
+        count = self._vocabulary.pop(word, 0) - 1
+        if count > 0:
+            self._vocabulary[word] = count
+            return
+        for trigram in trigrams(word):
+            words = self._trigrams.get(trigram)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self._trigrams[trigram]
+
+    def _remove(self, key: EntryKey):
+        entry = self._entries.pop(key)
+        for term in entry.terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[term]
+        for word in entry.words:
+            self._remove_word(word)
+
+    def set_popularity(self, category_orders: Dict[str, int]):
+        """
+        تحديث شعبية العناصر لترتيب الاقتراحات
+
+        Args:
+            category_orders: category_id -> عدد الطلبات (شعبية المنتج = مجموع فئاته)
+        """
+        popularity: Dict[EntryKey, int] = {}
+        for category_id, count in category_orders.items():
+            popularity[(CATEGORY, category_id)] = count
+            entry = self._entries.get((CATEGORY, category_id))
+            product_id = entry.doc.get("product_id") if entry else None
+            if product_id:
+                product_key = (PRODUCT, product_id)
+                popularity[product_key] = popularity.get(product_key, 0) + count
+        self._popularity = popularity
+        self._max_popularity = max(popularity.values(), default=0)
+
+    def sync(self, products: Iterable[dict], categories: Iterable[dict]) -> Tuple[int, int]:
+        """
+        مزامنة الفهرس مع لقطة كتالوج جديدة (المنتجات غير المفعلة لا تُفهرس)
+
+        Returns:
+            tuple: (عدد العناصر المفهرسة من جديد، عدد العناصر المحذوفة)
+        """
+        current: Dict[EntryKey, dict] = {}
+        for product in products:
+            if product.get("is_active") is True:
+                current[(PRODUCT, product["id"])] = product
+        for category in categories:
+            current[(CATEGORY, category["id"])] = category
+
+        removed = [key for key in self._entries if key not in current]
+        for key in removed:
+            self._remove(key)
+
+        reindexed = 0
+        for key, doc in current.items():
+            fingerprint = self._fingerprint(doc)
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint:
+                # النص لم يتغير: تحديث المستند فقط (السعر والحالة تُعرض منه)
+                entry.doc = doc
+                continue
+            if entry is not None:
+                self._remove(key)
+            self._add(key, doc, fingerprint)
+            reindexed += 1
+
+        self._results.clear()
+        self._terms_gauge.set(len(self._postings))
+        self._entries_gauge.set(len(self._entries))
+        return reindexed, len(removed)
+
+    def _posting(self, term: str) -> Optional[Dict[EntryKey, float]]:
+        posting = self._postings.get(term)
+        if posting is None and len(term) > MAX_PREFIX:
+            # الكلمة الكاملة مفهرسة بطولها لكن البادئات تتوقف عند MAX_PREFIX
+            posting = self._postings.get(term[:MAX_PREFIX])
+        if posting is None and term.endswith("ه") and len(term) > 3:
+            # "بطاقه" (بطاقة بعد التطبيع) تطابق "بطاقات" و"بطاقتي"
+            posting = self._postings.get(term[:-1])
+        return posting
+
+    def _rank(self, terms: List[str], kind: Optional[str], limit: int) -> List[EntryKey]:
+        postings = []
+        for term in terms:
+            posting = self._posting(term)
+            if not posting:
+                return []
+            postings.append(posting)
+        if not postings:
+            return []
+
+        # البدء بأصغر قائمة ثم التقاطع مع الباقي
+        postings.sort(key=len)
+        scores = {
+            key: weight for key, weight in postings[0].items()
+            if kind is None or key[0] == kind
+        }
+        for posting in postings[1:]:
+            scores = {key: score + posting[key] for key, score in scores.items() if key in posting}
+            if not scores:
+                return []
+
+        return heapq.nsmallest(limit, scores, key=lambda key: (-scores[key], self._entries[key].name_length))
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """
+        أفضل النتائج المطابقة لكل كلمات الاستعلام
+
+        Args:
+            kind: PRODUCT أو CATEGORY أو None للنوعين
+
+        Returns:
+            list: المستندات مرتبة حسب الوزن ثم قصر الاسم
+        """
+        start = time.perf_counter()
+        try:
+            cache_key = (tuple(query_terms(query)), kind, limit)
+            results = self._results.get(cache_key)
+            if results is None:
+                results = [self._entries[key].doc for key in self._rank(list(cache_key[0]), kind, limit)]
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results.clear()
+                self._results[cache_key] = results
+            return list(results)
+        finally:
+            self._search_time.observe(time.perf_counter() - start)
+
+    def similar_words(self, term: str, deadline: float) -> List[Tuple[str, float]]:
+        """
+        كلمات الكتالوج الأقرب لكلمة غير موجودة
+
+        المرشحون هم الكلمات التي تشارك الكلمة ثلاثية واحدة على الأقل، والتشابه هو الأعلى من
+        معامل Dice على الثلاثيات ونسبة مسافة التحرير (الثلاثيات وحدها ضعيفة في الكلمات القصيرة)
+
+        Returns:
+            list: حتى FUZZY_CANDIDATES من (الكلمة، التشابه) بترتيب تنازلي
+        """
+        query_trigrams = trigrams(term)
+        shared: Dict[str, int] = {}
+        for trigram in query_trigrams:
+            words = self._trigrams.get(trigram)
+            if not words or len(words) > MAX_TRIGRAM_FANOUT:
+                continue
+            for word in words:
+                shared[word] = shared.get(word, 0) + 1
+            if time.perf_counter() > deadline:
+                self._budget_exceeded.inc()
+                break
+
+        max_distance = 1 if len(term) <= 5 else 2
+        scored = []
+        # الأكثر اشتراكاً في الثلاثيات أولاً حتى تُفحص أفضل المرشحات قبل انتهاء الميزانية
+        for index, (word, count) in enumerate(sorted(shared.items(), key=lambda item: -item[1])):
+            # عدد ثلاثيات الكلمة مع علامتي البداية والنهاية = طولها
+            similarity = 2 * count / (len(query_trigrams) + len(word))
+            if abs(len(word) - len(term)) <= max_distance:
+                distance = edit_distance(term, word, max_distance)
+                if distance <= max_distance:
+                    similarity = max(similarity, 1 - distance / max(len(term), len(word)))
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((word, similarity))
+            if index % 64 == 63 and time.perf_counter() > deadline:
+                self._budget_exceeded.inc()
+                break
+
+        return heapq.nlargest(
+            FUZZY_CANDIDATES, scored,
+            key=lambda candidate: (candidate[1], self._vocabulary[candidate[0]])
+        )
+
+    def _popularity_score(self, key: EntryKey) -> float:
+        if not self._max_popularity:
+            return 0.0
+        return math.log1p(self._popularity.get(key, 0)) / math.log1p(self._max_popularity)
+
+    def suggest(self, query: str, limit: int = 5, budget_ms: Optional[float] = None) -> Optional[Suggestion]:
+        """
+        اقتراحات "هل تقصد" لاستعلام بدون نتائج مطابقة
+
+        الكلمات الموجودة في الفهرس تبقى كما هي، والكلمات غير الموجودة تُستبدل بأقرب كلمات الكتالوج،
+        ثم تُجرب أفضل التركيبات حتى انتهاء الميزانية الزمنية
+
+        Returns:
+            Suggestion أو None إذا لم توجد كلمات قريبة بما يكفي
+        """
+        start = time.perf_counter()
+        deadline = start + (FUZZY_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+        try:
+            options: List[List[Tuple[str, float]]] = []
+            for term in query_terms(query):
+                if self._posting(term):
+                    options.append([(term, 1.0)])
+                    continue
+                candidates = self.similar_words(term, deadline) if len(term) >= 3 else []
+                if not candidates:
+                    return None
+                options.append(candidates)
+            if not options or all(len(option) == 1 and option[0][1] == 1.0 for option in options):
+                return None
+
+            combinations = sorted(
+                itertools.islice(itertools.product(*options), FUZZY_COMBINATIONS * 4),
+                key=lambda combination: -sum(similarity for _, similarity in combination)
+            )[:FUZZY_COMBINATIONS]
+
+            best: Optional[Tuple[str, float]] = None
+            scores: Dict[EntryKey, float] = {}
+            for combination in combinations:
+                words = [word for word, _ in combination]
+                similarity = sum(similarity for _, similarity in combination) / len(combination)
+                keys = self._rank(words, None, limit)
+                if keys and best is None:
+                    best = (" ".join(words), similarity)
+                for key in keys:
+                    score = similarity + POPULARITY_WEIGHT * self._popularity_score(key)
+                    scores[key] = max(scores.get(key, 0.0), score)
+                if time.perf_counter() > deadline:
+                    self._budget_exceeded.inc()
+                    break
+
+            if best is None:
+                return None
+            ranked = heapq.nlargest(limit, scores, key=scores.get)
+            return Suggestion(best[0], best[1], [(key[0], self._entries[key].doc) for key in ranked])
+        finally:
+            self._suggest_time.observe(time.perf_counter() - start)
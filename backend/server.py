@@ -1,5 +1,5 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,17 +9,40 @@ from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
+import time
 from datetime import datetime, timezone
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from inventory import allocate_code, claim_code, category_in_stock, InventoryService, stock_status, LOW_STOCK_THRESHOLD
+from reporting import build_report, report_range
+from order_search import search_orders
+from code_import import (
+    import_codes, import_stream, open_job, fail_job, running_jobs, ImportResult, ParsedCode, ProgressMessage,
+    DOCUMENT_EXTENSIONS, MAX_DOCUMENT_SIZE, JOB_RESUMED, JOB_RUNNING
+)
+from rollups import day_key, ensure_rollups, order_totals, rebuild_rollups, record_signup, signup_total, update_order_status
+from purchase_engine import execute_purchase
+from update_queue import UpdateDispatcher
+from update_dedup import UpdateDeduplicator, DEDUP_BACKEND
+from callback_router import CallbackRouter
+from conversation import ConversationMachine, parse_float, parse_int
+from command_aliases import AliasTable
+from aliases_config import USER_COMMANDS, USER_SHORTCUTS
+from telegram_sender import SendScheduler, InstrumentedRequest, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+import http_clients
+from session_store import SessionStore
+from user_cache import UserCache, request_scope as user_request_scope
+from catalog_cache import CatalogCache
+from search_index import PRODUCT, CATEGORY
+import metrics
+from mongo_metrics import MongoCommandMetrics
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Telegram Bots
@@ -32,8 +55,16 @@ ADMIN_SUPPORT_USERNAME = "AbodStoreVIP"  # معرف الدعم الفني
 
 # إعدادات الدفع المحلي بالدولار فقط
 
-user_bot = Bot(token=USER_BOT_TOKEN)
-admin_bot = Bot(token=ADMIN_BOT_TOKEN)
+user_bot = Bot(token=USER_BOT_TOKEN, request=InstrumentedRequest("user"))
+admin_bot = Bot(token=ADMIN_BOT_TOKEN, request=InstrumentedRequest("admin"))
+
+# جدولة الرسائل الصادرة (حدود تليجرام + أولويات + إعادة المحاولة)
+user_sender = SendScheduler("user", user_bot)
+admin_sender = SendScheduler("admin", admin_bot)
+
+# جداول مسارات الأزرار (callback_data) - المعالجات تُسجل بالمزخرفات
+user_callbacks = CallbackRouter("user")
+admin_callbacks = CallbackRouter("admin")
 
 # Create the main app
 app = FastAPI()
@@ -139,25 +170,25 @@ class TelegramSession(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Session management
+# الجلسات تُقرأ من الذاكرة وتُكتب لقاعدة البيانات في الخلفية (session_store.py)
+user_session_store = SessionStore("user", db.user_sessions)
+admin_session_store = SessionStore("admin", db.admin_sessions)
+
 async def get_session(telegram_id: int, is_admin: bool = False):
-    collection = db.admin_sessions if is_admin else db.user_sessions
-    session = await collection.find_one({"telegram_id": telegram_id})
+    store = admin_session_store if is_admin else user_session_store
+    session = await store.get(telegram_id)
     if session:
         return TelegramSession(**session)
     return None
 
 async def save_session(session: TelegramSession, is_admin: bool = False):
-    collection = db.admin_sessions if is_admin else db.user_sessions
+    store = admin_session_store if is_admin else user_session_store
     session.updated_at = datetime.now(timezone.utc)
-    await collection.replace_one(
-        {"telegram_id": session.telegram_id},
-        session.dict(),
-        upsert=True
-    )
+    store.put(session.dict())
 
 async def clear_session(telegram_id: int, is_admin: bool = False):
-    collection = db.admin_sessions if is_admin else db.user_sessions
-    await collection.delete_one({"telegram_id": telegram_id})
+    store = admin_session_store if is_admin else user_session_store
+    store.delete(telegram_id)
 
 # Admin session helpers
 async def clear_admin_session(telegram_id: int, is_admin: bool = True):
@@ -176,20 +207,28 @@ async def set_admin_session(telegram_id: int, state: str, data: dict = None, is_
     await save_session(session, is_admin)
 
 # User management helpers
+# بيانات المستخدمين تُقرأ من الذاكرة ويجب إبطالها بعد أي كتابة على db.users
+user_cache = UserCache(db.users)
+
+# المنتجات والفئات تُقرأ من الذاكرة، وكل تعديل إداري يجب أن يستدعي catalog.bump()
+catalog = CatalogCache(db)
+
+# إحصائيات المخزون لكل الفئات (عدادات inventory_counters مشتركة بين البوت والواجهة)
+inventory = InventoryService(db)
+
 async def get_user(telegram_id: int):
     """الحصول على بيانات المستخدم"""
-    return await db.users.find_one({"telegram_id": telegram_id})
+    return await user_cache.get(telegram_id)
 # User bot handlers
-async def send_user_message(telegram_id: int, text: str, keyboard: Optional[InlineKeyboardMarkup] = None):
-    try:
-        await user_bot.send_message(
-            chat_id=telegram_id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
-        )
-    except TelegramError as e:
-        logging.error(f"Failed to send user message to {telegram_id}: {e}")
+async def send_user_message(telegram_id: int, text: str, keyboard: Optional[InlineKeyboardMarkup] = None, priority: int = PRIORITY_NORMAL):
+    """جدولة رسالة للعميل (لا تنتظر الإرسال الفعلي)"""
+    await user_sender.send_message(
+        telegram_id,
+        priority,
+        text=text,
+        reply_markup=keyboard,
+        parse_mode=ParseMode.MARKDOWN
+    )
 
 # دوال المحفظة المحلية بالدولار
 
@@ -221,16 +260,28 @@ async def set_persistent_menu(telegram_id: int):
     except Exception as e:
         logging.error(f"Failed to set persistent menu: {e}")
 
-async def send_admin_message(telegram_id: int, text: str, keyboard: Optional[InlineKeyboardMarkup] = None):
-    try:
-        await admin_bot.send_message(
-            chat_id=telegram_id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
-        )
-    except TelegramError as e:
-        logging.error(f"Failed to send admin message to {telegram_id}: {e}")
+async def send_admin_message(telegram_id: int, text: str, keyboard: Optional[InlineKeyboardMarkup] = None, priority: int = PRIORITY_NORMAL):
+    """جدولة رسالة للإدارة (لا تنتظر الإرسال الفعلي)"""
+    await admin_sender.send_message(
+        telegram_id,
+        priority,
+        text=text,
+        reply_markup=keyboard,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+# جداول حالات الإدخال النصي متعدد الخطوات - المعالجات تُسجل بالمزخرفات (conversation.py)
+user_conversation = ConversationMachine("user", user_session_store, send_user_message)
+admin_conversation = ConversationMachine("admin", admin_session_store, send_admin_message)
+
+# جدول الأوامر والاختصارات النصية لبوت المستخدمين (command_aliases.py)
+user_aliases = AliasTable("user", USER_COMMANDS, USER_SHORTCUTS)
+
+# مهلة أطول لإدخالات قد تتطلب تجهيز بيانات خارج البوت (أكواد، تنفيذ طلب)
+LONG_INPUT_TTL = float(os.environ.get('CONVERSATION_LONG_INPUT_TTL', '3600'))
+
+# عدد الأسطر الذي تظهر بعده رسالة تقدم أثناء إضافة الأكواد
+CODE_IMPORT_PROGRESS_LINES = int(os.environ.get('CODE_IMPORT_PROGRESS_LINES', '200'))
 
 async def create_user_keyboard():
     keyboard = [
@@ -383,7 +434,7 @@ async def handle_back_button(telegram_id: int, is_admin: bool = False):
         await send_admin_message(telegram_id, message, keyboard)
     else:
         # الحصول على بيانات المستخدم المحدثة
-        user = await db.users.find_one({"telegram_id": telegram_id})
+        user = await user_cache.get(telegram_id)
         balance = user.get('balance', 0) if user else 0
         name = user.get('first_name', 'صديق') if user else 'صديق'
         
@@ -395,6 +446,7 @@ async def handle_back_button(telegram_id: int, is_admin: bool = False):
 تم إلغاء العملية السابقة. اختر ما تريد القيام به:"""
         await send_user_message(telegram_id, message, keyboard)
 
+@user_callbacks.exact("special_offers")
 async def handle_special_offers(telegram_id: int):
     """عرض العروض الخاصة"""
     # استيراد العروض من ملف التكوين
@@ -409,6 +461,7 @@ async def handle_special_offers(telegram_id: int):
     
     await send_user_message(telegram_id, offers_text, keyboard)
 
+@user_callbacks.exact("about_store")
 async def handle_about_store(telegram_id: int):
     """معلومات عن المتجر"""
     about_text = """ℹ️ *معلومات عن Abod Card*
@@ -441,10 +494,11 @@ async def handle_about_store(telegram_id: int):
     
     await send_user_message(telegram_id, about_text, keyboard)
 
+@user_callbacks.exact("refresh_data")
 async def handle_refresh_user_data(telegram_id: int):
     """تحديث بيانات المستخدم"""
     # الحصول على بيانات المستخدم الحديثة
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     
     if user:
         orders_count = user.get('orders_count', 0)
@@ -476,6 +530,7 @@ async def handle_refresh_user_data(telegram_id: int):
     
     await send_user_message(telegram_id, refresh_text, keyboard)
 
+@user_callbacks.exact("spending_details")
 async def handle_spending_details(telegram_id: int):
     """عرض تفاصيل الإنفاق للمستخدم"""
     # الحصول على الطلبات المكتملة للمستخدم
@@ -524,6 +579,7 @@ async def handle_spending_details(telegram_id: int):
     
     await send_user_message(telegram_id, spending_text, keyboard)
 
+@user_callbacks.exact("daily_surprises")
 async def handle_daily_surprises(telegram_id: int):
     """مفاجآت وعروض اليوم"""
     import random
@@ -565,6 +621,7 @@ async def handle_daily_surprises(telegram_id: int):
     
     await send_user_message(telegram_id, surprises_text, keyboard)
 
+@user_callbacks.exact("show_full_menu")
 async def handle_show_full_menu(telegram_id: int):
     """عرض القائمة الكاملة مع جميع الأوامر"""
     full_menu_text = """📋 **القائمة الكاملة - جميع الأوامر** 📋
@@ -655,6 +712,7 @@ async def handle_full_menu_command(telegram_id: int):
     """معالج أمر /menu - عرض القائمة الكاملة"""
     await handle_fast_menu(telegram_id)
 
+@user_callbacks.exact("quick_access")
 async def handle_quick_access(telegram_id: int):
     """قائمة الوصول السريع للخدمات الأساسية"""
     quick_access_text = """⚡ **الوصول السريع** ⚡
@@ -803,6 +861,7 @@ async def handle_support(telegram_id: int):
     
     await send_user_message(telegram_id, support_text, keyboard)
 
+@user_callbacks.exact("faq")
 async def handle_faq(telegram_id: int):
     """الأسئلة الشائعة"""
     faq_text = """❓ *الأسئلة الشائعة* ❓
@@ -838,6 +897,7 @@ async def handle_faq(telegram_id: int):
     
     await send_user_message(telegram_id, faq_text, keyboard)
 
+@user_callbacks.exact("submit_complaint")
 async def handle_submit_complaint(telegram_id: int):
     """تقديم شكوى"""
     complaint_text = f"""📋 *تقديم شكوى أو اقتراح* 📋
@@ -892,7 +952,7 @@ async def create_admin_keyboard():
 
 async def handle_user_start(telegram_id: int, username: str = None, first_name: str = None):
     # تحقق من وجود المستخدم وإنشاؤه إذا لم يكن موجوداً
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if not user:
         new_user = User(
             telegram_id=telegram_id,
@@ -901,6 +961,8 @@ async def handle_user_start(telegram_id: int, username: str = None, first_name:
             join_date=datetime.now(timezone.utc)
         )
         await db.users.insert_one(new_user.dict())
+        user_cache.invalidate(telegram_id)
+        await record_signup(db, new_user.dict())
         
         # إشعار الإدارة بمستخدم جديد
         admin_message = f"""👋 *عميل جديد انضم لمتجر Abod Card!*
@@ -912,7 +974,7 @@ async def handle_user_start(telegram_id: int, username: str = None, first_name:
 
 🎉 مرحباً بالعميل الجديد في عائلة Abod Card الرقمية! ✨"""
         
-        await send_admin_message(ADMIN_ID, admin_message)
+        await send_admin_message(ADMIN_ID, admin_message, priority=PRIORITY_LOW)
         user = new_user.dict()
     
     # تعيين القائمة الدائمة
@@ -969,74 +1031,127 @@ async def handle_admin_start(telegram_id: int):
     keyboard = await create_admin_keyboard()
     await send_admin_message(telegram_id, welcome_message, keyboard)
 
+async def update_route(update: Update, is_admin: bool = False) -> str:
+    """اسم مسار التحديث لمقاييس الزمن: callback:<data>، command:/<cmd>، text:<حالة الجلسة> أو document:<حالة الجلسة>"""
+    if update.callback_query:
+        router = admin_callbacks if is_admin else user_callbacks
+        return "callback:" + router.route_name(update.callback_query.data)
+    if update.message:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            return metrics.route_label(text.split()[0].lower(), prefix="command:")
+        store = admin_session_store if is_admin else user_session_store
+        session = await store.get(update.message.chat_id)
+        prefix = "document:" if update.message.document else "text:"
+        return metrics.route_label((session or {}).get("state") or "text", prefix=prefix)
+    return "other"
+
+async def process_user_update(update_data: dict):
+    """معالجة تحديث بوت المستخدمين (تعمل داخل عمال الطابور)"""
+    with user_request_scope():
+        update = Update.de_json(update_data, user_bot)
+        route = await update_route(update)
+        with metrics.histogram("handler_seconds", bot="user", route=route).time():
+            await dispatch_user_update(update)
+
+async def dispatch_user_update(update: Update):
+    if update.message:
+        # Handle web app data
+        if update.message.web_app_data:
+            await handle_web_app_data(update.message)
+        # معالجة الرسائل العادية
+        elif update.message.text:
+            await handle_user_message(update.message)
+        # معالجة دفعات النجوم المحذوفة
+    
+    # معالجة الـ callback queries
+    elif update.callback_query:
+        try:
+            await handle_user_callback(update.callback_query)
+            # Answer the callback query to remove loading state
+            await update.callback_query.answer()
+        except Exception as callback_error:
+            logging.error(f"User callback error: {callback_error}")
+            # Try to answer the callback even if processing failed
+            try:
+                await update.callback_query.answer("حدث خطأ، يرجى المحاولة مرة أخرى")
+            except:
+                pass
+    
+    # معالجة pre-checkout query المحذوفة
+
+async def process_admin_update(update_data: dict):
+    """معالجة تحديث بوت الإدارة (تعمل داخل عمال الطابور)"""
+    with user_request_scope():
+        update = Update.de_json(update_data, admin_bot)
+        route = await update_route(update, is_admin=True)
+        with metrics.histogram("handler_seconds", bot="admin", route=route).time():
+            await dispatch_admin_update(update)
+
+async def dispatch_admin_update(update: Update):
+    if update.message:
+        await handle_admin_message(update.message)
+    elif update.callback_query:
+        try:
+            await handle_admin_callback(update.callback_query)
+            # Answer the callback query to remove loading state
+            await update.callback_query.answer()
+        except Exception as callback_error:
+            logging.error(f"Admin callback error: {callback_error}")
+            # Try to answer the callback even if processing failed
+            try:
+                await update.callback_query.answer("حدث خطأ، يرجى المحاولة مرة أخرى")
+            except:
+                pass
+
+# طوابير التحديثات - الـ webhook يرد فوراً والمعالجة تتم في الخلفية
+user_update_dispatcher = UpdateDispatcher("user", process_user_update)
+admin_update_dispatcher = UpdateDispatcher("admin", process_admin_update)
+
+# تجاهل التحديثات المكررة عند إعادة الإرسال من تليجرام
+dedup_store = db if DEDUP_BACKEND == "mongo" else None
+user_update_dedup = UpdateDeduplicator("user", dedup_store)
+admin_update_dedup = UpdateDeduplicator("admin", dedup_store)
+
+async def read_webhook_update(request: Request) -> dict:
+    """قراءة التحديث والتحقق من صحته قبل إضافته للطابور"""
+    try:
+        update_data = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    if not isinstance(update_data, dict) or not isinstance(update_data.get("update_id"), int):
+        raise HTTPException(status_code=400, detail="Invalid Telegram update")
+    return update_data
+
+async def enqueue_webhook_update(dispatcher: UpdateDispatcher, dedup: UpdateDeduplicator, update_data: dict):
+    """إضافة التحديث للطابور أو رفضه بـ 503 عند الامتلاء ليعيد تليجرام المحاولة"""
+    update_id = update_data["update_id"]
+    if await dedup.is_duplicate(update_id):
+        return {"status": "ok", "duplicate": True}
+    
+    if not await dispatcher.submit(update_data):
+        # السماح بقبول التحديث عند إعادة المحاولة
+        await dedup.forget(update_id)
+        raise HTTPException(status_code=503, detail="Update queue is full, retry later")
+    return {"status": "ok"}
+
 # API Routes
 @api_router.post("/webhook/user/{secret}")
 async def user_webhook(secret: str, request: Request):
     if secret != "abod_user_webhook_secret":
         raise HTTPException(status_code=403, detail="Invalid webhook secret")
     
-    try:
-        update_data = await request.json()
-        update = Update.de_json(update_data, user_bot)
-        
-        if update.message:
-            # Handle web app data
-            if update.message.web_app_data:
-                await handle_web_app_data(update.message)
-            # معالجة الرسائل العادية
-            elif update.message.text:
-                await handle_user_message(update.message)
-            # معالجة دفعات النجوم المحذوفة
-        
-        # معالجة الـ callback queries
-        elif update.callback_query:
-            try:
-                await handle_user_callback(update.callback_query)
-                # Answer the callback query to remove loading state
-                await update.callback_query.answer()
-            except Exception as callback_error:
-                logging.error(f"User callback error: {callback_error}")
-                # Try to answer the callback even if processing failed
-                try:
-                    await update.callback_query.answer("حدث خطأ، يرجى المحاولة مرة أخرى")
-                except:
-                    pass
-        
-        # معالجة pre-checkout query المحذوفة
-        
-        return {"status": "ok"}
-    except Exception as e:
-        logging.error(f"User webhook error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    update_data = await read_webhook_update(request)
+    return await enqueue_webhook_update(user_update_dispatcher, user_update_dedup, update_data)
 
 @api_router.post("/webhook/admin/{secret}")
 async def admin_webhook(secret: str, request: Request):
     if secret != "abod_admin_webhook_secret":
         raise HTTPException(status_code=403, detail="Invalid webhook secret")
     
-    try:
-        update_data = await request.json()
-        update = Update.de_json(update_data, admin_bot)
-        
-        if update.message:
-            await handle_admin_message(update.message)
-        elif update.callback_query:
-            try:
-                await handle_admin_callback(update.callback_query)
-                # Answer the callback query to remove loading state
-                await update.callback_query.answer()
-            except Exception as callback_error:
-                logging.error(f"Admin callback error: {callback_error}")
-                # Try to answer the callback even if processing failed
-                try:
-                    await update.callback_query.answer("حدث خطأ، يرجى المحاولة مرة أخرى")
-                except:
-                    pass
-            
-        return {"status": "ok"}
-    except Exception as e:
-        logging.error(f"Admin webhook error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    update_data = await read_webhook_update(request)
+    return await enqueue_webhook_update(admin_update_dispatcher, admin_update_dedup, update_data)
 
 async def handle_web_app_data(message):
     """معالجة بيانات Web App"""
@@ -1105,11 +1220,9 @@ async def handle_web_app_wallet_action(telegram_id: int, data: dict):
 async def handle_user_message(message):
     telegram_id = message.chat_id
     text = message.text
-    username = message.from_user.username
-    first_name = message.from_user.first_name
     
     # Check if user is banned
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if user and user.get('is_banned', False):
         ban_reason = user.get('ban_reason', 'غير محدد')
         ban_message = f"""🚫 *حسابك محظور*
@@ -1121,39 +1234,56 @@ async def handle_user_message(message):
         await send_user_message(telegram_id, ban_message)
         return
     
-    if text == "/start":
-        await handle_user_start(telegram_id, username, first_name)
-    elif text == "/menu":
-        await handle_fast_menu(telegram_id)
-    elif text.lower() in ["/help", "/مساعدة", "مساعدة", "help"]:
-        await handle_help_command(telegram_id)
-    elif text.lower() in ["/shop", "shop"]:
-        await handle_browse_products(telegram_id)
-    elif text.lower() in ["/wallet", "wallet"]: 
-        await handle_user_wallet_info(telegram_id)
-    elif text.lower() in ["/orders", "orders"]:
-        await handle_order_history(telegram_id)
-    elif text.lower() in ["/support", "support"]:
-        await handle_support(telegram_id)
+    # الأوامر والاختصارات النصية (aliases_config.py) - بحث واحد في جدول مطبّع
+    alias = user_aliases.resolve(text)
+    if alias is not None and alias.command:
+        await user_aliases.dispatch(alias, message)
     elif text.startswith("/search") or text.startswith("🔍"):
         # ميزة البحث الجديدة
         search_query = text.replace("/search", "").replace("🔍", "").strip()
         if search_query:
             await handle_user_search(telegram_id, search_query)
         else:
-            await user_bot.send_message(
+            await send_user_message(
                 telegram_id, 
-                "🔍 *البحث في المتجر*\n\nاستخدم:\n`/search اسم المنتج`\nأو\n`🔍 اسم المنتج`\n\n*مثال:*\n`/search ببجي`", 
-                parse_mode="Markdown"
+                "🔍 *البحث في المتجر*\n\nاستخدم:\n`/search اسم المنتج`\nأو\n`🔍 اسم المنتج`\n\n*مثال:*\n`/search ببجي`"
             )
     else:
-        # Handle text input based on session state
+        # Handle text input based on session state (user_conversation)
         session = await get_session(telegram_id)
-        if session:
-            if session.state == "wallet_topup_amount":
-                try:
-                    amount = float(text)
-                    topup_text = f"""💰 *طلب شحن المحفظة*
+        if session and await user_conversation.handle(telegram_id, text, session):
+            return
+        
+        # Menu numbers and text shortcuts (aliases_config.USER_SHORTCUTS)
+        if alias is not None:
+            await user_aliases.dispatch(alias, message)
+        elif text.isdigit() and len(text) == 1:
+            await send_user_message(telegram_id, "❌ رقم غير صحيح. يرجى اختيار رقم من 1-8")
+        elif len(text) > 2 and not text.startswith('/'):
+            # Try to search for the text as a product/category name
+            await handle_user_search(telegram_id, text)
+        else:
+            # Enhanced help message for unknown text
+            await handle_enhanced_help_for_unknown_input(telegram_id, text)
+
+# معالجات الأوامر والاختصارات النصية، وتُستدعى بـ (message)
+user_aliases.bind("start", lambda message: handle_user_start(
+    message.chat_id, message.from_user.username, message.from_user.first_name
+))
+user_aliases.bind("menu", lambda message: handle_fast_menu(message.chat_id))
+user_aliases.bind("help", lambda message: handle_help_command(message.chat_id))
+user_aliases.bind("shop", lambda message: handle_browse_products(message.chat_id))
+user_aliases.bind("wallet", lambda message: handle_user_wallet_info(message.chat_id))
+user_aliases.bind("orders", lambda message: handle_order_history(message.chat_id))
+user_aliases.bind("support", lambda message: handle_support(message.chat_id))
+user_aliases.bind("offers", lambda message: handle_special_offers(message.chat_id))
+user_aliases.bind("about", lambda message: handle_about_store(message.chat_id))
+user_aliases.bind("refresh", lambda message: handle_refresh_user_data(message.chat_id))
+user_aliases.bind("daily", lambda message: handle_daily_surprises(message.chat_id))
+
+@user_conversation.state("wallet_topup_amount", validate=parse_float, error="❌ يرجى إدخال رقم صحيح")
+async def handle_wallet_topup_amount_step(telegram_id: int, amount: float, session: TelegramSession):
+    topup_text = f"""💰 *طلب شحن المحفظة*
 
 المبلغ المطلوب: *{amount} دولار*
 
@@ -1161,79 +1291,19 @@ async def handle_user_message(message):
 @AbodStoreVIP
 
 أرسل لهم هذا المبلغ وإيدي حسابك: `{telegram_id}`"""
-                    
-                    back_keyboard = InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
-                    ])
-                    await send_user_message(telegram_id, topup_text, back_keyboard)
-                    await clear_session(telegram_id)
-                except ValueError:
-                    await send_user_message(telegram_id, "❌ يرجى إدخال رقم صحيح")
-            
-            # Handle purchase input from users
-            elif session.state == "purchase_input_phone":
-                await handle_user_phone_input(telegram_id, text, session)
-            
-            elif session.state == "purchase_input_email":
-                await handle_user_email_input(telegram_id, text, session)
-            
-            elif session.state == "purchase_input_id":
-                await handle_user_id_input(telegram_id, text, session)
-        else:
-            # Handle direct menu numbers when no session exists
-            if text.isdigit() and len(text) == 1:
-                menu_number = int(text)
-                # Direct response - no loading messages for better speed
-                if menu_number == 1:
-                    await handle_browse_products(telegram_id)
-                elif menu_number == 2:
-                    await handle_user_wallet_info(telegram_id)
-                elif menu_number == 3:
-                    await handle_order_history(telegram_id)
-                elif menu_number == 4:
-                    await handle_special_offers(telegram_id)
-                elif menu_number == 5:
-                    await handle_support(telegram_id)
-                elif menu_number == 6:
-                    await handle_about_store(telegram_id)
-                elif menu_number == 7:
-                    await handle_refresh_user_data(telegram_id)
-                elif menu_number == 8:
-                    await handle_daily_surprises(telegram_id)
-                else:
-                    await send_user_message(telegram_id, "❌ رقم غير صحيح. يرجى اختيار رقم من 1-8")
-            
-            # Handle text shortcuts - direct response for speed
-            elif text.lower() in ["shop", "متجر", "منتجات", "shopping"]:
-                await handle_browse_products(telegram_id)
-            elif text.lower() in ["wallet", "محفظة", "رصيد", "balance"]:
-                await handle_user_wallet_info(telegram_id)
-            elif text.lower() in ["orders", "طلبات", "طلباتي", "history"]:
-                await handle_order_history(telegram_id)
-            elif text.lower() in ["support", "دعم"]:
-                await handle_support(telegram_id)
-            elif text.lower() in ["offers", "عروض", "خصومات", "deals"]:
-                await handle_special_offers(telegram_id)
-            elif text.lower() in ["about", "معلومات", "عنا", "info"]:
-                await handle_about_store(telegram_id)
-            elif text.lower() in ["refresh", "تحديث", "update"]:
-                await handle_refresh_user_data(telegram_id)
-            elif text.lower() in ["daily", "مفاجآت", "اليوم", "surprises"]:
-                await handle_daily_surprises(telegram_id)
-            else:
-                # Try to search for the text as a product/category name
-                if len(text) > 2 and not text.startswith('/'):
-                    await handle_user_search(telegram_id, text)
-                else:
-                    # Enhanced help message for unknown text
-                    await handle_enhanced_help_for_unknown_input(telegram_id, text)
+    
+    back_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
+    ])
+    await send_user_message(telegram_id, topup_text, back_keyboard)
+    await clear_session(telegram_id)
 
 async def handle_user_callback(callback_query):
     telegram_id = callback_query.message.chat_id
     data = callback_query.data
     
     # Check if user is banned
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if user and user.get('is_banned', False):
         ban_reason = user.get('ban_reason', 'غير محدد')
         ban_message = f"""🚫 *حسابك محظور*
@@ -1246,117 +1316,33 @@ async def handle_user_callback(callback_query):
         return
     
     # No loading animations - direct response for better performance
-    
-    if data == "main_menu":
-        keyboard = await create_user_keyboard()
-        await send_user_message(telegram_id, "🏠 مرحباً بك في القائمة الرئيسية!", keyboard)
-        await clear_session(telegram_id)
-    
-    elif data == "browse_products":
-        await handle_browse_products(telegram_id)
-    
-    elif data == "browse_traditional":
-        await handle_browse_traditional(telegram_id)
-    
-    elif data == "view_wallet":
-        await handle_user_wallet_info(telegram_id)
-    
-    elif data == "topup_wallet":
-        await handle_topup_wallet(telegram_id)
-    
-    elif data == "wallet":
-        await show_user_wallet(telegram_id)
-    
-    elif data == "request_topup":
-        await handle_user_topup_request(telegram_id)
-    
-    elif data.startswith("select_payment_method_"):
-        method_id = data.replace("select_payment_method_", "")
-        await handle_user_select_payment_method(telegram_id, method_id)
-    
-    # معالجات النجوم المحذوفة
-    
-    elif data == "support":
-        support_text = """📞 *الدعم الفني*
+    await user_callbacks.dispatch(telegram_id, data)
+
+# مسارات أزرار بوت المستخدمين التي لا تقابل دالة معالجة مباشرة
+# (باقي المسارات مسجلة بالمزخرفات فوق دوال المعالجة نفسها)
+@user_callbacks.exact("main_menu")
+async def handle_user_main_menu_callback(telegram_id: int):
+    keyboard = await create_user_keyboard()
+    await send_user_message(telegram_id, "🏠 مرحباً بك في القائمة الرئيسية!", keyboard)
+    await clear_session(telegram_id)
+
+@user_callbacks.exact("support")
+async def handle_support_callback(telegram_id: int):
+    support_text = """📞 *الدعم الفني*
 
 للحصول على المساعدة، يرجى التواصل مع فريق الدعم:
 @AbodStoreVIP
 
 سيقوم فريقنا بالرد عليك في أقرب وقت ممكن."""
-        
-        back_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
-        ])
-        await send_user_message(telegram_id, support_text, back_keyboard)
-    
-    elif data == "order_history":
-        await handle_order_history(telegram_id)
-    
-    elif data == "orders_completed":
-        await handle_orders_by_status(telegram_id, "completed")
-    
-    elif data == "orders_pending":
-        await handle_orders_by_status(telegram_id, "pending")
-    
-    elif data == "orders_failed":
-        await handle_orders_by_status(telegram_id, "failed")
-    
-    elif data.startswith("order_details_"):
-        order_id = data.replace("order_details_", "")
-        await handle_user_order_details(telegram_id, order_id)
     
-    elif data.startswith("download_report_"):
-        order_id = data.replace("download_report_", "")
-        await handle_download_order_report(telegram_id, order_id, is_admin=False)
-    
-    elif data.startswith("product_"):
-        product_id = data.replace("product_", "")
-        await handle_user_product_selection(telegram_id, product_id)
-    
-    elif data.startswith("category_"):
-        category_id = data.replace("category_", "")
-        await handle_user_category_selection(telegram_id, category_id)
-    
-    elif data.startswith("buy_category_"):
-        category_id = data.replace("buy_category_", "")
-        await handle_user_purchase(telegram_id, category_id)
-    
-    elif data.startswith("order_details_"):
-        order_id = data.replace("order_details_", "")
-        await handle_user_order_details(telegram_id, order_id)
-    
-    elif data == "back_to_main_menu":
-        await handle_back_button(telegram_id, is_admin=False)
-    
-    elif data == "special_offers":
-        await handle_special_offers(telegram_id)
-    
-    elif data == "about_store":
-        await handle_about_store(telegram_id)
-    
-    elif data == "refresh_data":
-        await handle_refresh_user_data(telegram_id)
-    
-    elif data == "spending_details":
-        await handle_spending_details(telegram_id)
-    
-    elif data == "daily_surprises":
-        await handle_daily_surprises(telegram_id)
-    
-    elif data == "show_full_menu":
-        await handle_show_full_menu(telegram_id)
-    
-    elif data == "quick_access":
-        await handle_quick_access(telegram_id)
-    
-    elif data == "faq":
-        await handle_faq(telegram_id)
-    
-    elif data == "submit_complaint":
-        await handle_submit_complaint(telegram_id)
-    
-    elif data == "new_search":
-        search_help_text = """🔍 *البحث في المتجر*
+    back_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
+    ])
+    await send_user_message(telegram_id, support_text, back_keyboard)
+
+@user_callbacks.exact("new_search")
+async def handle_new_search_callback(telegram_id: int):
+    search_help_text = """🔍 *البحث في المتجر*
 
 أرسل اسم المنتج أو الفئة التي تريد البحث عنها:
 
@@ -1369,14 +1355,21 @@ async def handle_user_callback(callback_query):
 أو استخدم:
 • `/search اسم المنتج`
 • `🔍 اسم المنتج`"""
-        
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🛍️ تصفح المتجر", callback_data="browse_products")],
-            [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="back_to_main_menu")]
-        ])
-        
-        await send_user_message(telegram_id, search_help_text, keyboard)
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🛍️ تصفح المتجر", callback_data="browse_products")],
+        [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="back_to_main_menu")]
+    ])
+    
+    await send_user_message(telegram_id, search_help_text, keyboard)
+
+user_callbacks.add_exact("orders_completed", lambda telegram_id: handle_orders_by_status(telegram_id, "completed"))
+user_callbacks.add_exact("orders_pending", lambda telegram_id: handle_orders_by_status(telegram_id, "pending"))
+user_callbacks.add_exact("orders_failed", lambda telegram_id: handle_orders_by_status(telegram_id, "failed"))
+user_callbacks.add_exact("back_to_main_menu", lambda telegram_id: handle_back_button(telegram_id, is_admin=False))
+user_callbacks.add_prefix("download_report_", lambda telegram_id, order_id: handle_download_order_report(telegram_id, order_id, is_admin=False))
 
+@user_callbacks.exact("browse_products")
 async def handle_browse_products(telegram_id: int):
     """فتح تطبيق Abod Card المذهل"""
     
@@ -1412,9 +1405,10 @@ async def handle_browse_products(telegram_id: int):
     
     await send_user_message(telegram_id, app_text, keyboard)
 
+@user_callbacks.exact("browse_traditional")
 async def handle_browse_traditional(telegram_id: int):
     """واجهة البوت التقليدية للتسوق"""
-    products = await db.products.find({"is_active": True}).to_list(100)
+    products = await catalog.list_product_summaries(await inventory.stock_levels(), active_only=True, limit=100)
     
     if not products:
         no_products_text = """🛍️ *عذراً، المتجر قيد التحديث*
@@ -1430,12 +1424,6 @@ async def handle_browse_traditional(telegram_id: int):
         await send_user_message(telegram_id, no_products_text, back_keyboard)
         return
     
-    # حساب عدد الفئات لكل منتج
-    products_with_categories = []
-    for product in products:
-        categories_count = await db.categories.count_documents({"product_id": product["id"]})
-        products_with_categories.append((product, categories_count))
-    
     text = f"""🛍️ *متجر Abod Card التقليدي*
 
 🎯 لديك {len(products)} منتج متاح للاختيار من بينها
@@ -1445,10 +1433,15 @@ async def handle_browse_traditional(telegram_id: int):
 📦 *اختر المنتج الذي يناسبك:*"""
     
     keyboard = []
-    for i, (product, categories_count) in enumerate(products_with_categories, 1):
+    for i, product in enumerate(products, 1):
         button_text = f"{i}. 📦 {product['name']}"
-        if categories_count > 0:
-            button_text += f" ({categories_count} فئة)"
+        if product["categories_count"] > 0:
+            button_text += f" ({product['categories_count']} فئة"
+            if product["min_price"] is not None:
+                button_text += f" - من ${product['min_price']:.2f}"
+            button_text += ")"
+        if not product["in_stock"]:
+            button_text += " ⏳"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"product_{product['id']}")])
     
     keyboard.extend([
@@ -1459,7 +1452,7 @@ async def handle_browse_traditional(telegram_id: int):
     await send_user_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
 async def handle_view_wallet(telegram_id: int):
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if user:
         balance = user.get("balance", 0.0)
         orders_count = user.get('orders_count', 0)
@@ -1509,13 +1502,14 @@ async def handle_view_wallet(telegram_id: int):
         ])
         await send_user_message(telegram_id, error_text, back_keyboard)
 
+@user_callbacks.exact("topup_wallet")
 async def handle_topup_wallet(telegram_id: int):
     """شحن المحفظة - عرض طرق الدفع المتاحة"""
     try:
         # الحصول على طرق الدفع النشطة
         payment_methods = await db.payment_methods.find({"is_active": True}).to_list(10)
         
-        user = await db.users.find_one({"telegram_id": telegram_id})
+        user = await user_cache.get(telegram_id)
         current_balance = user.get('balance', 0.0) if user else 0.0
         
         topup_text = f"""💳 *شحن المحفظة*
@@ -1559,10 +1553,11 @@ async def handle_topup_wallet(telegram_id: int):
         logging.error(f"Error in topup wallet: {e}")
         await send_user_message(telegram_id, "❌ حدث خطأ في عرض طرق الدفع.")
 
+@user_callbacks.exact("view_wallet")
 async def handle_user_wallet_info(telegram_id: int):
     """عرض معلومات المحفظة المحلية"""
     try:
-        user = await db.users.find_one({"telegram_id": telegram_id})
+        user = await user_cache.get(telegram_id)
         if not user:
             await send_user_message(telegram_id, "❌ لم يتم العثور على حسابك. يرجى البدء من جديد.")
             return
@@ -1598,12 +1593,13 @@ async def handle_user_wallet_info(telegram_id: int):
         logging.error(f"Error in wallet info: {e}")
         await send_user_message(telegram_id, "❌ حدث خطأ في عرض معلومات المحفظة.")
 
+@user_callbacks.exact("wallet")
 async def show_user_wallet(telegram_id: int):
     """عرض محفظة المستخدم"""
     user = await get_user(telegram_id)
     
     if not user:
-        await user_bot.send_message(telegram_id, "❌ خطأ في النظام. يرجى المحاولة مرة أخرى.")
+        await send_user_message(telegram_id, "❌ خطأ في النظام. يرجى المحاولة مرة أخرى.")
         return
     
     balance = user.get('balance', 0.0)
@@ -1637,6 +1633,7 @@ async def show_user_wallet(telegram_id: int):
     
     await send_user_message(telegram_id, wallet_text, keyboard)
 
+@user_callbacks.exact("request_topup")
 async def handle_user_topup_request(telegram_id: int):
     """طلب شحن المحفظة - عرض طرق الدفع المتاحة"""
     try:
@@ -1688,6 +1685,7 @@ async def handle_user_topup_request(telegram_id: int):
         logging.error(f"Error showing payment methods: {e}")
         await send_user_message(telegram_id, "❌ حدث خطأ في تحميل طرق الدفع. يرجى المحاولة مرة أخرى.")
 
+@user_callbacks.prefix("select_payment_method_")
 async def handle_user_select_payment_method(telegram_id: int, method_id: str):
     """معالجة اختيار طريقة الدفع وعرض التعليمات"""
     try:
@@ -1743,10 +1741,7 @@ async def handle_user_select_payment_method(telegram_id: int, method_id: str):
 العميل سيتواصل معك قريباً مع إثبات الدفع."""
         
         for admin_id in ADMIN_IDS:
-            try:
-                await admin_bot.send_message(admin_id, admin_notification, parse_mode="Markdown")
-            except:
-                pass
+            await send_admin_message(admin_id, admin_notification, priority=PRIORITY_LOW)
         
     except Exception as e:
         logging.error(f"Error handling payment method selection: {e}")
@@ -1757,26 +1752,32 @@ async def handle_user_select_payment_method(telegram_id: int, method_id: str):
 async def handle_user_search(telegram_id: int, search_query: str):
     """البحث في المنتجات والفئات"""
     try:
-        # البحث في المنتجات
-        products = await db.products.find({
-            "$and": [
-                {"is_active": True},
-                {"$or": [
-                    {"name": {"$regex": search_query, "$options": "i"}},
-                    {"description": {"$regex": search_query, "$options": "i"}}
-                ]}
-            ]
-        }).to_list(10)
-        
-        # البحث في الفئات
-        categories = await db.categories.find({
-            "$or": [
-                {"name": {"$regex": search_query, "$options": "i"}},
-                {"description": {"$regex": search_query, "$options": "i"}}
-            ]
-        }).to_list(10)
+        # البحث في فهرس الكتالوج (search_index.py) بدلاً من $regex على قاعدة البيانات
+        products = await catalog.search(search_query, kind=PRODUCT, limit=10)
+        categories = await catalog.search(search_query, kind=CATEGORY, limit=10)
         
         if not products and not categories:
+            # اقتراحات "هل تقصد" للأخطاء الإملائية (ببجى، gogle play...)
+            suggestion = await catalog.suggest(search_query)
+            if suggestion is not None:
+                suggestion_text = f"""🔍 *نتائج البحث عن: "{search_query}"*
+
+🤔 هل تقصد: *{suggestion.query}*؟"""
+                
+                keyboard = []
+                for kind, item in suggestion.results:
+                    if kind == PRODUCT:
+                        keyboard.append([InlineKeyboardButton(f"📦 {item['name']}", callback_data=f"product_{item['id']}")])
+                    else:
+                        keyboard.append([InlineKeyboardButton(f"🎯 {item['name']} - ${item['price']:.2f}", callback_data=f"category_{item['id']}")])
+                keyboard.extend([
+                    [InlineKeyboardButton("🔍 بحث جديد", callback_data="new_search")],
+                    [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="back_to_main_menu")]
+                ])
+                
+                await send_user_message(telegram_id, suggestion_text, InlineKeyboardMarkup(keyboard))
+                return
+            
             no_results_text = f"""🔍 *نتائج البحث عن: "{search_query}"*
             
 ❌ لم يتم العثور على نتائج مطابقة
@@ -1827,6 +1828,7 @@ async def handle_user_search(telegram_id: int, search_query: str):
         logging.error(f"Error in user search: {e}")
         await send_user_message(telegram_id, "❌ حدث خطأ أثناء البحث. يرجى المحاولة مرة أخرى.")
 
+@user_callbacks.exact("order_history")
 async def handle_order_history(telegram_id: int):
     """عرض طلبات المستخدم مقسمة حسب الحالة"""
     orders = await db.orders.find({"telegram_id": telegram_id}).sort("order_date", -1).to_list(100)
@@ -2023,7 +2025,7 @@ async def handle_download_order_report(telegram_id: int, order_id: str, is_admin
         img_bytes = create_order_report_image(order)
         
         # إرسال الصورة
-        bot_token = ADMIN_BOT_TOKEN if is_admin else BOT_TOKEN
+        bot_token = ADMIN_BOT_TOKEN if is_admin else USER_BOT_TOKEN
         
         files = {'photo': ('order_report.png', img_bytes, 'image/png')}
         caption = f"""📋 *تقرير الطلب*
@@ -2039,13 +2041,11 @@ async def handle_download_order_report(telegram_id: int, order_id: str, is_admin
             'parse_mode': 'Markdown'
         }
         
-        import httpx
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"https://api.telegram.org/bot{bot_token}/sendPhoto",
-                data=data,
-                files=files
-            )
+        response = await http_clients.request(
+            "telegram", "POST", f"/bot{bot_token}/sendPhoto",
+            data=data,
+            files=files
+        )
         
         if response.status_code == 200:
             success_msg = "✅ تم إرسال التقرير بنجاح!"
@@ -2061,6 +2061,7 @@ async def handle_download_order_report(telegram_id: int, order_id: str, is_admin
         else:
             await send_user_message(telegram_id, error_msg)
 
+@admin_callbacks.prefix("send_report_to_user_")
 async def handle_send_report_to_user(admin_telegram_id: int, order_id: str):
     """إرسال تقرير الطلب للعميل من بوت الإدارة"""
     try:
@@ -2076,7 +2077,7 @@ async def handle_send_report_to_user(admin_telegram_id: int, order_id: str):
         user_telegram_id = order['telegram_id']
         
         # الحصول على معلومات المستخدم
-        user = await db.users.find_one({"telegram_id": user_telegram_id})
+        user = await user_cache.get(user_telegram_id)
         user_name = user.get('first_name', 'العميل') if user else 'العميل'
         
         # إرسال رسالة انتظار للإدارة
@@ -2106,13 +2107,11 @@ async def handle_send_report_to_user(admin_telegram_id: int, order_id: str):
             'parse_mode': 'Markdown'
         }
         
-        import httpx
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"https://api.telegram.org/bot{USER_BOT_TOKEN}/sendPhoto",
-                data=data,
-                files=files
-            )
+        response = await http_clients.request(
+            "telegram", "POST", f"/bot{USER_BOT_TOKEN}/sendPhoto",
+            data=data,
+            files=files
+        )
         
         if response.status_code == 200:
             success_msg = f"""✅ *تم إرسال التقرير بنجاح!*
@@ -2152,7 +2151,14 @@ async def handle_admin_message(message):
         await send_admin_message(telegram_id, unauthorized_message)
         return
     
-    if text == "/start":
+    if message.document:
+        # ملفات الأكواد تُقبل فقط في خطوة إضافة الأكواد (بعد اختيار الفئة ونوع الكود)
+        session = await get_session(telegram_id, is_admin=True)
+        if session and session.state == "add_codes_input" and not admin_conversation.is_expired(session):
+            await handle_admin_codes_document(telegram_id, message.document, session)
+        else:
+            await send_admin_message(telegram_id, "❌ لرفع ملف أكواد اختر الفئة ونوع الكود أولاً من إدارة الأكواد")
+    elif text == "/start":
         await handle_admin_start(telegram_id)
     else:
         # Handle admin text input based on session state
@@ -2168,230 +2174,67 @@ async def handle_admin_callback(callback_query):
     if telegram_id not in ADMIN_IDS:
         return
     
-    if data == "admin_main_menu":
-        keyboard = await create_admin_keyboard()
-        await send_admin_message(telegram_id, "اختر العملية المطلوبة:", keyboard)
-        await clear_session(telegram_id, is_admin=True)
-    
-    elif data == "manage_products":
-        await handle_admin_manage_products(telegram_id)
-    
-    elif data == "manage_users":
-        await handle_admin_manage_users(telegram_id)
-    
-    elif data == "manage_wallet":
-        await handle_admin_manage_wallet(telegram_id)
-    
-    elif data == "view_users":
-        await handle_admin_view_users(telegram_id)
-    
-    elif data == "ban_user":
-        await handle_admin_ban_user(telegram_id)
-    
-    elif data == "unban_user":
-        await handle_admin_unban_user(telegram_id)
-    
-    elif data == "edit_product":
-        await handle_admin_edit_product(telegram_id)
-    
-    elif data == "delete_product":
-        await handle_admin_delete_product(telegram_id)
-    
-    elif data == "manage_codes":
-        await handle_admin_manage_codes(telegram_id)
-    
-    elif data.startswith("edit_product_"):
-        product_id = data.replace("edit_product_", "")
-        await handle_edit_product_selected(telegram_id, product_id)
-    
-    elif data.startswith("delete_product_"):
-        product_id = data.replace("delete_product_", "")
-        await handle_delete_product_confirm(telegram_id, product_id)
-    
-    elif data.startswith("confirm_delete_"):
-        product_id = data.replace("confirm_delete_", "")
-        await handle_product_delete_confirmed(telegram_id, product_id)
-    
-    elif data == "skip_product_name":
-        await handle_skip_product_name(telegram_id)
-    
-    elif data == "reports":
-        await handle_admin_reports(telegram_id)
-    
-    elif data == "manage_orders":
-        await handle_admin_manage_orders(telegram_id)
-    
-    elif data == "manage_orders":
-        await handle_admin_manage_orders(telegram_id)
-    
-    elif data == "search_order":
-        await handle_admin_search_order(telegram_id)
-    
-    elif data == "search_user":
-        await handle_admin_search_user(telegram_id)
-    
-    elif data == "delete_test_data":
-        await handle_admin_delete_test_data_menu(telegram_id)
-    
-    elif data == "confirm_delete_test_data":
-        await handle_admin_confirm_delete_test_data(telegram_id)
-    
-    elif data == "manage_payment_methods":
-        await handle_admin_payment_methods(telegram_id)
-    
-    elif data == "add_payment_method":
-        await handle_admin_add_payment_method(telegram_id)
-    
-    elif data == "edit_payment_method":
-        await handle_admin_edit_payment_method_select(telegram_id)
-    
-    elif data == "delete_payment_method":
-        await handle_admin_delete_payment_method_select(telegram_id)
-    
-    elif data == "toggle_payment_method":
-        await handle_admin_toggle_payment_method_select(telegram_id)
-    
-    elif data.startswith("edit_pm_"):
-        method_id = data.replace("edit_pm_", "")
-        await handle_admin_edit_payment_method(telegram_id, method_id)
-    
-    elif data.startswith("delete_pm_"):
-        method_id = data.replace("delete_pm_", "")
-        await handle_admin_delete_payment_method(telegram_id, method_id)
-    
-    elif data.startswith("toggle_pm_"):
-        method_id = data.replace("toggle_pm_", "")
-        await handle_admin_toggle_payment_method(telegram_id, method_id)
-    
-    elif data.startswith("admin_order_details_"):
-        order_id = data.replace("admin_order_details_", "")
-        await handle_admin_order_details(telegram_id, order_id)
-    
-    elif data.startswith("complete_order_"):
-        order_id = data.replace("complete_order_", "")
-        await handle_admin_complete_order(telegram_id, order_id)
-    
-    elif data.startswith("cancel_order_"):
-        order_id = data.replace("cancel_order_", "")
-        await handle_admin_cancel_order(telegram_id, order_id)
-    
-    elif data.startswith("download_report_"):
-        order_id = data.replace("download_report_", "")
-        await handle_download_order_report(telegram_id, order_id, is_admin=True)
-    
-    elif data.startswith("send_report_to_user_"):
-        order_id = data.replace("send_report_to_user_", "")
-        await handle_send_report_to_user(telegram_id, order_id)
-    
-    elif data.startswith("use_code_"):
-        parts = data.replace("use_code_", "").split("_")
-        order_id = parts[0]
-        code_id = parts[1]
-        await handle_admin_use_code_from_stock(telegram_id, order_id, code_id)
-    
-    elif data.startswith("manual_code_"):
-        order_id = data.replace("manual_code_", "")
-        await handle_admin_manual_code_input(telegram_id, order_id)
-    
-    elif data == "ammer_pay_menu":
-        await handle_admin_ammer_pay_menu(telegram_id)
-    
-    elif data == "add_product":
-        await handle_admin_add_product(telegram_id)
-    
-    elif data == "add_user_balance":
-        await handle_admin_add_user_balance(telegram_id)
-    # معالجات النجوم المحذوفة
-    elif data == "view_balances":
-        await handle_admin_view_balances(telegram_id)
-    
-    elif data == "add_category":
-        await handle_admin_add_category(telegram_id)
-    elif data == "list_all_categories":
-        await handle_admin_list_all_categories(telegram_id)
-    elif data == "manage_gaming_categories":
-        await handle_admin_manage_category_type(telegram_id, "games", "🎮 الألعاب")
-    elif data == "manage_ecommerce_categories":
-        await handle_admin_manage_category_type(telegram_id, "ecommerce", "🛒 التجارة الإلكترونية")
-    elif data == "manage_gift_cards_categories":
-        await handle_admin_manage_category_type(telegram_id, "gift_cards", "🎁 بطاقات الهدايا الرقمية")
-    elif data == "manage_subscriptions_categories":
-        await handle_admin_manage_category_type(telegram_id, "subscriptions", "📱 الاشتراكات الرقمية")
-    
-    elif data.startswith("select_product_for_category_"):
-        product_id = data.replace("select_product_for_category_", "")
-        await handle_admin_select_product_for_category(telegram_id, product_id)
-    
-    elif data.startswith("delivery_"):
-        delivery_type = data.replace("delivery_", "")
-        await handle_admin_delivery_type_selection(telegram_id, delivery_type)
-    
-    elif data == "add_codes":
-        await handle_admin_add_codes(telegram_id)
-    
-    elif data == "view_codes":
-        await handle_admin_view_codes(telegram_id)
-    
-    elif data == "low_stock_alerts":
-        await handle_admin_low_stock_alerts(telegram_id)
-    
-    elif data.startswith("add_codes_to_category_"):
-        category_id = data.replace("add_codes_to_category_", "")
-        await handle_admin_select_code_type(telegram_id, category_id)
-    
-    elif data.startswith("code_type_"):
-        # Handle code type selection
-        parts = data.split("_")
-        code_type = parts[2]  # text, number, or dual
-        category_id = parts[3]
-        await handle_admin_code_type_selected(telegram_id, code_type, category_id)
-    
-    elif data.startswith("process_order_"):
-        order_id = data.replace("process_order_", "")
-        await handle_admin_process_order(telegram_id, order_id)
-    
-    elif data.startswith("admin_order_details_"):
-        order_id = data.replace("admin_order_details_", "")
-        await handle_admin_order_details(telegram_id, order_id)
-    
-    elif data == "ammer_balance":
-        await handle_admin_ammer_pay_commands(telegram_id, "check_balance")
-    
-    elif data == "ammer_verify_tx":
-        verify_text = """🔍 *التحقق من معاملة Ammer Pay*
+    await admin_callbacks.dispatch(telegram_id, data)
+
+# مسارات أزرار بوت الإدارة التي لا تقابل دالة معالجة مباشرة
+# (باقي المسارات مسجلة بالمزخرفات فوق دوال المعالجة نفسها)
+@admin_callbacks.exact("admin_main_menu")
+async def handle_admin_main_menu_callback(telegram_id: int):
+    keyboard = await create_admin_keyboard()
+    await send_admin_message(telegram_id, "اختر العملية المطلوبة:", keyboard)
+    await clear_session(telegram_id, is_admin=True)
+
+@admin_callbacks.prefix("use_code_")
+async def handle_admin_use_code_callback(telegram_id: int, value: str):
+    parts = value.split("_")
+    order_id = parts[0]
+    code_id = parts[1]
+    await handle_admin_use_code_from_stock(telegram_id, order_id, code_id)
+
+@admin_callbacks.prefix("code_type_")
+async def handle_admin_code_type_callback(telegram_id: int, value: str):
+    parts = value.split("_")
+    code_type = parts[0]  # text, number, or dual
+    category_id = parts[1]
+    await handle_admin_code_type_selected(telegram_id, code_type, category_id)
+
+@admin_callbacks.exact("ammer_verify_tx")
+async def handle_admin_ammer_verify_callback(telegram_id: int):
+    verify_text = """🔍 *التحقق من معاملة Ammer Pay*
 
 أرسل معرف المعاملة للتحقق منها:
 
 **مثال:**
 `stxCZ9ffYe_YTgg_C5yoJyt5yzQky686TX2cpHkjZ12yaY0TUOAh6psyAjGnsp2G-3mfsjQsx64wO2ybZxzJdUQeimSXUPTEz2AVFCQgxXWmSQ`"""
-        
-        await set_admin_session(telegram_id, "ammer_verify_input")
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ إلغاء", callback_data="ammer_pay_menu")]
-        ])
-        await send_admin_message(telegram_id, verify_text, keyboard)
-    
-    elif data == "view_all_pending":
-        await handle_admin_view_all_pending_orders(telegram_id)
-    
-    elif data == "orders_report":
-        await handle_admin_orders_report(telegram_id)
-    
-    elif data == "add_product_category_games":
-        await handle_admin_add_product_category_selected(telegram_id, "games")
-    
-    elif data == "add_product_category_gift_cards":
-        await handle_admin_add_product_category_selected(telegram_id, "gift_cards")
     
-    elif data == "add_product_category_ecommerce":
-        await handle_admin_add_product_category_selected(telegram_id, "ecommerce")
-    
-    elif data == "add_product_category_subscriptions":
-        await handle_admin_add_product_category_selected(telegram_id, "subscriptions")
-    
-    elif data == "admin_back_to_main":
-        await handle_back_button(telegram_id, is_admin=True)
+    await set_admin_session(telegram_id, "ammer_verify_input")
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("❌ إلغاء", callback_data="ammer_pay_menu")]
+    ])
+    await send_admin_message(telegram_id, verify_text, keyboard)
+
+admin_callbacks.add_exact("reports_week", lambda telegram_id: handle_admin_reports(telegram_id, period="week"))
+admin_callbacks.add_exact("orders_report_week", lambda telegram_id: handle_admin_orders_report(telegram_id, period="week"))
+admin_callbacks.add_exact("ammer_balance", lambda telegram_id: handle_admin_ammer_pay_commands(telegram_id, "check_balance"))
+admin_callbacks.add_exact("admin_back_to_main", lambda telegram_id: handle_back_button(telegram_id, is_admin=True))
+admin_callbacks.add_prefix("download_report_", lambda telegram_id, order_id: handle_download_order_report(telegram_id, order_id, is_admin=True))
+for category_type, category_title, callback_key in [
+    ("games", "🎮 الألعاب", "manage_gaming_categories"),
+    ("ecommerce", "🛒 التجارة الإلكترونية", "manage_ecommerce_categories"),
+    ("gift_cards", "🎁 بطاقات الهدايا الرقمية", "manage_gift_cards_categories"),
+    ("subscriptions", "📱 الاشتراكات الرقمية", "manage_subscriptions_categories"),
+]:
+    admin_callbacks.add_exact(
+        callback_key,
+        lambda telegram_id, category_type=category_type, category_title=category_title:
+            handle_admin_manage_category_type(telegram_id, category_type, category_title)
+    )
+    admin_callbacks.add_exact(
+        f"add_product_category_{category_type}",
+        lambda telegram_id, category_type=category_type: handle_admin_add_product_category_selected(telegram_id, category_type)
+    )
 
+@admin_callbacks.exact("manage_products")
 async def handle_admin_manage_products(telegram_id: int):
     keyboard = [
         [InlineKeyboardButton("➕ إضافة منتج جديد", callback_data="add_product")],
@@ -2413,11 +2256,12 @@ async def handle_admin_manage_products(telegram_id: int):
     text = "📦 *إدارة المنتجات والفئات*\n\nاختر العملية المطلوبة:"
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("list_all_categories")
 async def handle_admin_list_all_categories(telegram_id: int):
     """عرض جميع الفئات"""
     try:
-        categories = await db.categories.find().to_list(None)
-        products = await db.products.find().to_list(None)
+        categories = await catalog.list_categories()
+        products = await catalog.list_products()
         
         if not categories:
             text = "❌ لا توجد فئات في النظام حالياً."
@@ -2484,7 +2328,7 @@ async def handle_admin_manage_category_type(telegram_id: int, category_type: str
         keywords = category_keywords.get(category_type, [])
         
         # البحث عن المنتجات حسب category_type أولاً
-        products = await db.products.find().to_list(None)
+        products = await catalog.list_products()
         relevant_products = []
         
         # البحث المباشر حسب category_type
@@ -2506,7 +2350,7 @@ async def handle_admin_manage_category_type(telegram_id: int, category_type: str
         # جمع الفئات لهذه المنتجات
         relevant_categories = []
         for product in relevant_products:
-            product_categories = await db.categories.find({"product_id": product['id']}).to_list(None)
+            product_categories = await catalog.list_categories(product_id=product['id'])
             for cat in product_categories:
                 cat['product_name'] = product['name']
                 relevant_categories.append(cat)
@@ -2557,6 +2401,7 @@ async def handle_admin_manage_category_type(telegram_id: int, category_type: str
         logging.error(f"Error managing {category_type} categories: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ في إدارة فئات {category_name}.")
 
+@admin_callbacks.exact("manage_users")
 async def handle_admin_manage_users(telegram_id: int):
     users_count = await db.users.count_documents({})
     total_balance = await db.users.aggregate([
@@ -2578,6 +2423,7 @@ async def handle_admin_manage_users(telegram_id: int):
     
     await send_admin_message(telegram_id, users_text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("view_users")
 async def handle_admin_view_users(telegram_id: int):
     """عرض قائمة المستخدمين للإدارة"""
     try:
@@ -2638,6 +2484,7 @@ async def handle_admin_view_users(telegram_id: int):
         await send_admin_message(telegram_id, f"❌ خطأ في عرض المستخدمين: {str(e)}")
         logging.error(f"Error viewing users: {e}")
 
+@admin_callbacks.exact("ban_user")
 async def handle_admin_ban_user(telegram_id: int):
     """بدء عملية حظر مستخدم"""
     session = TelegramSession(telegram_id=telegram_id, state="ban_user_id")
@@ -2655,6 +2502,7 @@ async def handle_admin_ban_user(telegram_id: int):
     
     await send_admin_message(telegram_id, text, keyboard)
 
+@admin_callbacks.exact("unban_user")
 async def handle_admin_unban_user(telegram_id: int):
     """بدء عملية إلغاء حظر مستخدم"""
     session = TelegramSession(telegram_id=telegram_id, state="unban_user_id")
@@ -2673,177 +2521,186 @@ async def handle_admin_unban_user(telegram_id: int):
     await send_admin_message(telegram_id, text, keyboard)
 
 async def handle_admin_text_input(telegram_id: int, text: str, session: TelegramSession):
-    if session.state == "add_product_name":
-        session.data["name"] = text
-        session.state = "add_product_description"
-        await save_session(session, is_admin=True)
-        
-        await send_admin_message(telegram_id, "📝 أدخل وصف المنتج:")
-    
-    elif session.state == "add_product_description":
-        session.data["description"] = text
-        session.state = "add_product_terms"
-        await save_session(session, is_admin=True)
-        
-        await send_admin_message(telegram_id, "📋 أدخل شروط المنتج:")
-    
-    elif session.state == "add_product_terms":
-        session.data["terms"] = text
-        
-        # Create the product with category type
-        category_type = session.data.get("category_type", "general")
-        product = Product(
-            name=session.data["name"],
-            description=session.data["description"],
-            terms=session.data["terms"],
-            category_type=category_type
-        )
-        
-        await db.products.insert_one(product.dict())
-        await clear_session(telegram_id, is_admin=True)
-        
-        category_names = {
-            "games": "🎮 الألعاب",
-            "gift_cards": "🎁 بطاقات الهدايا الرقمية", 
-            "ecommerce": "🛒 التجارة الإلكترونية",
-            "subscriptions": "📱 الاشتراكات الرقمية"
-        }
-        category_name = category_names.get(category_type, "عام")
-        
-        success_text = f"""✅ تم إضافة المنتج بنجاح!
+    # كل حالة مسجلة في admin_conversation بمزخرف فوق معالجها
+    await admin_conversation.handle(telegram_id, text, session)
+
+@admin_conversation.state("add_product_name")
+async def handle_product_name_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_product_description", name=text)
+    await send_admin_message(telegram_id, "📝 أدخل وصف المنتج:")
+
+@admin_conversation.state("add_product_description")
+async def handle_product_description_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_product_terms", description=text)
+    await send_admin_message(telegram_id, "📋 أدخل شروط المنتج:")
+
+@admin_conversation.state("add_product_terms")
+async def handle_product_terms_step(telegram_id: int, text: str, session: TelegramSession):
+    session.data["terms"] = text
+    
+    # Create the product with category type
+    category_type = session.data.get("category_type", "general")
+    product = Product(
+        name=session.data["name"],
+        description=session.data["description"],
+        terms=session.data["terms"],
+        category_type=category_type
+    )
+    
+    await db.products.insert_one(product.dict())
+    await catalog.bump()
+    await clear_session(telegram_id, is_admin=True)
+    
+    category_names = {
+        "games": "🎮 الألعاب",
+        "gift_cards": "🎁 بطاقات الهدايا الرقمية", 
+        "ecommerce": "🛒 التجارة الإلكترونية",
+        "subscriptions": "📱 الاشتراكات الرقمية"
+    }
+    category_name = category_names.get(category_type, "عام")
+    
+    success_text = f"""✅ تم إضافة المنتج بنجاح!
 
 📦 *اسم المنتج:* {product.name}
 🏷️ *الصنف:* {category_name}
 📝 *الوصف:* {session.data["description"][:50]}...
 
 يمكنك الآن إضافة فئات لهذا المنتج من قائمة إدارة المنتجات."""
-        
-        back_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("➕ إضافة فئة للمنتج", callback_data="add_category")],
-            [InlineKeyboardButton("🔙 العودة لإدارة المنتجات", callback_data="manage_products")]
-        ])
-        await send_admin_message(telegram_id, success_text, back_keyboard)
     
-    elif session.state == "add_user_balance_id":
-        try:
-            user_telegram_id = int(text)
-            user = await db.users.find_one({"telegram_id": user_telegram_id})
-            if user:
-                session.data["user_telegram_id"] = user_telegram_id
-                session.state = "add_user_balance_amount"
-                await save_session(session, is_admin=True)
-                
-                await send_admin_message(telegram_id, f"💰 أدخل المبلغ المراد إضافته للمستخدم {user.get('first_name', 'غير معروف')}:")
-            else:
-                await send_admin_message(telegram_id, "❌ المستخدم غير موجود. يرجى إدخال إيدي صحيح:")
-        except ValueError:
-            await send_admin_message(telegram_id, "❌ يرجى إدخال رقم صحيح:")
-    
-    # Category creation flow
-    elif session.state == "add_category_name":
-        session.data["category_name"] = text
-        session.state = "add_category_description"
-        await save_session(session, is_admin=True)
-        
-        await send_admin_message(telegram_id, f"2️⃣ أدخل وصف الفئة لـ *{text}*:")
-    
-    elif session.state == "add_category_description":
-        session.data["category_description"] = text
-        session.state = "add_category_type"
-        await save_session(session, is_admin=True)
-        
-        await send_admin_message(telegram_id, "3️⃣ أدخل صنف الفئة (مثال: بطاقة هدايا، اشتراك رقمي، إلخ):")
-    
-    elif session.state == "add_category_type":
-        session.data["category_type"] = text
-        session.state = "add_category_delivery_type"
-        await save_session(session, is_admin=True)
-        
-        # Show delivery type options
-        delivery_keyboard = [
-            [InlineKeyboardButton("🎫 كود تلقائي", callback_data="delivery_code")],
-            [InlineKeyboardButton("📱 رقم هاتف", callback_data="delivery_phone")],
-            [InlineKeyboardButton("📧 بريد إلكتروني", callback_data="delivery_email")],
-            [InlineKeyboardButton("🆔 إيدي المستخدم", callback_data="delivery_id")],
-            [InlineKeyboardButton("📝 طلب يدوي", callback_data="delivery_manual")]
-        ]
-        
-        await send_admin_message(telegram_id, "4️⃣ اختر نوع التسليم:", InlineKeyboardMarkup(delivery_keyboard))
+    back_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("➕ إضافة فئة للمنتج", callback_data="add_category")],
+        [InlineKeyboardButton("🔙 العودة لإدارة المنتجات", callback_data="manage_products")]
+    ])
+    await send_admin_message(telegram_id, success_text, back_keyboard)
+
+@admin_conversation.state("add_user_balance_id", validate=parse_int, error="❌ يرجى إدخال رقم صحيح:")
+async def handle_user_balance_id_step(telegram_id: int, user_telegram_id: int, session: TelegramSession):
+    user = await user_cache.get(user_telegram_id)
+    if user:
+        await admin_conversation.transition(session, "add_user_balance_amount", user_telegram_id=user_telegram_id)
+        await send_admin_message(telegram_id, f"💰 أدخل المبلغ المراد إضافته للمستخدم {user.get('first_name', 'غير معروف')}:")
+    else:
+        await send_admin_message(telegram_id, "❌ المستخدم غير موجود. يرجى إدخال إيدي صحيح:")
+
+@admin_conversation.state("add_user_balance_amount", validate=parse_float, error="❌ يرجى إدخال رقم صحيح:")
+async def handle_user_balance_amount_step(telegram_id: int, amount: float, session: TelegramSession):
+    user_telegram_id = session.data["user_telegram_id"]
     
-    elif session.state == "add_category_price":
-        try:
-            price = float(text)
-            session.data["category_price"] = price
-            session.state = "add_category_redemption"
-            await save_session(session, is_admin=True)
+    # Update user balance
+    await db.users.update_one(
+        {"telegram_id": user_telegram_id},
+        {"$inc": {"balance": amount}}
+    )
+    user_cache.invalidate(user_telegram_id)
+    
+    # Send notification to user
+    await send_user_message(
+        user_telegram_id,
+        f"💰 تم شحن محفظتك بنجاح!\n\nالمبلغ المضاف: *{amount:.2f} دولار*"
+    )
+    
+    await clear_session(telegram_id, is_admin=True)
+    
+    success_text = f"✅ تم إضافة {amount:.2f} دولار لحساب المستخدم {user_telegram_id}"
+    back_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 العودة لإدارة المستخدمين", callback_data="manage_users")]
+    ])
+    await send_admin_message(telegram_id, success_text, back_keyboard)
+
+# Category creation flow
+@admin_conversation.state("add_category_name")
+async def handle_category_name_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_category_description", category_name=text)
+    await send_admin_message(telegram_id, f"2️⃣ أدخل وصف الفئة لـ *{text}*:")
+
+@admin_conversation.state("add_category_description")
+async def handle_category_description_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_category_type", category_description=text)
+    await send_admin_message(telegram_id, "3️⃣ أدخل صنف الفئة (مثال: بطاقة هدايا، اشتراك رقمي، إلخ):")
+
+@admin_conversation.state("add_category_type")
+async def handle_category_type_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_category_delivery_type", category_type=text)
+    
+    # Show delivery type options
+    delivery_keyboard = [
+        [InlineKeyboardButton("🎫 كود تلقائي", callback_data="delivery_code")],
+        [InlineKeyboardButton("📱 رقم هاتف", callback_data="delivery_phone")],
+        [InlineKeyboardButton("📧 بريد إلكتروني", callback_data="delivery_email")],
+        [InlineKeyboardButton("🆔 إيدي المستخدم", callback_data="delivery_id")],
+        [InlineKeyboardButton("📝 طلب يدوي", callback_data="delivery_manual")]
+    ]
+    
+    await send_admin_message(telegram_id, "4️⃣ اختر نوع التسليم:", InlineKeyboardMarkup(delivery_keyboard))
+
+@admin_conversation.state("add_category_price", validate=parse_float, error="❌ يرجى إدخال رقم صحيح للسعر:")
+async def handle_category_price_step(telegram_id: int, price: float, session: TelegramSession):
+    await admin_conversation.transition(session, "add_category_redemption", category_price=price)
+    await send_admin_message(telegram_id, "6️⃣ أدخل طريقة الاسترداد (مثال: كود رقمي، بريد إلكتروني، إلخ):")
+
+@admin_conversation.state("add_category_redemption")
+async def handle_category_redemption_step(telegram_id: int, text: str, session: TelegramSession):
+    await admin_conversation.transition(session, "add_category_terms", redemption_method=text)
+    await send_admin_message(telegram_id, "7️⃣ أدخل شروط الفئة:")
+
+@admin_conversation.state("add_category_terms")
+async def handle_category_terms_step(telegram_id: int, text: str, session: TelegramSession):
+    session.data["category_terms"] = text
+    
+    # Create the category
+    category = Category(
+        name=session.data["category_name"],
+        description=session.data["category_description"],
+        category_type=session.data["category_type"],
+        delivery_type=session.data["delivery_type"],
+        price=session.data["category_price"],
+        redemption_method=session.data["redemption_method"],
+        terms=session.data["category_terms"],
+        product_id=session.data["product_id"]
+    )
+    
+    await db.categories.insert_one(category.dict())
+    
+    # تحديث إحصائيات المنتج
+    product_id = session.data["product_id"]
+    await db.products.update_one(
+        {"id": product_id},
+        {"$inc": {"categories_count": 1}}
+    )
+    
+    # تحديث نوع الصنف للمنتج إذا لم يكن محدداً
+    product = await db.products.find_one({"id": product_id})
+    if product and not product.get('category_type'):
+        # تحديد نوع الصنف بناءً على اسم المنتج
+        product_name_lower = product['name'].lower()
+        category_type = 'general'
+        
+        if any(keyword in product_name_lower for keyword in ['steam', 'xbox', 'playstation', 'game', 'gaming']):
+            category_type = 'games'
+        elif any(keyword in product_name_lower for keyword in ['gift', 'card', 'amazon', 'apple', 'google']):
+            category_type = 'gift_cards'
+        elif any(keyword in product_name_lower for keyword in ['netflix', 'spotify', 'subscription', 'premium']):
+            category_type = 'subscriptions'
+        elif any(keyword in product_name_lower for keyword in ['shop', 'store', 'market', 'ecommerce']):
+            category_type = 'ecommerce'
             
-            await send_admin_message(telegram_id, "6️⃣ أدخل طريقة الاسترداد (مثال: كود رقمي، بريد إلكتروني، إلخ):")
-        except ValueError:
-            await send_admin_message(telegram_id, "❌ يرجى إدخال رقم صحيح للسعر:")
-    
-    elif session.state == "add_category_redemption":
-        session.data["redemption_method"] = text
-        session.state = "add_category_terms"
-        await save_session(session, is_admin=True)
-        
-        await send_admin_message(telegram_id, "7️⃣ أدخل شروط الفئة:")
-    
-    elif session.state == "add_category_terms":
-        session.data["category_terms"] = text
-        
-        # Create the category
-        category = Category(
-            name=session.data["category_name"],
-            description=session.data["category_description"],
-            category_type=session.data["category_type"],
-            delivery_type=session.data["delivery_type"],
-            price=session.data["category_price"],
-            redemption_method=session.data["redemption_method"],
-            terms=session.data["category_terms"],
-            product_id=session.data["product_id"]
-        )
-        
-        await db.categories.insert_one(category.dict())
-        
-        # تحديث إحصائيات المنتج
-        product_id = session.data["product_id"]
         await db.products.update_one(
             {"id": product_id},
-            {"$inc": {"categories_count": 1}}
+            {"$set": {"category_type": category_type}}
         )
-        
-        # تحديث نوع الصنف للمنتج إذا لم يكن محدداً
-        product = await db.products.find_one({"id": product_id})
-        if product and not product.get('category_type'):
-            # تحديد نوع الصنف بناءً على اسم المنتج
-            product_name_lower = product['name'].lower()
-            category_type = 'general'
-            
-            if any(keyword in product_name_lower for keyword in ['steam', 'xbox', 'playstation', 'game', 'gaming']):
-                category_type = 'games'
-            elif any(keyword in product_name_lower for keyword in ['gift', 'card', 'amazon', 'apple', 'google']):
-                category_type = 'gift_cards'
-            elif any(keyword in product_name_lower for keyword in ['netflix', 'spotify', 'subscription', 'premium']):
-                category_type = 'subscriptions'
-            elif any(keyword in product_name_lower for keyword in ['shop', 'store', 'market', 'ecommerce']):
-                category_type = 'ecommerce'
-                
-            await db.products.update_one(
-                {"id": product_id},
-                {"$set": {"category_type": category_type}}
-            )
-        
-        await clear_session(telegram_id, is_admin=True)
-        
-        delivery_types = {
-            "code": "🎫 كود تلقائي",
-            "phone": "📱 رقم هاتف", 
-            "email": "📧 بريد إلكتروني",
-            "id": "🆔 إيدي المستخدم",
-            "manual": "📝 طلب يدوي"
-        }
-        
-        success_text = f"""✅ *تم إضافة الفئة بنجاح!*
+    
+    await catalog.bump()
+    await clear_session(telegram_id, is_admin=True)
+    
+    delivery_types = {
+        "code": "🎫 كود تلقائي",
+        "phone": "📱 رقم هاتف", 
+        "email": "📧 بريد إلكتروني",
+        "id": "🆔 إيدي المستخدم",
+        "manual": "📝 طلب يدوي"
+    }
+    
+    success_text = f"""✅ *تم إضافة الفئة بنجاح!*
 
 📦 المنتج: *{session.data['product_name']}*
 🏷️ اسم الفئة: *{category.name}*
@@ -2853,142 +2710,86 @@ async def handle_admin_text_input(telegram_id: int, text: str, session: Telegram
 
 {"يمكنك الآن إضافة أكواد لهذه الفئة." if category.delivery_type == "code" else "هذه الفئة تتطلب تنفيذ يدوي للطلبات."}"""
 
-        keyboard = []
-        if category.delivery_type == "code":
-            keyboard.append([InlineKeyboardButton("🎫 إضافة أكواد للفئة", callback_data="manage_codes")])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("📂 إضافة فئة أخرى", callback_data="add_category")],
-            [InlineKeyboardButton("🔙 العودة لإدارة المنتجات", callback_data="manage_products")]
-        ])
-        
-        await send_admin_message(telegram_id, success_text, InlineKeyboardMarkup(keyboard))
+    keyboard = []
+    if category.delivery_type == "code":
+        keyboard.append([InlineKeyboardButton("🎫 إضافة أكواد للفئة", callback_data="manage_codes")])
     
-    # Handle codes input
-    elif session.state == "add_codes_input":
-        await handle_admin_codes_input(telegram_id, text, session)
+    keyboard.extend([
+        [InlineKeyboardButton("📂 إضافة فئة أخرى", callback_data="add_category")],
+        [InlineKeyboardButton("🔙 العودة لإدارة المنتجات", callback_data="manage_products")]
+    ])
     
-    # Handle order processing input
-    elif session.state == "process_order_input_code":
-        await handle_admin_order_code_input(telegram_id, text, session)
+    await send_admin_message(telegram_id, success_text, InlineKeyboardMarkup(keyboard))
+
+# Handle ban user flow
+@admin_conversation.state("ban_user_id", validate=parse_int, error="❌ يرجى إدخال إيدي صحيح (أرقام فقط)")
+async def handle_ban_user_id_step(telegram_id: int, user_telegram_id: int, session: TelegramSession):
+    # Check if user exists
+    user = await user_cache.get(user_telegram_id)
+    if not user:
+        await send_admin_message(telegram_id, "❌ لا يوجد مستخدم بهذا الإيدي")
+        return
     
-    elif session.state == "add_user_balance_amount":
-        try:
-            amount = float(text)
-            user_telegram_id = session.data["user_telegram_id"]
-            
-            # Update user balance
-            await db.users.update_one(
-                {"telegram_id": user_telegram_id},
-                {"$inc": {"balance": amount}}
-            )
-            
-            # Send notification to user
-            await send_user_message(
-                user_telegram_id,
-                f"💰 تم شحن محفظتك بنجاح!\n\nالمبلغ المضاف: *{amount:.2f} دولار*"
-            )
-            
-            await clear_session(telegram_id, is_admin=True)
-            
-            success_text = f"✅ تم إضافة {amount:.2f} دولار لحساب المستخدم {user_telegram_id}"
-            back_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 العودة لإدارة المستخدمين", callback_data="manage_users")]
-            ])
-            await send_admin_message(telegram_id, success_text, back_keyboard)
-            
-        except ValueError:
-            await send_admin_message(telegram_id, "❌ يرجى إدخال رقم صحيح:")
+    if user.get('is_banned', False):
+        await send_admin_message(telegram_id, "⚠️ هذا المستخدم محظور بالفعل")
+        return
     
-    # معالجة إضافة النجوم المحذوفة
+    # Store user ID and ask for ban reason
+    await admin_conversation.transition(
+        session,
+        "ban_user_reason",
+        ban_user_telegram_id=user_telegram_id,
+        ban_user_name=user.get('first_name', 'غير محدد')
+    )
     
-    # Handle ban user flow
-    elif session.state == "ban_user_id":
-        try:
-            user_telegram_id = int(text)
-            
-            # Check if user exists
-            user = await db.users.find_one({"telegram_id": user_telegram_id})
-            if not user:
-                await send_admin_message(telegram_id, "❌ لا يوجد مستخدم بهذا الإيدي")
-                return
-            
-            if user.get('is_banned', False):
-                await send_admin_message(telegram_id, "⚠️ هذا المستخدم محظور بالفعل")
-                return
-            
-            # Store user ID and ask for ban reason
-            session.data["ban_user_telegram_id"] = user_telegram_id
-            session.data["ban_user_name"] = user.get('first_name', 'غير محدد')
-            session.state = "ban_user_reason"
-            await save_session(session, is_admin=True)
-            
-            await send_admin_message(telegram_id, f"🚫 *حظر المستخدم*\n\nالمستخدم: {user.get('first_name', 'غير محدد')}\nالإيدي: `{user_telegram_id}`\n\nأدخل سبب الحظر:")
-            
-        except ValueError:
-            await send_admin_message(telegram_id, "❌ يرجى إدخال إيدي صحيح (أرقام فقط)")
+    await send_admin_message(telegram_id, f"🚫 *حظر المستخدم*\n\nالمستخدم: {user.get('first_name', 'غير محدد')}\nالإيدي: `{user_telegram_id}`\n\nأدخل سبب الحظر:")
+
+def product_edit_value(text: str) -> Optional[str]:
+    """القيمة الجديدة لحقل المنتج، أو None عند كتابة "تخطي" """
+    value = text.strip()
+    return None if value.lower() in ["تخطي", "skip"] else value
+
+# Handle product editing flow
+@admin_conversation.state("edit_product_name")
+async def handle_edit_product_name_step(telegram_id: int, text: str, session: TelegramSession):
+    new_value = product_edit_value(text)
+    changes = {"new_name": new_value} if new_value is not None else {}
+    await admin_conversation.transition(session, "edit_product_description", **changes)
     
-    # Handle product editing flow
-    elif session.state == "edit_product_name":
-        new_name = text.strip()
-        if new_name.lower() not in ["تخطي", "skip"]:
-            session.data["new_name"] = new_name
-        
-        session.state = "edit_product_description"
-        await save_session(session, is_admin=True)
-        
-        product = session.data["product"]
-        await send_admin_message(telegram_id, f"""📝 *تعديل وصف المنتج*
+    product = session.data["product"]
+    await send_admin_message(telegram_id, f"""📝 *تعديل وصف المنتج*
 
 📄 الوصف الحالي: {product.get('description', 'غير محدد')}
 
 أدخل الوصف الجديد أو اكتب "تخطي" للإبقاء على الوصف الحالي:""")
+
+@admin_conversation.state("edit_product_description")
+async def handle_edit_product_description_step(telegram_id: int, text: str, session: TelegramSession):
+    new_value = product_edit_value(text)
+    changes = {"new_description": new_value} if new_value is not None else {}
+    await admin_conversation.transition(session, "edit_product_terms", **changes)
     
-    elif session.state == "edit_product_description":
-        new_description = text.strip()
-        if new_description.lower() not in ["تخطي", "skip"]:
-            session.data["new_description"] = new_description
-        
-        session.state = "edit_product_terms"
-        await save_session(session, is_admin=True)
-        
-        product = session.data["product"]
-        await send_admin_message(telegram_id, f"""📝 *تعديل شروط المنتج*
+    product = session.data["product"]
+    await send_admin_message(telegram_id, f"""📝 *تعديل شروط المنتج*
 
 📋 الشروط الحالية: {product.get('terms', 'غير محدد')}
 
 أدخل الشروط الجديدة أو اكتب "تخطي" للإبقاء على الشروط الحالية:""")
+
+@admin_conversation.state("edit_product_terms")
+async def handle_edit_product_terms_step(telegram_id: int, text: str, session: TelegramSession):
+    new_terms = product_edit_value(text)
+    if new_terms is not None:
+        session.data["new_terms"] = new_terms
     
-    elif session.state == "edit_product_terms":
-        new_terms = text.strip()
-        if new_terms.lower() not in ["تخطي", "skip"]:
-            session.data["new_terms"] = new_terms
-        
-        # Apply changes
-        await apply_product_changes(telegram_id, session)
-    
-    elif session.state == "search_order_input":
-        await handle_admin_search_order_input(telegram_id, text, session)
-    
-    elif session.state == "search_user_input":
-        await handle_admin_search_user_input(telegram_id, text, session)
-    
-    elif session.state == "ammer_verify_input":
-        await handle_admin_ammer_verify_input(telegram_id, text, session)
-    
-    elif session.state == "add_payment_method_input":
-        await handle_admin_add_payment_method_input(telegram_id, text, session)
-    
-    elif session.state == "edit_payment_method_input":
-        await handle_admin_edit_payment_method_input(telegram_id, text, session)
-    
-    elif session.state == "complete_order_code_input":
-        await handle_admin_complete_order_code_input(telegram_id, text, session)
+    # Apply changes
+    await apply_product_changes(telegram_id, session)
 
+@admin_callbacks.exact("edit_product")
 async def handle_admin_edit_product(telegram_id: int):
     """بدء عملية تعديل منتج"""
     # عرض قائمة المنتجات للاختيار
-    products = await db.products.find({"is_active": True}).to_list(20)
+    products = await catalog.list_products(active_only=True, limit=20)
     
     if not products:
         await send_admin_message(telegram_id, "❌ لا توجد منتجات متاحة للتعديل")
@@ -3006,10 +2807,11 @@ async def handle_admin_edit_product(telegram_id: int):
     
     await send_admin_message(telegram_id, products_text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("delete_product")
 async def handle_admin_delete_product(telegram_id: int):
     """بدء عملية حذف منتج"""
     # عرض قائمة المنتجات للاختيار
-    products = await db.products.find({"is_active": True}).to_list(20)
+    products = await catalog.list_products(active_only=True, limit=20)
     
     if not products:
         await send_admin_message(telegram_id, "❌ لا توجد منتجات متاحة للحذف")
@@ -3027,10 +2829,11 @@ async def handle_admin_delete_product(telegram_id: int):
     
     await send_admin_message(telegram_id, products_text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.prefix("edit_product_")
 async def handle_edit_product_selected(telegram_id: int, product_id: str):
     """معالجة اختيار منتج للتعديل"""
     # البحث عن المنتج
-    product = await db.products.find_one({"id": product_id})
+    product = await catalog.get_product(product_id)
     if not product:
         await send_admin_message(telegram_id, "❌ المنتج غير موجود")
         return
@@ -3058,16 +2861,17 @@ async def handle_edit_product_selected(telegram_id: int, product_id: str):
     
     await send_admin_message(telegram_id, edit_text, keyboard)
 
+@admin_callbacks.prefix("delete_product_")
 async def handle_delete_product_confirm(telegram_id: int, product_id: str):
     """تأكيد حذف المنتج"""
     # البحث عن المنتج
-    product = await db.products.find_one({"id": product_id})
+    product = await catalog.get_product(product_id)
     if not product:
         await send_admin_message(telegram_id, "❌ المنتج غير موجود")
         return
     
     # البحث عن الفئات المرتبطة
-    categories_count = await db.categories.count_documents({"product_id": product_id})
+    categories_count = await catalog.count_categories(product_id)
     
     confirm_text = f"""🗑 *تأكيد حذف المنتج*
 
@@ -3090,6 +2894,7 @@ async def handle_delete_product_confirm(telegram_id: int, product_id: str):
     
     await send_admin_message(telegram_id, confirm_text, keyboard)
 
+@admin_callbacks.prefix("confirm_delete_")
 async def handle_product_delete_confirmed(telegram_id: int, product_id: str):
     """تنفيذ حذف المنتج"""
     try:
@@ -3108,6 +2913,7 @@ async def handle_product_delete_confirmed(telegram_id: int, product_id: str):
             {"product_id": product_id},
             {"$set": {"is_active": False}}
         )
+        await catalog.bump()
         
         success_text = f"""✅ *تم حذف المنتج بنجاح*
 
@@ -3126,14 +2932,14 @@ async def handle_product_delete_confirmed(telegram_id: int, product_id: str):
         await send_admin_message(telegram_id, f"❌ خطأ في حذف المنتج: {str(e)}")
         logging.error(f"Error deleting product: {e}")
 
+@admin_callbacks.exact("skip_product_name")
 async def handle_skip_product_name(telegram_id: int):
     """تخطي اسم المنتج"""
     session = await get_session(telegram_id, is_admin=True)
     if not session:
         return
     
-    session.state = "edit_product_description"
-    await save_session(session, is_admin=True)
+    await admin_conversation.transition(session, "edit_product_description")
     
     product = session.data["product"]
     await send_admin_message(telegram_id, f"""📝 *تعديل وصف المنتج*
@@ -3170,6 +2976,7 @@ async def apply_product_changes(telegram_id: int, session):
                 {"id": product_id},
                 {"$set": updates}
             )
+            await catalog.bump()
             
             changes_text += f"\n✅ تم حفظ جميع التغييرات بنجاح"
         else:
@@ -3187,9 +2994,10 @@ async def apply_product_changes(telegram_id: int, session):
         await send_admin_message(telegram_id, f"❌ خطأ في تحديث المنتج: {str(e)}")
         logging.error(f"Error updating product: {e}")
 
+@admin_callbacks.exact("manage_codes")
 async def handle_admin_manage_codes(telegram_id: int):
     # Get categories that use codes
-    code_categories = await db.categories.find({"delivery_type": "code"}).to_list(100)
+    code_categories = await catalog.list_categories(delivery_type="code", limit=100)
     
     keyboard = [
         [InlineKeyboardButton("➕ إضافة أكواد", callback_data="add_codes")],
@@ -3200,12 +3008,10 @@ async def handle_admin_manage_codes(telegram_id: int):
     
     # Show low stock warnings
     warnings = []
+    stock_levels = await inventory.stock_levels()
     for category in code_categories:
-        available_codes = await db.codes.count_documents({
-            "category_id": category["id"],
-            "is_used": False
-        })
-        if available_codes <= 5:
+        available_codes = stock_levels.get(category["id"], {}).get("available", 0)
+        if available_codes <= LOW_STOCK_THRESHOLD:
             warnings.append(f"⚠️ {category['name']}: {available_codes} أكواد متبقية")
     
     text = "🎫 *إدارة الأكواد*\n\n"
@@ -3217,27 +3023,25 @@ async def handle_admin_manage_codes(telegram_id: int):
     keyboard.append([InlineKeyboardButton("🔙 العودة", callback_data="admin_main_menu")])
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
-async def handle_admin_reports(telegram_id: int):
-    # Get statistics
-    total_users = await db.users.count_documents({})
-    total_orders = await db.orders.count_documents({})
-    completed_orders = await db.orders.count_documents({"status": "completed"})
-    pending_orders = await db.orders.count_documents({"status": "pending"})
-    
-    # Calculate revenue
-    revenue_result = await db.orders.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$price"}}}
-    ]).to_list(1)
-    
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
-    # Get today's orders
-    from datetime import datetime, timezone
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_orders = await db.orders.count_documents({
-        "order_date": {"$gte": today}
-    })
+def report_period_title(period: str) -> str:
+    return "آخر 7 أيام" if period == "week" else "اليوم"
+
+def report_period_button(period: str, callback_prefix: str) -> InlineKeyboardButton:
+    """زر التبديل بين التقرير اليومي والأسبوعي"""
+    if period == "week":
+        return InlineKeyboardButton("📅 تقرير اليوم", callback_data=callback_prefix)
+    return InlineKeyboardButton("🗓 تقرير آخر 7 أيام", callback_data=f"{callback_prefix}_week")
+
+@admin_callbacks.exact("reports")
+async def handle_admin_reports(telegram_id: int, period: str = "day"):
+    report = await build_report(db, "admin_overview", report_range(period), include_users=True)
+    total_users = report["total_users"]
+    total_orders = report["total_orders"]
+    completed_orders = report["completed_orders"]
+    pending_orders = report["pending_orders"]
+    total_revenue = report["total_revenue"]
+    period_orders = report["period_orders"]
+    period_revenue = report["period_revenue"]
     
     report_text = f"""📊 *تقرير شامل - Abod Card*
 
@@ -3251,16 +3055,19 @@ async def handle_admin_reports(telegram_id: int):
 • إجمالي الإيرادات: *${total_revenue:.2f}*
 • متوسط قيمة الطلب: *${total_revenue/completed_orders if completed_orders > 0 else 0:.2f}*
 
-📅 *إحصائيات اليوم:*
-• طلبات اليوم: *{today_orders}*
+📅 *إحصائيات {report_period_title(period)}:*
+• الطلبات: *{period_orders}*
+• الإيرادات: *${period_revenue:.2f}*
 
 تم إنتاج التقرير في: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M')}"""
     
     back_keyboard = InlineKeyboardMarkup([
+        [report_period_button(period, "reports")],
         [InlineKeyboardButton("🔙 العودة", callback_data="admin_main_menu")]
     ])
     await send_admin_message(telegram_id, report_text, back_keyboard)
 
+@admin_callbacks.exact("manage_orders")
 async def handle_admin_manage_orders(telegram_id: int):
     pending_orders = await db.orders.find({"status": "pending"}).to_list(50)
     completed_orders_count = await db.orders.count_documents({"status": "completed"})
@@ -3305,6 +3112,7 @@ async def handle_admin_manage_orders(telegram_id: int):
     
     await send_admin_message(telegram_id, orders_text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("manage_payment_methods")
 async def handle_admin_payment_methods(telegram_id: int):
     """إدارة طرق الدفع اليدوية"""
     
@@ -3350,6 +3158,7 @@ async def handle_admin_payment_methods(telegram_id: int):
     
     await send_admin_message(telegram_id, methods_text, keyboard)
 
+@admin_callbacks.exact("add_payment_method")
 async def handle_admin_add_payment_method(telegram_id: int):
     """إضافة طريقة دفع جديدة"""
     
@@ -3384,6 +3193,7 @@ SA1234567890123456789
     
     await send_admin_message(telegram_id, add_text, keyboard)
 
+@admin_conversation.state("add_payment_method_input")
 async def handle_admin_add_payment_method_input(telegram_id: int, text: str, session):
     """معالجة إدخال طريقة الدفع الجديدة"""
     try:
@@ -3432,6 +3242,7 @@ async def handle_admin_add_payment_method_input(telegram_id: int, text: str, ses
         logging.error(f"Error adding payment method: {e}")
         await send_admin_message(telegram_id, "❌ حدث خطأ أثناء إضافة طريقة الدفع. يرجى المحاولة مرة أخرى.")
 
+@admin_callbacks.exact("edit_payment_method")
 async def handle_admin_edit_payment_method_select(telegram_id: int):
     """اختيار طريقة دفع لتعديلها"""
     payment_methods = await db.payment_methods.find().to_list(20)
@@ -3453,6 +3264,7 @@ async def handle_admin_edit_payment_method_select(telegram_id: int):
     keyboard.append([InlineKeyboardButton("🔙 العودة", callback_data="manage_payment_methods")])
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.prefix("edit_pm_")
 async def handle_admin_edit_payment_method(telegram_id: int, method_id: str):
     """تعديل طريقة دفع"""
     method = await db.payment_methods.find_one({"id": method_id})
@@ -3482,6 +3294,7 @@ async def handle_admin_edit_payment_method(telegram_id: int, method_id: str):
     
     await send_admin_message(telegram_id, text, keyboard)
 
+@admin_callbacks.exact("delete_payment_method")
 async def handle_admin_delete_payment_method_select(telegram_id: int):
     """اختيار طريقة دفع لحذفها"""
     payment_methods = await db.payment_methods.find().to_list(20)
@@ -3503,6 +3316,7 @@ async def handle_admin_delete_payment_method_select(telegram_id: int):
     keyboard.append([InlineKeyboardButton("🔙 العودة", callback_data="manage_payment_methods")])
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.prefix("delete_pm_")
 async def handle_admin_delete_payment_method(telegram_id: int, method_id: str):
     """حذف طريقة دفع"""
     method = await db.payment_methods.find_one({"id": method_id})
@@ -3525,6 +3339,7 @@ async def handle_admin_delete_payment_method(telegram_id: int, method_id: str):
     
     await send_admin_message(telegram_id, text, keyboard)
 
+@admin_callbacks.exact("toggle_payment_method")
 async def handle_admin_toggle_payment_method_select(telegram_id: int):
     """اختيار طريقة دفع لتفعيل/إلغاء"""
     payment_methods = await db.payment_methods.find().to_list(20)
@@ -3547,6 +3362,7 @@ async def handle_admin_toggle_payment_method_select(telegram_id: int):
     keyboard.append([InlineKeyboardButton("🔙 العودة", callback_data="manage_payment_methods")])
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.prefix("toggle_pm_")
 async def handle_admin_toggle_payment_method(telegram_id: int, method_id: str):
     """تفعيل/إلغاء طريقة دفع"""
     method = await db.payment_methods.find_one({"id": method_id})
@@ -3571,6 +3387,7 @@ async def handle_admin_toggle_payment_method(telegram_id: int, method_id: str):
     
     await send_admin_message(telegram_id, text, keyboard)
 
+@admin_conversation.state("edit_payment_method_input")
 async def handle_admin_edit_payment_method_input(telegram_id: int, text: str, session):
     """معالجة إدخال تعديل طريقة الدفع"""
     try:
@@ -3658,6 +3475,7 @@ async def handle_admin_old_payment_methods(telegram_id: int):
     
     await send_admin_message(telegram_id, methods_text, keyboard)
 
+@admin_callbacks.exact("ammer_pay_menu")
 async def handle_admin_ammer_pay_menu(telegram_id: int):
     """قائمة إدارة Ammer Pay"""
     
@@ -3698,6 +3516,7 @@ async def handle_admin_ammer_pay_menu(telegram_id: int):
     
     await send_admin_message(telegram_id, menu_text, keyboard)
 
+@admin_callbacks.exact("search_order")
 async def handle_admin_search_order(telegram_id: int):
     """بحث عن طلب معين"""
     await clear_admin_session(telegram_id)
@@ -3720,111 +3539,84 @@ async def handle_admin_search_order(telegram_id: int):
     
     await send_admin_message(telegram_id, search_text, keyboard)
 
+@admin_conversation.state("search_order_input")
 async def handle_admin_search_order_input(telegram_id: int, search_text: str, session: TelegramSession):
     """معالجة البحث عن الطلبات"""
     try:
         await clear_admin_session(telegram_id)
         
         search_term = search_text.strip()
-        logging.info(f"Admin search order: term='{search_term}'")
-        
         if not search_term:
             await send_admin_message(telegram_id, "❌ يرجى إدخال معلومات البحث")
             return
         
-        # البحث في قاعدة البيانات
-        orders = []
-        
-        # البحث برقم الطلب (AC format أو ID مباشر)
-        if search_term.startswith("AC"):
-            logging.info("Searching by AC order number")
-            orders = await db.orders.find({"order_number": search_term}).to_list(10)
-        
-        # البحث بـ ID المباشر (8 أحرف hex أو أكثر)
-        elif len(search_term) >= 8:
-            # محاولة البحث كـ ID مباشر
-            try:
-                logging.info(f"Searching by ID: {search_term}")
-                orders = await db.orders.find({
-                    "$or": [
-                        {"id": {"$regex": f"^{search_term}", "$options": "i"}},
-                        {"order_number": {"$regex": search_term, "$options": "i"}}
-                    ]
-                }).to_list(10)
-                logging.info(f"Found {len(orders)} orders by ID")
-            except Exception as e:
-                logging.error(f"Search by ID error: {e}")
-                orders = []
-        
-        # البحث بإيدي المستخدم (إذا كان رقم)
-        if not orders and search_term.isdigit():
-            logging.info("Searching by telegram_id")
-            telegram_id_search = int(search_term)
-            orders = await db.orders.find({"telegram_id": telegram_id_search}).sort("order_date", -1).to_list(10)
-            logging.info(f"Found {len(orders)} orders by telegram_id")
-        
-        # البحث برقم العميل الداخلي
-        if not orders and search_term.startswith("U") and len(search_term) > 1:
-            logging.info("Searching by user_internal_id")
-            orders = await db.orders.find({"user_internal_id": search_term}).to_list(10)
-        
-        # البحث النصي في اسم المنتج
-        if not orders:
-            try:
-                logging.info("Searching by text")
-                orders = await db.orders.find({
-                    "$or": [
-                        {"product_name": {"$regex": search_term, "$options": "i"}},
-                        {"category_name": {"$regex": search_term, "$options": "i"}},
-                        {"id": {"$regex": search_term, "$options": "i"}},
-                        {"order_number": {"$regex": search_term, "$options": "i"}}
-                    ]
-                }).sort("order_date", -1).to_list(10)
-                logging.info(f"Found {len(orders)} orders by text search")
-            except Exception as e:
-                logging.error(f"Text search error: {e}")
-                orders = []
-        
-        logging.info(f"Total orders found: {len(orders)}")
+        await show_admin_order_search(telegram_id, search_term)
         
-        if not orders:
-            no_results_text = f"""🔍 *نتائج البحث*
+    except Exception as e:
+        logging.error(f"Error in admin search order: {e}")
+        await send_admin_message(telegram_id, "❌ حدث خطأ في البحث. يرجى المحاولة مرة أخرى.")
+
+@admin_callbacks.prefix("search_order_page_")
+async def handle_admin_search_order_page(telegram_id: int, page: str):
+    """صفحة أخرى من نتائج آخر بحث (نص البحث محفوظ في الجلسة)"""
+    session = await get_session(telegram_id, is_admin=True)
+    if not session or session.state != "search_order_results" or not page.isdigit():
+        await send_admin_message(telegram_id, "❌ انتهت صلاحية نتائج البحث، يرجى البحث من جديد", InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔍 بحث جديد", callback_data="search_order")]
+        ]))
+        return
+    
+    try:
+        await show_admin_order_search(telegram_id, session.data["term"], int(page))
+    except Exception as e:
+        logging.error(f"Error in admin search order page: {e}")
+        await send_admin_message(telegram_id, "❌ حدث خطأ في البحث. يرجى المحاولة مرة أخرى.")
+
+async def show_admin_order_search(telegram_id: int, search_term: str, page: int = 0):
+    """تنفيذ البحث باستعلام واحد مفهرس (order_search.py) وعرض صفحة من النتائج"""
+    _, orders, has_more = await search_orders(db, search_term, page=page)
+    
+    if not orders:
+        no_results_text = f"""🔍 *نتائج البحث*
 
 ❌ لم يتم العثور على أي طلبات تطابق: `{search_term}`
 
 💡 *نصائح البحث:*
 • تأكد من صحة رقم الطلب (مثل: AC20241201ABCD1234)
 • تأكد من صحة إيدي المستخدم
-• جرب البحث باسم المنتج أو الفئة"""
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔍 بحث جديد", callback_data="search_order")],
-                [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="admin_main_menu")]
-            ])
-            
-            await send_admin_message(telegram_id, no_results_text, keyboard)
-            return
+• جرب البحث باسم المنتج أو الفئة (كلمة كاملة)"""
         
-        # عرض النتائج
-        results_text = f"""🔍 *نتائج البحث عن:* `{search_term}`
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔍 بحث جديد", callback_data="search_order")],
+            [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="admin_main_menu")]
+        ])
+        
+        await send_admin_message(telegram_id, no_results_text, keyboard)
+        return
+    
+    # حفظ نص البحث لأزرار الصفحات
+    await set_admin_session(telegram_id, "search_order_results", {"term": search_term})
+    
+    # عرض النتائج
+    results_text = f"""🔍 *نتائج البحث عن:* `{search_term}`
 
-تم العثور على {len(orders)} طلب(ات):
+الصفحة {page + 1} - {len(orders)} طلب(ات):
 
 """
+    
+    keyboard = []
+    
+    for i, order in enumerate(orders, 1):
+        status_emoji = "✅" if order["status"] == "completed" else "⏳" if order["status"] == "pending" else "❌"
+        order_date = order["order_date"].strftime('%Y-%m-%d %H:%M')
         
-        keyboard = []
+        # التأكد من وجود order_number
+        if not order.get('order_number'):
+            order_number = f"AC{order['order_date'].strftime('%Y%m%d')}{order['id'][:8].upper()}"
+            await db.orders.update_one({"id": order['id']}, {"$set": {"order_number": order_number}})
+            order['order_number'] = order_number
         
-        for i, order in enumerate(orders, 1):
-            status_emoji = "✅" if order["status"] == "completed" else "⏳" if order["status"] == "pending" else "❌"
-            order_date = order["order_date"].strftime('%Y-%m-%d %H:%M')
-            
-            # التأكد من وجود order_number
-            if not order.get('order_number'):
-                order_number = f"AC{order['order_date'].strftime('%Y%m%d')}{order['id'][:8].upper()}"
-                await db.orders.update_one({"id": order['id']}, {"$set": {"order_number": order_number}})
-                order['order_number'] = order_number
-            
-            results_text += f"""**{i}.** {status_emoji} **{order.get('product_name', 'منتج')}**
+        results_text += f"""**{i}.** {status_emoji} **{order.get('product_name', 'منتج')}**
 📦 الفئة: {order['category_name']}
 🆔 رقم الطلب: `{order['order_number']}`
 🔑 ID: `{order['id'][:8].upper()}`
@@ -3834,23 +3626,28 @@ async def handle_admin_search_order_input(telegram_id: int, search_text: str, se
 ━━━━━━━━━━━━━━━━━━━━━━━━━
 
 """
-            
-            keyboard.append([InlineKeyboardButton(
-                f"📋 {order['order_number'][:15]}...", 
-                callback_data=f"admin_order_details_{order['id']}"
-            )])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("🔍 بحث جديد", callback_data="search_order")],
-            [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="admin_main_menu")]
-        ])
         
-        await send_admin_message(telegram_id, results_text, InlineKeyboardMarkup(keyboard))
-        
-    except Exception as e:
-        logging.error(f"Error in admin search order: {e}")
-        await send_admin_message(telegram_id, "❌ حدث خطأ في البحث. يرجى المحاولة مرة أخرى.")
+        keyboard.append([InlineKeyboardButton(
+            f"📋 {order['order_number'][:15]}...", 
+            callback_data=f"admin_order_details_{order['id']}"
+        )])
+    
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"search_order_page_{page - 1}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton("التالي ➡️", callback_data=f"search_order_page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.extend([
+        [InlineKeyboardButton("🔍 بحث جديد", callback_data="search_order")],
+        [InlineKeyboardButton("🔙 العودة للرئيسية", callback_data="admin_main_menu")]
+    ])
+    
+    await send_admin_message(telegram_id, results_text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("search_user")
 async def handle_admin_search_user(telegram_id: int):
     """بحث عن مستخدم"""
     await clear_admin_session(telegram_id)
@@ -3868,6 +3665,7 @@ async def handle_admin_search_user(telegram_id: int):
     
     await send_admin_message(telegram_id, search_text, keyboard)
 
+@admin_conversation.state("search_user_input")
 async def handle_admin_search_user_input(telegram_id: int, search_text: str, session: TelegramSession):
     """معالجة البحث عن المستخدم"""
     try:
@@ -3880,28 +3678,23 @@ async def handle_admin_search_user_input(telegram_id: int, search_text: str, ses
         user_telegram_id = int(search_text.strip())
         
         # البحث عن المستخدم
-        user = await db.users.find_one({"telegram_id": user_telegram_id})
+        user = await user_cache.get(user_telegram_id)
         
         if not user:
             await send_admin_message(telegram_id, f"❌ لم يتم العثور على مستخدم بـ ID: `{user_telegram_id}`")
             return
         
-        # الحصول على طلبات المستخدم
-        total_orders = await db.orders.count_documents({"telegram_id": user_telegram_id})
-        completed_orders = await db.orders.count_documents({"telegram_id": user_telegram_id, "status": "completed"})
-        pending_orders = await db.orders.count_documents({"telegram_id": user_telegram_id, "status": "pending"})
-        failed_orders = await db.orders.count_documents({"telegram_id": user_telegram_id, "status": "failed"})
-        
-        # حساب إجمالي المشتريات
-        pipeline = [
-            {"$match": {"telegram_id": user_telegram_id, "status": "completed"}},
-            {"$group": {"_id": None, "total": {"$sum": "$price"}}}
-        ]
-        total_spent_result = await db.orders.aggregate(pipeline).to_list(1)
-        total_spent = total_spent_result[0]['total'] if total_spent_result else 0
+        # الحصول على طلبات المستخدم وإجمالي مشترياته وآخر طلب في استعلام واحد
+        report = await build_report(db, "user", report_range("day"), match={"telegram_id": user_telegram_id},
+                                    include_last_order=True)
+        total_orders = report["total_orders"]
+        completed_orders = report["completed_orders"]
+        pending_orders = report["pending_orders"]
+        failed_orders = report["failed_orders"]
+        total_spent = report["total_revenue"]
         
         # آخر طلب
-        last_order = await db.orders.find_one({"telegram_id": user_telegram_id}, sort=[("order_date", -1)])
+        last_order = report["last_order"]
         last_order_text = f"{last_order['category_name']} (${last_order['price']:.2f})" if last_order else "لا يوجد"
         last_order_date = last_order['order_date'].strftime('%Y-%m-%d %H:%M') if last_order else "---"
         
@@ -3946,6 +3739,7 @@ async def handle_admin_search_user_input(telegram_id: int, search_text: str, ses
         logging.error(f"Error searching user: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ في البحث: {str(e)}")
 
+@admin_callbacks.prefix("admin_order_details_")
 async def handle_admin_order_details(telegram_id: int, order_id: str):
     """عرض تفاصيل طلب محدد"""
     try:
@@ -3956,7 +3750,7 @@ async def handle_admin_order_details(telegram_id: int, order_id: str):
             return
         
         # الحصول على معلومات المستخدم
-        user = await db.users.find_one({"telegram_id": order['telegram_id']})
+        user = await user_cache.get(order['telegram_id'])
         user_name = user.get('first_name', 'غير محدد') if user else 'غير محدد'
         user_username = user.get('username', 'لا يوجد') if user else 'لا يوجد'
         
@@ -4040,6 +3834,7 @@ async def handle_admin_order_details(telegram_id: int, order_id: str):
         logging.error(f"Error showing order details: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ: {str(e)}")
 
+@admin_callbacks.prefix("complete_order_")
 async def handle_admin_complete_order(telegram_id: int, order_id: str):
     """طلب تنفيذ طلب - التحقق من المخزون أو طلب إدخال الكود"""
     try:
@@ -4061,7 +3856,7 @@ async def handle_admin_complete_order(telegram_id: int, order_id: str):
             available_code = await db.codes.find_one({
                 "category_id": category_id,
                 "is_used": False
-            })
+            }, sort=[("created_at", 1)])
         
         order_number = order.get('order_number', order['id'][:8].upper())
         
@@ -4119,37 +3914,29 @@ async def handle_admin_use_code_from_stock(telegram_id: int, order_id: str, code
     """استخدام كود من المخزون لتنفيذ الطلب"""
     try:
         order = await db.orders.find_one({"id": order_id})
-        code_obj = await db.codes.find_one({"id": code_id})
         
-        if not order or not code_obj:
+        if not order:
             await send_admin_message(telegram_id, "❌ الطلب أو الكود غير موجود")
             return
         
-        if code_obj.get('is_used'):
+        # زر قديم لطلب منفذ مسبقاً لا يحجز كوداً جديداً
+        if order.get('status') != "pending":
+            await send_admin_message(telegram_id, "❌ تم تنفيذ هذا الطلب مسبقاً")
+            return
+        
+        # حجز الكود بشكل ذري - يفشل إذا سبقنا إليه طلب آخر (أو ضغطة مكررة على نفس الزر)
+        code_obj = await claim_code(db, code_id, order['telegram_id'], order_id)
+        
+        if not code_obj:
             await send_admin_message(telegram_id, "❌ هذا الكود مستخدم بالفعل")
             return
         
         # تحديث حالة الطلب
-        await db.orders.update_one(
-            {"id": order_id},
-            {"$set": {
-                "status": "completed",
-                "completed_at": datetime.now(timezone.utc),
-                "code_used": code_obj['code'],
-                "delivery_code": code_obj['code']
-            }}
-        )
-        
-        # تحديث حالة الكود
-        await db.codes.update_one(
-            {"id": code_id},
-            {"$set": {
-                "is_used": True,
-                "used_by": order['telegram_id'],
-                "used_at": datetime.now(timezone.utc),
-                "order_id": order_id
-            }}
-        )
+        await update_order_status(db, order_id, "completed", {
+            "completed_at": datetime.now(timezone.utc),
+            "code_used": code_obj['code'],
+            "delivery_code": code_obj['code']
+        })
         
         order_number = order.get('order_number', order['id'][:8].upper())
         
@@ -4165,7 +3952,8 @@ async def handle_admin_use_code_from_stock(telegram_id: int, order_id: str, code
 🎫 *الكود الخاص بك:*
 `{code_obj['code']}`
 
-شكراً لاستخدامك Abod Card! 🎉"""
+شكراً لاستخدامك Abod Card! 🎉""",
+            priority=PRIORITY_HIGH
         )
         
         await send_admin_message(
@@ -4186,6 +3974,7 @@ async def handle_admin_use_code_from_stock(telegram_id: int, order_id: str, code
         logging.error(f"Error using code from stock: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ: {str(e)}")
 
+@admin_callbacks.prefix("manual_code_")
 async def handle_admin_manual_code_input(telegram_id: int, order_id: str):
     """طلب إدخال كود يدوياً"""
     order = await db.orders.find_one({"id": order_id})
@@ -4215,6 +4004,7 @@ async def handle_admin_manual_code_input(telegram_id: int, order_id: str):
         "order_number": order_number
     })
 
+@admin_conversation.state("complete_order_code_input", ttl=LONG_INPUT_TTL)
 async def handle_admin_complete_order_code_input(telegram_id: int, code_text: str, session):
     """معالجة إدخال الكود لتنفيذ الطلب"""
     try:
@@ -4250,15 +4040,11 @@ async def handle_admin_complete_order_code_input(telegram_id: int, code_text: st
             order_number = order['order_number']
         
         # تحديث حالة الطلب
-        await db.orders.update_one(
-            {"id": order_id},
-            {"$set": {
-                "status": "completed",
-                "completed_at": datetime.now(timezone.utc),
-                "delivery_code": code,
-                "code_used": code
-            }}
-        )
+        await update_order_status(db, order_id, "completed", {
+            "completed_at": datetime.now(timezone.utc),
+            "delivery_code": code,
+            "code_used": code
+        })
         
         # إشعار العميل
         await send_user_message(
@@ -4272,7 +4058,8 @@ async def handle_admin_complete_order_code_input(telegram_id: int, code_text: st
 🎫 *الكود/الرد الخاص بك:*
 `{code}`
 
-شكراً لاستخدامك Abod Card! 🎉"""
+شكراً لاستخدامك Abod Card! 🎉""",
+            priority=PRIORITY_HIGH
         )
         
         await send_admin_message(
@@ -4294,6 +4081,7 @@ async def handle_admin_complete_order_code_input(telegram_id: int, code_text: st
         await send_admin_message(telegram_id, f"❌ حدث خطأ: {str(e)}")
 
 
+@admin_callbacks.prefix("cancel_order_")
 async def handle_admin_cancel_order(telegram_id: int, order_id: str):
     """إلغاء طلب"""
     try:
@@ -4308,19 +4096,16 @@ async def handle_admin_cancel_order(telegram_id: int, order_id: str):
             return
         
         # تحديث حالة الطلب
-        await db.orders.update_one(
-            {"id": order_id},
-            {"$set": {
-                "status": "cancelled",
-                "cancelled_at": datetime.now(timezone.utc)
-            }}
-        )
+        await update_order_status(db, order_id, "cancelled", {
+            "cancelled_at": datetime.now(timezone.utc)
+        })
         
         # إرجاع المبلغ للمستخدم
         await db.users.update_one(
             {"telegram_id": order['telegram_id']},
             {"$inc": {"balance": order['price']}}
         )
+        user_cache.invalidate(order['telegram_id'])
         
         # إشعار العميل
         await send_user_message(
@@ -4346,6 +4131,7 @@ async def handle_admin_cancel_order(telegram_id: int, order_id: str):
         logging.error(f"Error cancelling order: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ: {str(e)}")
 
+@admin_callbacks.exact("delete_test_data")
 async def handle_admin_delete_test_data_menu(telegram_id: int):
     """قائمة حذف البيانات الوهمية"""
     # الحصول على إحصائيات البيانات الوهمية
@@ -4369,6 +4155,7 @@ async def handle_admin_delete_test_data_menu(telegram_id: int):
     
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("confirm_delete_test_data")
 async def handle_admin_confirm_delete_test_data(telegram_id: int):
     """تأكيد وحذف البيانات الوهمية"""
     await send_admin_message(telegram_id, "🔄 جاري حذف البيانات الوهمية...")
@@ -4376,10 +4163,14 @@ async def handle_admin_confirm_delete_test_data(telegram_id: int):
     try:
         # حذف المستخدمين الوهميين
         users_result = await db.users.delete_many({"is_test_data": True})
+        user_cache.clear()
         
         # حذف الطلبات الوهمية
         orders_result = await db.orders.delete_many({"is_test_data": True})
         
+        # إعادة حساب التجميعات اليومية بعد الحذف الجماعي
+        await rebuild_rollups(db)
+        
         result_text = f"""✅ *تم حذف البيانات الوهمية بنجاح!*
 
 📊 **النتيجة:**
@@ -4398,6 +4189,7 @@ async def handle_admin_confirm_delete_test_data(telegram_id: int):
         logging.error(f"Error deleting test data: {e}")
         await send_admin_message(telegram_id, f"❌ حدث خطأ: {str(e)}")
 
+@admin_conversation.state("ammer_verify_input")
 async def handle_admin_ammer_verify_input(telegram_id: int, text: str, session: TelegramSession):
     """معالجة إدخال معرف المعاملة للتحقق"""
     try:
@@ -4460,6 +4252,7 @@ async def handle_admin_ammer_verify_input(telegram_id: int, text: str, session:
         logging.error(f"Error in admin ammer verify input: {e}")
         await send_admin_message(telegram_id, "❌ حدث خطأ في التحقق من المعاملة. يرجى المحاولة مرة أخرى.")
 
+@admin_callbacks.exact("add_product")
 async def handle_admin_add_product(telegram_id: int):
     """بدء عملية إضافة منتج جديد"""
     await clear_session(telegram_id, is_admin=True)
@@ -4510,6 +4303,7 @@ async def handle_admin_add_product_category_selected(telegram_id: int, category_
     
     await send_admin_message(telegram_id, text, keyboard)
 
+@admin_callbacks.exact("add_user_balance")
 async def handle_admin_add_user_balance(telegram_id: int):
     session = TelegramSession(telegram_id=telegram_id, state="add_user_balance_id")
     await save_session(session, is_admin=True)
@@ -4521,6 +4315,7 @@ async def handle_admin_add_user_balance(telegram_id: int):
     ])
     await send_admin_message(telegram_id, text, cancel_keyboard)
 
+@admin_callbacks.exact("manage_wallet")
 async def handle_admin_manage_wallet(telegram_id: int):
     keyboard = [
         [InlineKeyboardButton("💰 إضافة رصيد دولار", callback_data="add_user_balance")],
@@ -4542,6 +4337,7 @@ async def handle_admin_manage_wallet(telegram_id: int):
 
 # دالة عرض معاملات النجوم المحذوفة
 
+@admin_callbacks.exact("view_balances")
 async def handle_admin_view_balances(telegram_id: int):
     """عرض أرصدة المستخدمين"""
     try:
@@ -4588,9 +4384,10 @@ async def handle_admin_view_balances(telegram_id: int):
         logging.error(f"Error viewing balances: {e}")
         await send_admin_message(telegram_id, "❌ حدث خطأ في عرض الأرصدة.")
 
+@admin_callbacks.exact("add_category")
 async def handle_admin_add_category(telegram_id: int):
     # Get available products first
-    products = await db.products.find({"is_active": True}).to_list(100)
+    products = await catalog.list_products(active_only=True, limit=100)
     
     if not products:
         no_products_text = "❌ لا توجد منتجات متاحة. يجب إضافة منتج أولاً قبل إضافة الفئات."
@@ -4615,15 +4412,16 @@ async def handle_admin_add_category(telegram_id: int):
     
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@user_callbacks.prefix("product_")
 async def handle_user_product_selection(telegram_id: int, product_id: str):
     # Get product details
-    product = await db.products.find_one({"id": product_id})
+    product = await catalog.get_product(product_id)
     if not product:
         await send_user_message(telegram_id, "❌ المنتج غير موجود")
         return
     
     # Get categories for this product
-    categories = await db.categories.find({"product_id": product_id}).to_list(100)
+    categories = await catalog.list_categories(product_id=product_id, limit=100)
     
     if not categories:
         no_categories_text = f"❌ لا توجد فئات متاحة للمنتج *{product['name']}*"
@@ -4652,15 +4450,16 @@ async def handle_user_product_selection(telegram_id: int, product_id: str):
     
     await send_user_message(telegram_id, product_text, InlineKeyboardMarkup(keyboard))
 
+@user_callbacks.prefix("category_")
 async def handle_user_category_selection(telegram_id: int, category_id: str):
     # Get category details
-    category = await db.categories.find_one({"id": category_id})
+    category = await catalog.get_category(category_id)
     if not category:
         await send_user_message(telegram_id, "❌ الفئة غير موجودة")
         return
     
     # Get user balance
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if not user:
         await send_user_message(telegram_id, "❌ خطأ في بيانات المستخدم")
         return
@@ -4691,17 +4490,18 @@ async def handle_user_category_selection(telegram_id: int, category_id: str):
     
     await send_user_message(telegram_id, category_text, InlineKeyboardMarkup(keyboard))
 
+@user_callbacks.prefix("buy_category_")
 async def handle_user_purchase(telegram_id: int, category_id: str):
     # Get category and user info
-    category = await db.categories.find_one({"id": category_id})
-    user = await db.users.find_one({"telegram_id": telegram_id})
-    product = await db.products.find_one({"id": category["product_id"]})
+    category = await catalog.get_category(category_id)
+    user = await user_cache.get(telegram_id)
+    product = await catalog.get_product(category["product_id"])
     
     if not all([category, user, product]):
         await send_user_message(telegram_id, "❌ خطأ في البيانات")
         return
     
-    # Check balance
+    # Early check for the UI; the purchase engine re-checks atomically on debit
     if user['balance'] < category['price']:
         await send_user_message(telegram_id, "❌ رصيد غير كافي")
         return
@@ -4717,12 +4517,6 @@ async def handle_user_purchase(telegram_id: int, category_id: str):
         await handle_manual_purchase(telegram_id, category, user, product)
 
 async def handle_code_purchase(telegram_id: int, category: dict, user: dict, product: dict):
-    # Check for available codes
-    available_code = await db.codes.find_one({
-        "category_id": category["id"],
-        "is_used": False
-    })
-    
     # Create order
     order = Order(
         user_id=user['id'],
@@ -4732,32 +4526,17 @@ async def handle_code_purchase(telegram_id: int, category: dict, user: dict, pro
         category_id=category['id'],
         delivery_type=category['delivery_type'],
         price=category['price'],
-        status="completed" if available_code else "pending"
+        status="pending"
     )
     
-    # Deduct balance and update user
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {"$inc": {"balance": -category['price'], "orders_count": 1}}
-    )
+    # Debit, reserve the oldest available code and save the order atomically
+    result = await execute_purchase(db, telegram_id, category['price'], order.dict(), allocate_code_for_order=True, user_cache=user_cache)
+    if not result["success"]:
+        await send_user_message(telegram_id, "❌ رصيد غير كافي")
+        return
     
+    available_code = result["code"]
     if available_code:
-        # Mark code as used
-        await db.codes.update_one(
-            {"id": available_code['id']},
-            {
-                "$set": {
-                    "is_used": True,
-                    "used_by": user['id'],
-                    "used_at": datetime.now(timezone.utc)
-                }
-            }
-        )
-        
-        # Add code to order
-        order.code_sent = available_code['code']
-        order.completion_date = datetime.now(timezone.utc)
-        
         # Send code to user
         code_display = available_code['code']
         if available_code.get('serial_number'):
@@ -4813,15 +4592,12 @@ async def handle_code_purchase(telegram_id: int, category: dict, user: dict, pro
             category['price']
         )
     
-    # Save order
-    await db.orders.insert_one(order.dict())
-    
     back_keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("📋 عرض طلباتي", callback_data="order_history")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
     ])
     
-    await send_user_message(telegram_id, success_text, back_keyboard)
+    await send_user_message(telegram_id, success_text, back_keyboard, priority=PRIORITY_HIGH)
 
 async def handle_manual_input_purchase(telegram_id: int, category: dict, user: dict, product: dict, delivery_type: str):
     # Start session to get user input
@@ -4865,14 +4641,11 @@ async def handle_manual_purchase(telegram_id: int, category: dict, user: dict, p
         status="pending"
     )
     
-    # Deduct balance and update user
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {"$inc": {"balance": -category['price'], "orders_count": 1}}
-    )
-    
-    # Save order
-    await db.orders.insert_one(order.dict())
+    # Debit and save the order atomically
+    result = await execute_purchase(db, telegram_id, category['price'], order.dict(), user_cache=user_cache)
+    if not result["success"]:
+        await send_user_message(telegram_id, "❌ رصيد غير كافي")
+        return
     
     success_text = f"""⏳ *تم استلام طلبك!*
 
@@ -4905,7 +4678,7 @@ async def handle_manual_purchase(telegram_id: int, category: dict, user: dict, p
 للوصول لإدارة الطلبات: /start ثم اختر "📋 الطلبات" """
     
     try:
-        await send_admin_message(ADMIN_ID, admin_message)
+        await send_admin_message(ADMIN_ID, admin_message, priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Failed to notify admin: {e}")
     
@@ -4914,8 +4687,9 @@ async def handle_manual_purchase(telegram_id: int, category: dict, user: dict, p
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
     ])
     
-    await send_user_message(telegram_id, success_text, back_keyboard)
+    await send_user_message(telegram_id, success_text, back_keyboard, priority=PRIORITY_HIGH)
 
+@user_callbacks.prefix("order_details_")
 async def handle_user_order_details(telegram_id: int, order_id: str):
     order = await db.orders.find_one({"id": order_id, "telegram_id": telegram_id})
     if not order:
@@ -4948,6 +4722,7 @@ async def handle_user_order_details(telegram_id: int, order_id: str):
     
     await send_user_message(telegram_id, order_text, back_keyboard)
 
+@user_conversation.state("purchase_input_phone")
 async def handle_user_phone_input(telegram_id: int, text: str, session: TelegramSession):
     """Handle phone number input from user during purchase"""
     # Validate phone number (basic validation)
@@ -4959,6 +4734,7 @@ async def handle_user_phone_input(telegram_id: int, text: str, session: Telegram
     # Complete the purchase with phone number
     await complete_manual_purchase(telegram_id, session, phone)
 
+@user_conversation.state("purchase_input_email")
 async def handle_user_email_input(telegram_id: int, text: str, session: TelegramSession):
     """Handle email input from user during purchase"""
     # Validate email (basic validation)
@@ -4970,6 +4746,7 @@ async def handle_user_email_input(telegram_id: int, text: str, session: Telegram
     # Complete the purchase with email
     await complete_manual_purchase(telegram_id, session, email)
 
+@user_conversation.state("purchase_input_id")
 async def handle_user_id_input(telegram_id: int, text: str, session: TelegramSession):
     """Handle ID input from user during purchase"""
     # Validate ID (basic validation - should be numeric or alphanumeric)
@@ -4989,37 +4766,32 @@ async def complete_manual_purchase(telegram_id: int, session: TelegramSession, u
     price = session.data["price"]
     
     # Get user info
-    user = await db.users.find_one({"telegram_id": telegram_id})
+    user = await user_cache.get(telegram_id)
     if not user:
         await send_user_message(telegram_id, "❌ خطأ في بيانات المستخدم")
         return
     
-    # Check balance again
-    if user['balance'] < price:
-        await send_user_message(telegram_id, "❌ رصيد غير كافي")
-        return
-    
     # Create order
+    delivery_type = session.state.replace("purchase_input_", "")
     order = Order(
         user_id=user['id'],
         telegram_id=telegram_id,
         product_name=product_name,
         category_name=category_name,
         category_id=category_id,
-        delivery_type=session.state.replace("purchase_input_", ""),
+        delivery_type=delivery_type,
         price=price,
         status="pending",
-        user_input_data=user_input
-    )
-    
-    # Deduct balance and update user
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {"$inc": {"balance": -price, "orders_count": 1}}
+        additional_info={"user_id" if delivery_type == "id" else delivery_type: user_input}
     )
+    order_data = order.dict()
+    order_data["user_input_data"] = user_input
     
-    # Save order
-    await db.orders.insert_one(order.dict())
+    # Debit (balance re-checked atomically) and save the order
+    result = await execute_purchase(db, telegram_id, price, order_data, user_cache=user_cache)
+    if not result["success"]:
+        await send_user_message(telegram_id, "❌ رصيد غير كافي")
+        return
     
     # Clear session
     await clear_session(telegram_id)
@@ -5050,7 +4822,7 @@ async def complete_manual_purchase(telegram_id: int, session: TelegramSession, u
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="main_menu")]
     ])
     
-    await send_user_message(telegram_id, success_text, back_keyboard)
+    await send_user_message(telegram_id, success_text, back_keyboard, priority=PRIORITY_HIGH)
     
     # Notify admin about the new order
     admin_notification = f"""📋 *طلب جديد يتطلب تنفيذ يدوي*
@@ -5069,10 +4841,57 @@ async def complete_manual_purchase(telegram_id: int, session: TelegramSession, u
     # For now, we'll log it or you can replace with actual admin ID
     try:
         # Send to the correct admin ID
-        await send_admin_message(ADMIN_ID, admin_notification)
+        await send_admin_message(ADMIN_ID, admin_notification, priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Failed to notify admin: {e}")
 
+def make_code_builder(category_id: str, code_type: str):
+    """إنشاء مستند كود من سطر مستورد (نص ملصوق أو ملف)"""
+    def build_code(entry: ParsedCode) -> dict:
+        return Code(
+            code=entry.code,
+            description=f"كود {code_type}",
+            terms="يرجى اتباع شروط الاستخدام",
+            category_id=category_id,
+            code_type=code_type,
+            serial_number=entry.serial if code_type == "dual" else None
+        ).dict()
+    return build_code
+
+def admin_progress_message(telegram_id: int) -> ProgressMessage:
+    """رسالة تقدم واحدة تُعدل أثناء العمليات الطويلة"""
+    return ProgressMessage(
+        send=lambda progress_text: admin_sender.send_and_wait(telegram_id, text=progress_text),
+        edit=lambda message, progress_text: admin_sender.edit_message_text(
+            telegram_id, message.message_id, text=progress_text
+        )
+    )
+
+async def send_codes_import_result(telegram_id: int, category_name: str, result: ImportResult):
+    """رسالة نتيجة إضافة الأكواد"""
+    codes_added = result.inserted
+    errors = result.error_lines(5)
+    
+    result_text = f"✅ *تم إضافة {codes_added} كود للفئة: {category_name}*\n\n"
+    
+    if result.rejected:
+        result_text += f"⚠️ *أخطاء ({result.rejected}):*\n"
+        for error in errors:  # Show first 5 errors
+            result_text += f"• {error}\n"
+        if result.rejected > 5:
+            result_text += f"• ... و {result.rejected - 5} أخطاء أخرى\n"
+    
+    result_text += f"\n📊 إجمالي الأكواد المضافة: *{codes_added}*"
+    
+    keyboard = [
+        [InlineKeyboardButton("➕ إضافة أكواد أخرى", callback_data="add_codes")],
+        [InlineKeyboardButton("👁 عرض الأكواد", callback_data="view_codes")],
+        [InlineKeyboardButton("🔙 العودة لإدارة الأكواد", callback_data="manage_codes")]
+    ]
+    
+    await send_admin_message(telegram_id, result_text, InlineKeyboardMarkup(keyboard))
+
+@admin_conversation.state("add_codes_input", ttl=LONG_INPUT_TTL)
 async def handle_admin_codes_input(telegram_id: int, text: str, session: TelegramSession):
     """Handle codes input from admin"""
     category_id = session.data["category_id"]
@@ -5085,78 +4904,127 @@ async def handle_admin_codes_input(telegram_id: int, text: str, session: Telegra
         await send_admin_message(telegram_id, "❌ يرجى إدخال الأكواد")
         return
     
-    # Split by lines for multiple codes
-    code_lines = [line.strip() for line in codes_text.split('\n') if line.strip()]
+    # الدفعات الكبيرة تعرض رسالة تقدم واحدة تُعدل بعد كل دفعة كتابة
+    on_progress = None
+    if codes_text.count('\n') >= CODE_IMPORT_PROGRESS_LINES:
+        progress = admin_progress_message(telegram_id)
+        
+        async def on_progress(done: int, total: int, inserted: int):
+            await progress.update(f"⏳ جاري إضافة الأكواد... {done}/{total}", force=done == total)
     
-    codes_added = 0
-    errors = []
+    result = await import_codes(
+        db, category_id, code_type, codes_text, make_code_builder(category_id, code_type), on_progress=on_progress
+    )
     
-    for line in code_lines:
-        try:
-            if code_type == "dual":
-                # Handle dual codes (code|serial)
-                if '|' not in line:
-                    errors.append(f"خطأ في التنسيق: {line} - يجب استخدام | للفصل")
-                    continue
-                
-                code_part, serial_part = line.split('|', 1)
-                code_part = code_part.strip()
-                serial_part = serial_part.strip()
-                
-                if not code_part or not serial_part:
-                    errors.append(f"كود أو سيريال فارغ: {line}")
-                    continue
-                    
-            else:
-                code_part = line
-                serial_part = None
-            
-            # Check if code already exists
-            existing_code = await db.codes.find_one({"code": code_part, "category_id": category_id})
-            if existing_code:
-                errors.append(f"الكود موجود مسبقاً: {code_part}")
-                continue
-            
-            # Create new code
-            new_code = Code(
-                code=code_part,
-                description=f"كود {code_type}",
-                terms="يرجى اتباع شروط الاستخدام",
-                category_id=category_id,
-                code_type=code_type,
-                serial_number=serial_part if code_type == "dual" else None
-            )
-            
-            # Save to database
-            await db.codes.insert_one(new_code.dict())
-            codes_added += 1
-            
-        except Exception as e:
-            errors.append(f"خطأ في معالجة: {line} - {str(e)}")
+    if result.inserted:
+        inventory.invalidate()
     
     # Clear session
     await clear_session(telegram_id, is_admin=True)
     
-    # Prepare result message
-    result_text = f"✅ *تم إضافة {codes_added} كود للفئة: {category_name}*\n\n"
+    await send_codes_import_result(telegram_id, category_name, result)
+
+# مهام استيراد الملفات الجارية حسب معرف المهمة (مرجع يمنع جمعها قبل انتهائها ويمنع تشغيل المهمة مرتين)
+code_import_tasks: Dict[str, asyncio.Task] = {}
+
+async def handle_admin_codes_document(telegram_id: int, document, session: TelegramSession):
+    """استيراد أكواد من ملف TXT/CSV مرفوع في خطوة إضافة الأكواد"""
+    file_name = document.file_name or "codes.txt"
+    if not file_name.lower().endswith(DOCUMENT_EXTENSIONS):
+        await send_admin_message(telegram_id, "❌ يرجى إرسال ملف TXT أو CSV (كود في كل سطر)")
+        return
+    if document.file_size and document.file_size > MAX_DOCUMENT_SIZE:
+        await send_admin_message(
+            telegram_id, f"❌ حجم الملف أكبر من {MAX_DOCUMENT_SIZE // (1024 * 1024)}MB، يرجى تقسيمه لعدة ملفات"
+        )
+        return
     
-    if errors:
-        result_text += f"⚠️ *أخطاء ({len(errors)}):*\n"
-        for error in errors[:5]:  # Show first 5 errors
-            result_text += f"• {error}\n"
-        if len(errors) > 5:
-            result_text += f"• ... و {len(errors) - 5} أخطاء أخرى\n"
+    job, job_state = await open_job(
+        db,
+        category_id=session.data["category_id"],
+        category_name=session.data["category_name"],
+        code_type=session.data["code_type"],
+        telegram_id=telegram_id,
+        file_id=document.file_id,
+        file_unique_id=document.file_unique_id,
+        file_name=file_name,
+        file_size=document.file_size or 0
+    )
+    if job_state == JOB_RUNNING:
+        await send_admin_message(
+            telegram_id,
+            f"⏳ *استيراد هذا الملف جارٍ بالفعل* (تمت إضافة {job['inserted']} كود حتى الآن)\n\nستصلك النتيجة عند انتهائه."
+        )
+        return
     
-    result_text += f"\n📊 إجمالي الأكواد المضافة: *{codes_added}*"
+    await clear_session(telegram_id, is_admin=True)
     
-    keyboard = [
-        [InlineKeyboardButton("➕ إضافة أكواد أخرى", callback_data="add_codes")],
-        [InlineKeyboardButton("👁 عرض الأكواد", callback_data="view_codes")],
-        [InlineKeyboardButton("🔙 العودة لإدارة الأكواد", callback_data="manage_codes")]
-    ]
+    if job_state == JOB_RESUMED:
+        await send_admin_message(
+            telegram_id, f"♻️ *استئناف استيراد الملف* من بعد السطر {job['committed_line']} ({job['inserted']} كود مضاف سابقاً)"
+        )
+    start_code_import_job(job)
+
+def start_code_import_job(job: dict) -> bool:
+    """تشغيل مهمة الاستيراد في الخلفية حتى لا تعطل طابور تحديثات الإدارة (False إذا كانت تعمل بالفعل)"""
+    running = code_import_tasks.get(job["id"])
+    if running is not None and not running.done():
+        return False
+    task = asyncio.create_task(run_code_import_job(job), name=f"code-import-{job['id']}")
+    code_import_tasks[job["id"]] = task
+    task.add_done_callback(
+        lambda finished: code_import_tasks.pop(job["id"], None) if code_import_tasks.get(job["id"]) is finished else None
+    )
+    return True
+
+async def run_code_import_job(job: dict):
+    """تنزيل الملف واستيراده على دفعات مع رسالة تقدم واحدة"""
+    telegram_id = job["telegram_id"]
+    progress = admin_progress_message(telegram_id)
+    
+    async def on_progress(received: int, total: int, inserted: int):
+        percent = min(100, received * 100 // total) if total else 0
+        await progress.update(
+            f"⏳ جاري استيراد {job['file_name']}... {percent}%\n✅ تمت إضافة: {inserted}",
+            force=received >= total
+        )
     
-    await send_admin_message(telegram_id, result_text, InlineKeyboardMarkup(keyboard))
+    try:
+        telegram_file = await admin_bot.get_file(job["file_id"])
+        result = await import_stream(
+            db, job, http_clients.stream_bytes("telegram", telegram_file.file_path),
+            make_code_builder(job["category_id"], job["code_type"]), on_progress=on_progress
+        )
+    except asyncio.CancelledError:
+        # إيقاف الخادم: المهمة تبقى running وتُستأنف عند التشغيل التالي
+        raise
+    except Exception as e:
+        logging.error(f"Code import job {job['id']} stopped: {type(e).__name__}")
+        # أخطاء ما قبل الاستيراد (get_file) لا تمر عبر import_stream، والمهمة يجب ألا تبقى running
+        try:
+            await fail_job(db, job["id"])
+        except Exception as fail_error:
+            logging.error(f"Failed to mark code import job {job['id']} as failed: {fail_error}")
+        await send_admin_message(
+            telegram_id,
+            "❌ *توقف استيراد الملف*\n\nتم حفظ الأكواد المضافة حتى الآن. أعد إرسال نفس الملف في خطوة إضافة الأكواد لنفس الفئة للمتابعة من آخر دفعة محفوظة."
+        )
+        return
+    finally:
+        inventory.invalidate()
+    
+    await send_codes_import_result(telegram_id, job["category_name"], result)
+
+async def resume_code_import_jobs():
+    """استئناف مهام استيراد الملفات التي قطعها إيقاف الخادم (المهام الفاشلة تُستأنف بإعادة رفع الملف)"""
+    try:
+        for job in await running_jobs(db):
+            logging.info(f"Resuming code import job {job['id']} after line {job['committed_line']}")
+            start_code_import_job(job)
+    except Exception as e:
+        logging.error(f"Failed to resume code import jobs: {e}")
 
+@admin_callbacks.prefix("process_order_")
 async def handle_admin_process_order(telegram_id: int, order_id: str):
     """معالجة طلب معلق من الإدارة"""
     order = await db.orders.find_one({"id": order_id, "status": "pending"})
@@ -5208,6 +5076,7 @@ async def handle_admin_process_order(telegram_id: int, order_id: str):
     
     await send_admin_message(telegram_id, order_details, cancel_keyboard)
 
+@admin_callbacks.exact("view_all_pending")
 async def handle_admin_view_all_pending_orders(telegram_id: int):
     """عرض جميع الطلبات المعلقة"""
     pending_orders = await db.orders.find({"status": "pending"}).sort("order_date", 1).to_list(50)
@@ -5257,15 +5126,13 @@ async def handle_admin_view_all_pending_orders(telegram_id: int):
 async def verify_ammer_pay_transaction(transaction_id: str) -> dict:
     """التحقق من معاملة Ammer Pay"""
     try:
-        import httpx
-        
         ammer_token = os.environ.get('AMMER_PAY_TOKEN')
         if not ammer_token:
             logging.error("AMMER_PAY_TOKEN not found")
             return {"success": False, "error": "Token not configured"}
         
         # Ammer Pay API endpoint for transaction verification
-        url = "https://api.ammer.group/v1/transactions/verify"
+        url = "/v1/transactions/verify"
         headers = {
             "Authorization": f"Bearer {ammer_token}",
             "Content-Type": "application/json"
@@ -5273,22 +5140,21 @@ async def verify_ammer_pay_transaction(transaction_id: str) -> dict:
         
         data = {"transaction_id": transaction_id}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "data": result,
-                    "status": result.get("status"),
-                    "amount": result.get("amount"),
-                    "currency": result.get("currency"),
-                    "paid_at": result.get("paid_at")
-                }
-            else:
-                logging.error(f"Ammer Pay API error: {response.status_code} - {response.text}")
-                return {"success": False, "error": f"API Error: {response.status_code}"}
+        response = await http_clients.request("ammer_pay", "POST", url, headers=headers, json=data)
+        
+        if response.status_code == 200:
+            result = response.json()
+            return {
+                "success": True,
+                "data": result,
+                "status": result.get("status"),
+                "amount": result.get("amount"),
+                "currency": result.get("currency"),
+                "paid_at": result.get("paid_at")
+            }
+        else:
+            logging.error(f"Ammer Pay API error: {response.status_code} - {response.text}")
+            return {"success": False, "error": f"API Error: {response.status_code}"}
                 
     except Exception as e:
         logging.error(f"Error verifying Ammer Pay transaction: {e}")
@@ -5297,31 +5163,28 @@ async def verify_ammer_pay_transaction(transaction_id: str) -> dict:
 async def get_ammer_pay_balance() -> dict:
     """الحصول على رصيد Ammer Pay"""
     try:
-        import httpx
-        
         ammer_token = os.environ.get('AMMER_PAY_TOKEN')
         if not ammer_token:
             return {"success": False, "error": "Token not configured"}
         
-        url = "https://api.ammer.group/v1/account/balance"
+        url = "/v1/account/balance"
         headers = {
             "Authorization": f"Bearer {ammer_token}",
             "Content-Type": "application/json"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "balance": result.get("balance", 0),
-                    "currency": result.get("currency", "USD"),
-                    "available_for_withdrawal": result.get("available_for_withdrawal", 0)
-                }
-            else:
-                return {"success": False, "error": f"API Error: {response.status_code}"}
+        response = await http_clients.request("ammer_pay", "GET", url, headers=headers)
+        
+        if response.status_code == 200:
+            result = response.json()
+            return {
+                "success": True,
+                "balance": result.get("balance", 0),
+                "currency": result.get("currency", "USD"),
+                "available_for_withdrawal": result.get("available_for_withdrawal", 0)
+            }
+        else:
+            return {"success": False, "error": f"API Error: {response.status_code}"}
                 
     except Exception as e:
         logging.error(f"Error getting Ammer Pay balance: {e}")
@@ -5330,13 +5193,11 @@ async def get_ammer_pay_balance() -> dict:
 async def request_ammer_pay_withdrawal(amount: float, method: str = "bank") -> dict:
     """طلب سحب من Ammer Pay"""
     try:
-        import httpx
-        
         ammer_token = os.environ.get('AMMER_PAY_TOKEN')
         if not ammer_token:
             return {"success": False, "error": "Token not configured"}
         
-        url = "https://api.ammer.group/v1/withdrawals/request"
+        url = "/v1/withdrawals/request"
         headers = {
             "Authorization": f"Bearer {ammer_token}",
             "Content-Type": "application/json"
@@ -5348,19 +5209,18 @@ async def request_ammer_pay_withdrawal(amount: float, method: str = "bank") -> d
             "currency": "USD"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "withdrawal_id": result.get("withdrawal_id"),
-                    "status": result.get("status"),
-                    "estimated_processing_time": result.get("estimated_processing_time")
-                }
-            else:
-                return {"success": False, "error": f"API Error: {response.status_code}"}
+        response = await http_clients.request("ammer_pay", "POST", url, headers=headers, json=data)
+        
+        if response.status_code == 200:
+            result = response.json()
+            return {
+                "success": True,
+                "withdrawal_id": result.get("withdrawal_id"),
+                "status": result.get("status"),
+                "estimated_processing_time": result.get("estimated_processing_time")
+            }
+        else:
+            return {"success": False, "error": f"API Error: {response.status_code}"}
                 
     except Exception as e:
         logging.error(f"Error requesting Ammer Pay withdrawal: {e}")
@@ -5416,7 +5276,7 @@ async def handle_admin_order_details_view(telegram_id: int, order_id: str):
             return
         
         # الحصول على بيانات المستخدم
-        user = await db.users.find_one({"telegram_id": order["telegram_id"]})
+        user = await user_cache.get(order["telegram_id"])
         user_name = user.get('first_name', 'غير محدد') if user else 'غير محدد'
         
         # تحديد حالة الطلب
@@ -5506,38 +5366,19 @@ async def handle_admin_order_details_view(telegram_id: int, order_id: str):
         logging.error(f"Error viewing admin order details: {e}")
         await send_admin_message(telegram_id, "❌ حدث خطأ في عرض تفاصيل الطلب")
 
-async def handle_admin_orders_report(telegram_id: int):
+@admin_callbacks.exact("orders_report")
+async def handle_admin_orders_report(telegram_id: int, period: str = "day"):
     """تقرير شامل عن الطلبات"""
-    # إحصائيات عامة
-    total_orders = await db.orders.count_documents({})
-    completed_orders = await db.orders.count_documents({"status": "completed"})
-    pending_orders = await db.orders.count_documents({"status": "pending"})
-    failed_orders = await db.orders.count_documents({"status": "failed"})
-    
-    # إيرادات
-    revenue_result = await db.orders.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$price"}}}
-    ]).to_list(1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
-    # إحصائيات اليوم
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_orders = await db.orders.count_documents({
-        "order_date": {"$gte": today}
-    })
-    today_revenue_result = await db.orders.aggregate([
-        {"$match": {"status": "completed", "order_date": {"$gte": today}}},
-        {"$group": {"_id": None, "total": {"$sum": "$price"}}}
-    ]).to_list(1)
-    today_revenue = today_revenue_result[0]["total"] if today_revenue_result else 0
-    
+    report = await build_report(db, "orders", report_range(period))
+    total_orders = report["total_orders"]
+    completed_orders = report["completed_orders"]
+    pending_orders = report["pending_orders"]
+    failed_orders = report["failed_orders"]
+    total_revenue = report["total_revenue"]
+    period_orders = report["period_orders"]
+    period_revenue = report["period_revenue"]
     # طلبات متأخرة (أكثر من 24 ساعة)
-    yesterday = datetime.now(timezone.utc) - timedelta(hours=24)
-    overdue_orders = await db.orders.count_documents({
-        "status": "pending",
-        "order_date": {"$lt": yesterday}
-    })
+    overdue_orders = report["overdue_orders"]
     
     report_text = f"""📊 *تقرير شامل عن الطلبات*
 
@@ -5551,9 +5392,9 @@ async def handle_admin_orders_report(telegram_id: int):
 • إجمالي الإيرادات: *${total_revenue:.2f}*
 • متوسط قيمة الطلب: *${total_revenue/completed_orders if completed_orders > 0 else 0:.2f}*
 
-📅 *إحصائيات اليوم:*
-• طلبات اليوم: *{today_orders}*
-• إيرادات اليوم: *${today_revenue:.2f}*
+📅 *إحصائيات {report_period_title(period)}:*
+• الطلبات: *{period_orders}*
+• الإيرادات: *${period_revenue:.2f}*
 
 ⚠️ *تحذيرات:*
 • طلبات متأخرة (+24س): *{overdue_orders}*
@@ -5566,10 +5407,12 @@ async def handle_admin_orders_report(telegram_id: int):
     if overdue_orders > 0:
         keyboard.append([InlineKeyboardButton("⚠️ الطلبات المتأخرة", callback_data="view_overdue_orders")])
     
+    keyboard.append([report_period_button(period, "orders_report")])
     keyboard.append([InlineKeyboardButton("🔙 العودة لإدارة الطلبات", callback_data="manage_orders")])
     
     await send_admin_message(telegram_id, report_text, InlineKeyboardMarkup(keyboard))
 
+@admin_conversation.state("process_order_input_code", ttl=LONG_INPUT_TTL)
 async def handle_admin_order_code_input(telegram_id: int, text: str, session: TelegramSession):
     """معالجة إدخال الكود من الإدارة لتنفيذ الطلب"""
     order_id = session.data["order_id"]
@@ -5585,17 +5428,11 @@ async def handle_admin_order_code_input(telegram_id: int, text: str, session: Te
     
     try:
         # تحديث حالة الطلب
-        await db.orders.update_one(
-            {"id": order_id},
-            {
-                "$set": {
-                    "status": "completed",
-                    "code_sent": code_to_send,
-                    "completion_date": datetime.now(timezone.utc),
-                    "admin_notes": f"تم التنفيذ يدوياً بواسطة الإدارة"
-                }
-            }
-        )
+        await update_order_status(db, order_id, "completed", {
+            "code_sent": code_to_send,
+            "completion_date": datetime.now(timezone.utc),
+            "admin_notes": f"تم التنفيذ يدوياً بواسطة الإدارة"
+        })
         
         # الحصول على تفاصيل الطلب
         order = await db.orders.find_one({"id": order_id})
@@ -5667,7 +5504,7 @@ async def notify_admin_new_order(product_name: str, category_name: str, user_tel
 ⚠️ يحتاج تنفيذ يدوي - يرجى المتابعة من لوحة الإدارة."""
     
     try:
-        await send_admin_message(ADMIN_ID, admin_message)
+        await send_admin_message(ADMIN_ID, admin_message, priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Failed to notify admin about new order: {e}")
 
@@ -5687,7 +5524,7 @@ async def notify_admin_for_codeless_order(product_name: str, category_name: str,
 📋 للوصول لإدارة الطلبات: /start ثم اختر "📋 الطلبات" """
     
     try:
-        await send_admin_message(ADMIN_ID, admin_message)
+        await send_admin_message(ADMIN_ID, admin_message, priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Failed to notify admin: {e}")
 
@@ -5723,14 +5560,15 @@ async def check_for_pending_orders():
             admin_message += "يرجى مراجعة الطلبات المعلقة وتنفيذها."
             
             # إرسال للإدارة الرئيسية فقط (إشعارات الطلبات مسموحة)
-            await send_admin_message(ADMIN_ID, admin_message)
+            await send_admin_message(ADMIN_ID, admin_message, priority=PRIORITY_LOW)
     
     except Exception as e:
         logging.error(f"Error checking pending orders: {e}")
 
+@admin_callbacks.prefix("select_product_for_category_")
 async def handle_admin_select_product_for_category(telegram_id: int, product_id: str):
     # Get product details
-    product = await db.products.find_one({"id": product_id})
+    product = await catalog.get_product(product_id)
     if not product:
         await send_admin_message(telegram_id, "❌ المنتج غير موجود")
         return
@@ -5750,6 +5588,7 @@ async def handle_admin_select_product_for_category(telegram_id: int, product_id:
     ])
     await send_admin_message(telegram_id, text, cancel_keyboard)
 
+@admin_callbacks.prefix("delivery_")
 async def handle_admin_delivery_type_selection(telegram_id: int, delivery_type: str):
     session = await get_session(telegram_id, is_admin=True)
     if not session:
@@ -5764,15 +5603,14 @@ async def handle_admin_delivery_type_selection(telegram_id: int, delivery_type:
         "manual": "📝 طلب يدوي"
     }
     
-    session.data["delivery_type"] = delivery_type
-    session.state = "add_category_price"
-    await save_session(session, is_admin=True)
+    await admin_conversation.transition(session, "add_category_price", delivery_type=delivery_type)
     
     await send_admin_message(telegram_id, f"✅ تم اختيار: {delivery_types[delivery_type]}\n\n5️⃣ أدخل سعر الفئة (بالدولار):")
 
+@admin_callbacks.exact("add_codes")
 async def handle_admin_add_codes(telegram_id: int):
     # Get categories that support codes
-    categories = await db.categories.find({"delivery_type": "code"}).to_list(100)
+    categories = await catalog.list_categories(delivery_type="code", limit=100)
     
     if not categories:
         no_categories_text = "❌ لا توجد فئات تدعم الأكواد. يجب إضافة فئة بنوع 'كود تلقائي' أولاً."
@@ -5786,12 +5624,10 @@ async def handle_admin_add_codes(telegram_id: int):
     text = "🎫 *إضافة أكواد*\n\nاختر الفئة التي تريد إضافة أكواد لها:"
     keyboard = []
     
+    stock_levels = await inventory.stock_levels()
     for category in categories:
         # Get current stock
-        available_codes = await db.codes.count_documents({
-            "category_id": category["id"],
-            "is_used": False
-        })
+        available_codes = stock_levels.get(category["id"], {}).get("available", 0)
         
         keyboard.append([InlineKeyboardButton(
             f"{category['name']} ({available_codes} متاح)",
@@ -5801,8 +5637,9 @@ async def handle_admin_add_codes(telegram_id: int):
     keyboard.append([InlineKeyboardButton("🔙 العودة", callback_data="manage_codes")])
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.prefix("add_codes_to_category_")
 async def handle_admin_select_code_type(telegram_id: int, category_id: str):
-    category = await db.categories.find_one({"id": category_id})
+    category = await catalog.get_category(category_id)
     if not category:
         await send_admin_message(telegram_id, "❌ الفئة غير موجودة")
         return
@@ -5819,7 +5656,7 @@ async def handle_admin_select_code_type(telegram_id: int, category_id: str):
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
 async def handle_admin_code_type_selected(telegram_id: int, code_type: str, category_id: str):
-    category = await db.categories.find_one({"id": category_id})
+    category = await catalog.get_category(category_id)
     if not category:
         await send_admin_message(telegram_id, "❌ الفئة غير موجودة")
         return
@@ -5854,7 +5691,9 @@ DEF789|SERIAL123
 GHI456|SERIAL789
 ```
 
-⚠️ استخدم الرمز | للفصل بين الكود والسيريال"""
+⚠️ استخدم الرمز | للفصل بين الكود والسيريال
+
+📎 للكميات الكبيرة أرسل ملف TXT بنفس التنسيق أو CSV (عمود الكود ثم عمود السيريال)"""
     else:
         text = f"""🎫 *إضافة أكواد {code_type_names[code_type]} للفئة: {category['name']}*
 
@@ -5865,7 +5704,9 @@ GHI456|SERIAL789
 ABC123
 DEF456
 GHI789
-```"""
+```
+
+📎 للكميات الكبيرة أرسل ملف TXT أو CSV (كود في كل سطر)"""
     
     cancel_keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ إلغاء", callback_data="manage_codes")]
@@ -5873,8 +5714,9 @@ GHI789
     
     await send_admin_message(telegram_id, text, cancel_keyboard)
 
+@admin_callbacks.exact("view_codes")
 async def handle_admin_view_codes(telegram_id: int):
-    categories = await db.categories.find({"delivery_type": "code"}).to_list(100)
+    categories = await catalog.list_categories(delivery_type="code", limit=100)
     
     if not categories:
         text = "❌ لا توجد فئات تدعم الأكواد"
@@ -5886,10 +5728,12 @@ async def handle_admin_view_codes(telegram_id: int):
     
     text = "👁 *عرض الأكواد*\n\n"
     
+    stock_levels = await inventory.stock_levels()
     for category in categories:
-        total_codes = await db.codes.count_documents({"category_id": category["id"]})
-        used_codes = await db.codes.count_documents({"category_id": category["id"], "is_used": True})
-        available_codes = total_codes - used_codes
+        stock = stock_levels.get(category["id"], {})
+        total_codes = stock.get("total", 0)
+        used_codes = stock.get("used", 0)
+        available_codes = stock.get("available", 0)
         
         status_emoji = "🟢" if available_codes > 10 else "🟡" if available_codes > 5 else "🔴"
         text += f"{status_emoji} *{category['name']}*\n"
@@ -5902,16 +5746,15 @@ async def handle_admin_view_codes(telegram_id: int):
     
     await send_admin_message(telegram_id, text, InlineKeyboardMarkup(keyboard))
 
+@admin_callbacks.exact("low_stock_alerts")
 async def handle_admin_low_stock_alerts(telegram_id: int):
-    categories = await db.categories.find({"delivery_type": "code"}).to_list(100)
+    categories = await catalog.list_categories(delivery_type="code", limit=100)
     
     low_stock = []
+    stock_levels = await inventory.stock_levels()
     for category in categories:
-        available_codes = await db.codes.count_documents({
-            "category_id": category["id"],
-            "is_used": False
-        })
-        if available_codes <= 5:
+        available_codes = stock_levels.get(category["id"], {}).get("available", 0)
+        if available_codes <= LOW_STOCK_THRESHOLD:
             low_stock.append({
                 "name": category["name"],
                 "count": available_codes,
@@ -5936,7 +5779,7 @@ async def handle_admin_low_stock_alerts(telegram_id: int):
 # API endpoints for web interface
 @api_router.get("/products")
 async def get_products():
-    products = await db.products.find({"is_active": True}).to_list(100)
+    products = await catalog.list_product_summaries(await inventory.stock_levels(), active_only=True, limit=100)
     # إزالة _id من كل document
     for product in products:
         product.pop('_id', None)
@@ -5944,33 +5787,55 @@ async def get_products():
 
 @api_router.get("/categories") 
 async def get_categories():
-    categories = await db.categories.find().to_list(100)
+    categories = await catalog.list_categories(limit=100)
+    stock_levels = await inventory.stock_levels()
     # إزالة _id من كل document
     for category in categories:
         category.pop('_id', None)
+        category["in_stock"] = category_in_stock(category, stock_levels)
     return categories
 
 @api_router.get("/codes-stats")
 async def get_codes_stats():
-    categories = await db.categories.find({"delivery_type": "code"}).to_list(100)
+    categories = await catalog.list_categories(delivery_type="code", limit=100)
     stats = []
     
+    stock_levels = await inventory.stock_levels()
     for category in categories:
-        total_codes = await db.codes.count_documents({"category_id": category["id"]})
-        used_codes = await db.codes.count_documents({"category_id": category["id"], "is_used": True})
-        available_codes = total_codes - used_codes
+        stock = stock_levels.get(category["id"], {})
+        available_codes = stock.get("available", 0)
         
         stats.append({
             "category_name": category["name"],
             "category_id": category["id"],
-            "total_codes": total_codes,
-            "used_codes": used_codes,
+            "total_codes": stock.get("total", 0),
+            "used_codes": stock.get("used", 0),
             "available_codes": available_codes,
-            "status": "low" if available_codes <= 5 else "medium" if available_codes <= 10 else "good"
+            "status": stock_status(available_codes)
         })
     
     return stats
 
+@api_router.get("/dashboard-stats")
+async def get_dashboard_stats():
+    """إحصائيات لوحة التحكم من التجميعات اليومية"""
+    today = day_key(datetime.now(timezone.utc))
+    all_time, today_totals, total_users = await asyncio.gather(
+        order_totals(db),
+        order_totals(db, start_day=today),
+        signup_total(db)
+    )
+    return {
+        "total_users": total_users,
+        "total_orders": sum(row["count"] for row in all_time.values()),
+        "pending_orders": all_time.get("pending", {}).get("count", 0),
+        "completed_orders": all_time.get("completed", {}).get("count", 0),
+        "total_revenue": all_time.get("completed", {}).get("revenue", 0),
+        "today_orders": sum(row["count"] for row in today_totals.values()),
+        "today_revenue": today_totals.get("completed", {}).get("revenue", 0),
+        "new_users_today": await signup_total(db, start_day=today)
+    }
+
 @api_router.get("/users")
 async def get_users():
     users = await db.users.find().to_list(100)
@@ -6015,7 +5880,7 @@ async def web_purchase(purchase_data: dict):
             raise HTTPException(status_code=400, detail="معرف المستخدم غير صحيح")
         
         # التحقق من وجود المستخدم
-        user = await db.users.find_one({"telegram_id": user_telegram_id})
+        user = await user_cache.get(user_telegram_id)
         if not user:
             raise HTTPException(status_code=404, detail="المستخدم غير مسجل في النظام")
         
@@ -6024,7 +5889,7 @@ async def web_purchase(purchase_data: dict):
             raise HTTPException(status_code=403, detail="حسابك محظور. تواصل مع الدعم الفني")
         
         # التحقق من وجود الفئة
-        category = await db.categories.find_one({"id": category_id})
+        category = await catalog.get_category(category_id)
         if not category:
             raise HTTPException(status_code=404, detail="الفئة المطلوبة غير موجودة")
             
@@ -6043,7 +5908,7 @@ async def web_purchase(purchase_data: dict):
         payment_method = 'wallet'
         
         # البحث عن المنتج
-        product = await db.products.find_one({"id": category['product_id']})
+        product = await catalog.get_product(category['product_id'])
         if not product:
             raise HTTPException(status_code=404, detail="المنتج غير متاح حالياً")
         
@@ -6051,37 +5916,37 @@ async def web_purchase(purchase_data: dict):
         if not product.get('is_active', True):
             raise HTTPException(status_code=410, detail="المنتج غير نشط حالياً")
         
+        # بناء الطلب - يتم الخصم المشروط وحجز الكود وحفظ الطلب بشكل ذري في محرك الشراء
+        order = Order(
+            user_id=user['id'],
+            telegram_id=user_telegram_id,
+            product_name=product['name'],
+            category_name=category['name'],
+            category_id=category_id,
+            price=category_price,
+            delivery_type=delivery_type,
+            payment_method=payment_method,
+            status="pending",
+            additional_info=additional_info or None
+        )
+        
+        result = await execute_purchase(
+            db, user_telegram_id, category_price, order.dict(),
+            allocate_code_for_order=(delivery_type == "code"),
+            user_cache=user_cache
+        )
+        if not result["success"]:
+            raise HTTPException(
+                status_code=402,
+                detail="رصيد غير كافي.\n\nيمكنك شحن محفظتك من خلال الطرق المتاحة في البوت."
+            )
+        
         # معالجة الطلب حسب نوع التسليم
         if delivery_type == "code":
-            # البحث عن كود متاح
-            available_code = await db.codes.find_one({
-                "category_id": category_id,
-                "is_used": False
-            })
+            available_code = result["code"]
             
             if not available_code:
-                # إنشاء طلب يدوي
-                order = Order(
-                    user_id=user['id'],
-                    telegram_id=user_telegram_id,
-                    product_name=product['name'],
-                    category_name=category['name'],
-                    category_id=category_id,
-                    price=category['price'],
-                    delivery_type=delivery_type,
-                    status="pending",
-                    order_date=datetime.now(timezone.utc)
-                )
-                await db.orders.insert_one(order.dict())
-                
-                # خصم الرصيد
-                await db.users.update_one(
-                    {"telegram_id": user_telegram_id},
-                    {
-                        "$inc": {"balance": -category['price'], "orders_count": 1}
-                    }
-                )
-                
+                # لا يوجد كود - تم إنشاء طلب معلق
                 # إشعار الإدارة
                 await notify_admin_for_codeless_order(
                     product['name'], category['name'], user_telegram_id, category['price']
@@ -6095,66 +5960,7 @@ async def web_purchase(purchase_data: dict):
             }
             
             else:
-                # تنفيذ الطلب فوراً - يوجد كود متاح
-                # تحديث الكود
-                await db.codes.update_one(
-                    {"id": available_code['id']},
-                    {
-                        "$set": {
-                            "is_used": True,
-                            "used_by": user_telegram_id,
-                            "used_at": datetime.now(timezone.utc)
-                        }
-                    }
-                )
-                
-                # خصم المبلغ من محفظة المستخدم
-                new_balance = user_balance - category_price
-                await db.users.update_one(
-                    {"telegram_id": user_telegram_id},
-                    {"$set": {"balance": new_balance}}
-                )
-                
-                # إنشاء الطلب مع المحفظة المحلية
-                order_dict = {
-                    "id": str(uuid.uuid4()),
-                    "user_id": user['id'],
-                    "telegram_id": user_telegram_id,
-                    "product_name": product['name'],
-                    "category_name": category['name'],
-                    "category_id": category_id,
-                    "price": category_price,
-                    "delivery_type": delivery_type,
-                    "payment_method": payment_method,
-                    "status": "completed",
-                    "code_sent": available_code['code'],
-                    "completion_date": datetime.now(timezone.utc),
-                    "order_date": datetime.now(timezone.utc)
-                }
-
-                # إضافة المعلومات الإضافية إذا وجدت
-                if additional_info:
-                    order_dict["additional_info"] = additional_info
-                await db.orders.insert_one(order_dict)
-                
-                # خصم الرصيد من المحفظة المحلية
-                if payment_method == 'wallet':
-                    # خصم من رصيد الدولار
-                    await db.users.update_one(
-                        {"telegram_id": user_telegram_id},
-                        {
-                            "$inc": {"balance": -category_price, "orders_count": 1}
-                        }
-                    )
-                else:
-                    # للطرق الأخرى، لا نخصم من المحفظة (سيتم الدفع مباشرة)
-                    await db.users.update_one(
-                        {"telegram_id": user_telegram_id},
-                        {
-                            "$inc": {"orders_count": 1}
-                        }
-                    )
-                
+                # تم تنفيذ الطلب فوراً - تم حجز الكود
                 # إرسال الكود للمستخدم
                 code_display = available_code['code']
                 if available_code.get('serial_number'):
@@ -6182,7 +5988,7 @@ async def web_purchase(purchase_data: dict):
 🎉 شكراً لك لاختيار Abod Card!
 💬 للدعم الفني: @AbodStoreVIP"""
                 
-                await send_user_message(user_telegram_id, success_text)
+                await send_user_message(user_telegram_id, success_text, priority=PRIORITY_HIGH)
                 
                 # إشعار الإدارة
                 await notify_admin_new_order(
@@ -6199,34 +6005,7 @@ async def web_purchase(purchase_data: dict):
                 }
         
         else:
-            # طلبات يدوية (phone, email, id, manual)
-            order_dict = {
-                "id": str(uuid.uuid4()),
-                "user_id": user['id'],
-                "telegram_id": user_telegram_id,
-                "product_name": product['name'],
-                "category_name": category['name'],
-                "category_id": category_id,
-                "price": category_price,
-                "delivery_type": delivery_type,
-                "status": "pending",
-                "order_date": datetime.now(timezone.utc)
-            }
-
-            # إضافة المعلومات الإضافية إذا وجدت
-            if additional_info:
-                order_dict["additional_info"] = additional_info
-
-            await db.orders.insert_one(order_dict)
-            
-            # خصم الرصيد
-            await db.users.update_one(
-                {"telegram_id": user_telegram_id},
-                {
-                    "$inc": {"balance": -category_price, "orders_count": 1}
-                }
-            )
-            
+            # طلبات يدوية (phone, email, id, manual) - تم إنشاء الطلب كمعلق
             # إشعار المستخدم
             delivery_type_names = {
                 'code': 'كود تلقائي',
@@ -6262,7 +6041,7 @@ async def web_purchase(purchase_data: dict):
 🎉 شكراً لك لاختيار Abod Card!
 💬 للدعم الفني: @AbodStoreVIP"""
             
-            await send_user_message(user_telegram_id, success_text)
+            await send_user_message(user_telegram_id, success_text, priority=PRIORITY_HIGH)
             
             # إشعار الإدارة
             await notify_admin_new_order(
@@ -6375,8 +6154,8 @@ async def root():
 async def health_check():
     """Health check endpoint for deployment platforms"""
     try:
-        # Test database connection
-        await db.users.count_documents({})
+        # Test database connection (أمر ping لا يقرأ أي مجموعة)
+        await db.command("ping")
         return {
             "status": "healthy", 
             "database": "connected",
@@ -6391,6 +6170,34 @@ async def health_check():
             "timestamp": datetime.now(timezone.utc)
         }
 
+def cache_stats() -> dict:
+    """إحصائيات الذاكرات المؤقتة مع تحديث مقياس cache_hit_ratio لكل منها"""
+    caches = {
+        "users": user_cache.stats(),
+        "user_sessions": user_session_store.stats(),
+        "admin_sessions": admin_session_store.stats(),
+        "inventory": inventory.stats()
+    }
+    for name, stats in caches.items():
+        metrics.gauge("cache_hit_ratio", cache=name).set(stats["hit_ratio"])
+    return caches
+
+@api_router.get("/metrics")
+async def get_metrics(format: str = "json"):
+    """
+    مقاييس الأداء: زمن كل مسار في البوتين، أوامر MongoDB، استدعاءات Bot API، عمق الطوابير ونسب الإصابة
+
+    ?format=prometheus لإرجاعها بصيغة Prometheus النصية
+    """
+    caches = cache_stats()
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return {
+        "timestamp": datetime.now(timezone.utc),
+        "metrics": metrics.snapshot(),
+        "caches": caches
+    }
+
 @api_router.get("/test")
 async def test_endpoint():
     return {"message": "Test endpoint working", "timestamp": datetime.now(timezone.utc)}
@@ -6398,6 +6205,21 @@ async def test_endpoint():
 # Include router
 app.include_router(api_router)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """زمن كل طلب REST حسب قالب المسار (وليس الرابط الفعلي) وحالة الاستجابة"""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.histogram("api_request_seconds", method=request.method, route=path).observe(time.perf_counter() - start)
+        metrics.counter("api_requests_total", method=request.method, route=path, status=str(status_code)).inc()
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -6424,14 +6246,13 @@ async def send_system_heartbeat():
     try:
         # تم إيقاف إشعارات heartbeat النظام بناءً على طلب المستخدم
         # إحصائيات سريعة للمراقبة الداخلية فقط
-        users_count = await db.users.count_documents({})
-        orders_today = await db.orders.count_documents({
-            "order_date": {"$gte": datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)}
-        })
-        pending_orders = await db.orders.count_documents({"status": "pending"})
+        today = day_key(datetime.now(timezone.utc))
+        users_count = await signup_total(db)
+        orders_today = sum(row["count"] for row in (await order_totals(db, start_day=today)).values())
+        pending_orders = (await order_totals(db)).get("pending", {}).get("count", 0)
         
         # إحصائية الأكواد المتاحة
-        available_codes = await db.codes.count_documents({"is_used": False})
+        available_codes = sum(stock["available"] for stock in (await inventory.stock_levels()).values())
         
         # تسجيل في لوج النظام بدلاً من إرسال إشعار
         logging.info(f"System heartbeat: Users={users_count}, Orders_today={orders_today}, Pending={pending_orders}, Available_codes={available_codes}")
@@ -6512,11 +6333,56 @@ async def background_tasks():
             
             await asyncio.sleep(300)  # انتظار 5 دقائق في حالة الخطأ
 
+async def apply_database_indexes():
+    """تطبيق بيان الفهارس في الخلفية دون تعطيل بدء التشغيل"""
+    try:
+        from db_indexes import apply_index_manifest
+        await apply_index_manifest(db)
+    except Exception as e:
+        logging.error(f"Error applying index manifest: {e}")
+    
+    try:
+        await ensure_rollups(db)
+    except Exception as e:
+        logging.error(f"Error building daily rollups: {e}")
+
 @app.on_event("startup")
 async def startup_background_tasks():
     """بدء المهام الخلفية"""
+    # رفض البادئات المتداخلة في جداول المسارات قبل استقبال أي تحديث
+    user_callbacks.validate()
+    admin_callbacks.validate()
+    user_aliases.validate()
+    asyncio.create_task(apply_database_indexes())
+    await http_clients.start_http_clients()
+    await user_session_store.start()
+    await admin_session_store.start()
+    await catalog.start()
+    await inventory.start()
+    await user_sender.start()
+    await admin_sender.start()
+    await user_update_dispatcher.start()
+    await admin_update_dispatcher.start()
     asyncio.create_task(background_tasks())
+    await resume_code_import_jobs()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # إنهاء التحديثات الموجودة في الطوابير قبل إغلاق الاتصال بقاعدة البيانات
+    await user_update_dispatcher.stop()
+    await admin_update_dispatcher.stop()
+    # مهام استيراد الملفات تُستأنف من آخر دفعة محفوظة عند التشغيل التالي
+    import_tasks = list(code_import_tasks.values())
+    for task in import_tasks:
+        task.cancel()
+    await asyncio.gather(*import_tasks, return_exceptions=True)
+    # إرسال الرسائل المتبقية في طابور الإرسال
+    await user_sender.stop()
+    await admin_sender.stop()
+    await http_clients.close_http_clients()
+    # كتابة الجلسات المعلقة قبل إغلاق الاتصال
+    await user_session_store.stop()
+    await admin_session_store.stop()
+    await catalog.stop()
+    await inventory.stop()
     client.close()
\ No newline at end of file
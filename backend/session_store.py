@@ -0,0 +1,220 @@
+"""
+Session Store - مخزن الجلسات
+قراءة الجلسات من ذاكرة محلية (LRU + TTL) وتجميع الكتابات وإرسالها لقاعدة البيانات في الخلفية (write-behind)
+
+- القراءة: من الذاكرة، وعند عدم الوجود من MongoDB (لذلك تبقى الجلسات بعد إعادة التشغيل)
+- الكتابة: تُحفظ في الذاكرة فوراً وتُجمع عدة كتابات لنفس المستخدم في عملية واحدة عند التفريغ
+- التحديث الجزئي (patch): يُكتب فقط ما تغير من الحقول ($set بمسارات مثل data.name) بدلاً من المستند كاملاً
+- الحذف التلقائي للجلسات القديمة يتم بفهرس TTL على updated_at (انظر db_indexes.py)
+"""
+import asyncio
+import copy
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '900'))
+DEFAULT_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get('SESSION_FLUSH_INTERVAL', '0.5'))
+
+# علامة حذف معلّق في طابور الكتابة
+_DELETED = object()
+
+
+class _Patch(dict):
+    """حقول معدلة لم تُكتب بعد (مسار نقطي -> قيمة)"""
+
+
+def _apply_fields(doc: dict, fields: dict):
+    """تطبيق حقول $set بمسارات نقطية على مستند في الذاكرة"""
+    for path, value in fields.items():
+        target = doc
+        *parents, leaf = path.split(".")
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = copy.deepcopy(value)
+
+
+def _merge_pending(older, newer):
+    """دمج تغيير معلق قديم (فشلت كتابته) مع تغيير أحدث لنفس الجلسة"""
+    if newer is _DELETED or not isinstance(newer, _Patch):
+        return newer
+    if older is _DELETED:
+        # الجلسة حُذفت ثم عُدلت: التعديل لا يعيد إنشاءها
+        return older
+    merged = copy.deepcopy(older)
+    if isinstance(merged, _Patch):
+        merged.update(newer)
+    else:
+        _apply_fields(merged, newer)
+    return merged
+
+
+class SessionStore:
+    """ذاكرة مؤقتة مع كتابة مؤجلة لمجموعة جلسات واحدة"""
+
+    def __init__(self, name: str, collection, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 flush_interval: Optional[float] = None):
+        self.name = name
+        self.collection = collection
+        self.ttl = DEFAULT_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or DEFAULT_CACHE_SIZE
+        self.flush_interval = flush_interval or DEFAULT_FLUSH_INTERVAL
+
+        # telegram_id -> (المستند أو None إذا لا توجد جلسة, وقت التخزين)
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        # telegram_id -> آخر مستند لم يُكتب بعد، أو حقول معدلة (_Patch)، أو _DELETED
+        self._dirty: Dict[int, object] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self._hits = metrics.counter("session_cache_total", store=name, result="hit")
+        self._misses = metrics.counter("session_cache_total", store=name, result="miss")
+        self._flush_time = metrics.histogram("session_flush_seconds", store=name)
+        self._coalesced = metrics.counter("session_writes_coalesced_total", store=name)
+
+    def _remember(self, telegram_id: int, doc: Optional[dict]):
+        self._cache[telegram_id] = (doc, time.monotonic())
+        self._cache.move_to_end(telegram_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def get(self, telegram_id: int) -> Optional[dict]:
+        """الحصول على مستند الجلسة (نسخة مستقلة) أو None"""
+        pending = self._dirty.get(telegram_id)
+        if pending is not None and not isinstance(pending, _Patch):
+            self._hits.inc()
+            return None if pending is _DELETED else copy.deepcopy(pending)
+
+        cached = self._cache.get(telegram_id)
+        if cached is not None and (pending is not None or time.monotonic() - cached[1] < self.ttl):
+            self._cache.move_to_end(telegram_id)
+            self._hits.inc()
+            return copy.deepcopy(cached[0])
+
+        self._misses.inc()
+        doc = await self.collection.find_one({"telegram_id": telegram_id}, {"_id": 0})
+        # قد تكون كتابة جديدة وصلت أثناء انتظار القراءة
+        pending = self._dirty.get(telegram_id)
+        if pending is not None and not isinstance(pending, _Patch):
+            return await self.get(telegram_id)
+        if doc is not None and pending is not None:
+            _apply_fields(doc, pending)
+        self._remember(telegram_id, doc)
+        return copy.deepcopy(doc)
+
+    def put(self, doc: dict):
+        """حفظ الجلسة في الذاكرة وجدولة كتابتها"""
+        telegram_id = doc["telegram_id"]
+        doc = copy.deepcopy(doc)
+        if telegram_id in self._dirty:
+            self._coalesced.inc()
+        self._dirty[telegram_id] = doc
+        self._remember(telegram_id, doc)
+
+    def patch(self, telegram_id: int, fields: dict):
+        """
+        تحديث حقول محددة فقط وجدولة كتابتها كـ $set
+
+        Args:
+            fields: مسار نقطي -> قيمة، مثل {"state": "...", "data.name": "..."}
+        """
+        pending = self._dirty.get(telegram_id)
+        if pending is _DELETED:
+            return
+        if pending is not None:
+            self._coalesced.inc()
+            if isinstance(pending, _Patch):
+                pending.update(copy.deepcopy(fields))
+            else:
+                _apply_fields(pending, fields)
+        else:
+            self._dirty[telegram_id] = _Patch(copy.deepcopy(fields))
+
+        cached = self._cache.get(telegram_id)
+        if cached is not None and cached[0] is not None:
+            if cached[0] is not pending:
+                _apply_fields(cached[0], fields)
+            self._cache.move_to_end(telegram_id)
+        else:
+            # المستند غير معروف محلياً: القراءة التالية تجلبه من القاعدة وتطبق عليه الحقول المعلقة
+            self._cache.pop(telegram_id, None)
+
+    def delete(self, telegram_id: int):
+        """حذف الجلسة من الذاكرة وجدولة حذفها من قاعدة البيانات"""
+        if telegram_id in self._dirty:
+            self._coalesced.inc()
+        self._dirty[telegram_id] = _DELETED
+        self._remember(telegram_id, None)
+
+    def stats(self) -> dict:
+        """نسبة الإصابة وعدد الكتابات المعلقة"""
+        hits, misses = self._hits.value, self._misses.value
+        total = hits + misses
+        return {
+            "entries": len(self._cache),
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "pending_writes": len(self._dirty)
+        }
+
+    async def flush(self):
+        """كتابة كل التغييرات المعلقة في عملية bulk واحدة"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+
+            operations = []
+            for telegram_id, doc in batch.items():
+                if doc is _DELETED:
+                    operations.append(DeleteOne({"telegram_id": telegram_id}))
+                elif isinstance(doc, _Patch):
+                    # لا upsert: تعديل جلسة حُذفت من القاعدة لا يعيد إنشاءها ناقصة
+                    operations.append(UpdateOne({"telegram_id": telegram_id}, {"$set": dict(doc)}))
+                else:
+                    operations.append(UpdateOne({"telegram_id": telegram_id}, {"$set": doc}, upsert=True))
+
+            start = time.perf_counter()
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Session store '{self.name}' flush failed ({len(operations)} ops): {e}")
+                # إعادة التغييرات للطابور ما لم تُستبدل بكتابة أحدث
+                for telegram_id, doc in batch.items():
+                    newer = self._dirty.get(telegram_id)
+                    self._dirty[telegram_id] = doc if newer is None else _merge_pending(doc, newer)
+                raise
+            finally:
+                self._flush_time.observe(time.perf_counter() - start)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # تم التسجيل داخل flush - المحاولة مرة أخرى في الدورة التالية
+                await asyncio.sleep(self.flush_interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name=f"session-store-{self.name}")
+
+    async def stop(self):
+        """إيقاف حلقة التفريغ وكتابة ما تبقى"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            pass
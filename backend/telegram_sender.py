@@ -0,0 +1,362 @@
+"""
+Telegram Send Scheduler - جدولة إرسال رسائل تليجرام
+طابور مركزي للرسائل الصادرة مع حد عام للرسائل في الثانية، وحد لكل محادثة، وأولويات،
+واحترام retry_after عند تجاوز حدود تليجرام (429) مع إعادة المحاولة
+
+- رسائل كل محادثة في طابور FIFO خاص بها، وطابور الأولويات يحمل المحادثات الجاهزة لا الرسائل،
+  فلا يخدم المحادثة أكثر من عامل واحد في نفس الوقت ويبقى ترتيب رسائلها محفوظاً
+- المحادثة التي نفد حدها أو تنتظر إعادة محاولة تُؤجل بمؤقت بدلاً من حجز عامل، فمحادثة مزدحمة
+  لا توقف الإرسال لباقي المحادثات
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# الأولويات (الرقم الأصغر يُرسل أولاً)
+PRIORITY_HIGH = 0     # نتائج الشراء للعملاء
+PRIORITY_NORMAL = 1   # الردود العادية
+PRIORITY_LOW = 2      # إشعارات الإدارة
+
+# حدود تليجرام: حوالي 30 رسالة/ثانية للبوت، ورسالة/ثانية لكل محادثة مع السماح بدفعات قصيرة
+DEFAULT_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+DEFAULT_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+DEFAULT_CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', '3'))
+DEFAULT_CONCURRENCY = int(os.environ.get('TELEGRAM_SEND_CONCURRENCY', '8'))
+DEFAULT_MAX_RETRIES = int(os.environ.get('TELEGRAM_SEND_RETRIES', '5'))
+# اتصالات البوت المتزامنة مع Bot API (يجب أن تكفي عمال الإرسال + الردود المباشرة)
+DEFAULT_BOT_POOL_SIZE = int(os.environ.get('TELEGRAM_BOT_POOL_SIZE', '16'))
+
+# حد أقصى لعدد المحادثات المحفوظة حالتها قبل التنظيف
+MAX_TRACKED_CHATS = 10000
+# تأجيل المحادثة عندما يكون إرسال مباشر (send_and_wait) جارياً لها
+LOCK_RETRY_DELAY = 0.1
+
+# طرق يمكن إعادتها بأمان بعد انتهاء المهلة (إعادة send_message قد تكرر رسالة وصلت فعلاً)
+RETRY_ON_TIMEOUT = {"edit_message_text"}
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    طبقة HTTP لمكتبة python-telegram-bot تسجل زمن كل استدعاء لـ Bot API وأخطاءه حسب الطريقة
+
+    الاستخدام: Bot(token, request=InstrumentedRequest("user"))
+    """
+
+    def __init__(self, bot_name: str, **kwargs):
+        kwargs.setdefault("connection_pool_size", DEFAULT_BOT_POOL_SIZE)
+        super().__init__(**kwargs)
+        self.bot_name = bot_name
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            metrics.counter("telegram_api_errors_total", bot=self.bot_name, method=api_method,
+                            error=type(e).__name__).inc()
+            raise
+        finally:
+            metrics.histogram("telegram_api_seconds", bot=self.bot_name, method=api_method).observe(
+                time.perf_counter() - start
+            )
+        if status_code >= 400:
+            metrics.counter("telegram_api_errors_total", bot=self.bot_name, method=api_method,
+                            error=str(status_code)).inc()
+        return status_code, payload
+
+
+class TokenBucket:
+    """دلو رموز بسيط: reserve() يحجز رمزاً ويعيد مدة الانتظار المطلوبة"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        """إيقاف الدلو مدة seconds: الرصيد يصبح سالباً فكل حجز لاحق ينتظر انتهاءها"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def wait_time(self) -> float:
+        """مدة الانتظار حتى يتوفر رمز (دون حجزه)"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    """رسالة في طابور محادثة"""
+
+    __slots__ = ("priority", "enqueued_at", "kwargs", "attempt")
+
+    def __init__(self, priority: int, kwargs: dict):
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.kwargs = kwargs
+        self.attempt = 0
+
+
+class SendScheduler:
+    """مُرسل رسائل بوت واحد عبر طابور محادثات جاهزة بالأولوية ومجموعة عمال"""
+
+    def __init__(self, name: str, bot, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 chat_burst: Optional[int] = None, concurrency: Optional[int] = None, max_retries: Optional[int] = None):
+        self.name = name
+        self.bot = bot
+        self.chat_rate = chat_rate or DEFAULT_CHAT_RATE
+        self.chat_burst = chat_burst or DEFAULT_CHAT_BURST
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.max_retries = DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+
+        self._global_bucket = TokenBucket(global_rate or DEFAULT_GLOBAL_RATE, global_rate or DEFAULT_GLOBAL_RATE)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        # رسائل كل محادثة بالترتيب: وجود المحادثة هنا يعني أنها مجدولة مرة واحدة فقط
+        # (في طابور الجاهزة، أو مؤجلة بمؤقت، أو يخدمها عامل)
+        self._outboxes: Dict[int, Deque[_Outgoing]] = {}
+        self._pending = 0
+        # الرقم التسلسلي يحفظ ترتيب الوصول داخل نفس الأولوية
+        self._sequence = itertools.count()
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        self._depth = metrics.gauge("telegram_send_queue_depth", bot=name)
+        self._send_time = metrics.histogram("telegram_send_seconds", bot=name)
+        self._delay_time = metrics.histogram("telegram_send_delay_seconds", bot=name)
+        self._retries = metrics.counter("telegram_send_retries_total", bot=name)
+        self._failed = metrics.counter("telegram_send_failed_total", bot=name)
+        self._timeouts = metrics.counter("telegram_send_timeouts_total", bot=name)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._ready = asyncio.PriorityQueue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-sender-{index}")
+            for index in range(self.concurrency)
+        ]
+        logger.info(f"Send scheduler '{self.name}' started: {self.concurrency} workers")
+
+    async def stop(self, timeout: float = 10.0):
+        """إيقاف العمال بعد إرسال ما تبقى في الطوابير (بحد أقصى timeout ثانية)"""
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        while self._outboxes and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning(f"Send scheduler '{self.name}': {self._pending} messages dropped on shutdown")
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._outboxes.clear()
+        self._pending = 0
+        self._depth.set(0)
+
+    async def send_message(self, chat_id: int, priority: int = PRIORITY_NORMAL, **kwargs):
+        """
+        جدولة رسالة للإرسال دون انتظار (لا يعطل مسار الطلب)
+
+        عند عدم تشغيل المُجدول يتم الإرسال مباشرة
+        """
+        if not self.running:
+            await self._deliver(chat_id, kwargs)
+            return
+        outbox = self._outboxes.get(chat_id)
+        scheduled = outbox is not None
+        if not scheduled:
+            outbox = self._outboxes[chat_id] = deque()
+        outbox.append(_Outgoing(priority, kwargs))
+        self._pending += 1
+        self._depth.set(self._pending)
+        if not scheduled:
+            self._schedule(chat_id)
+
+    async def send_and_wait(self, chat_id: int, **kwargs):
+        """
+        إرسال فوري مع انتظار النتيجة (لرسائل تُعدل لاحقاً مثل رسالة التقدم)
+
+        Returns:
+            Message: الرسالة المرسلة أو None عند الفشل
+        """
+        lock, chat_bucket = self._chat_state(chat_id)
+        async with lock:
+            return await self._deliver(chat_id, kwargs, chat_bucket)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, **kwargs):
+        """تعديل نص رسالة سابقة مع احترام نفس حدود الإرسال"""
+        lock, chat_bucket = self._chat_state(chat_id)
+        async with lock:
+            return await self._deliver(chat_id, dict(kwargs, message_id=message_id), chat_bucket, method="edit_message_text")
+
+    def _chat_state(self, chat_id: int):
+        if chat_id not in self._chat_locks:
+            if len(self._chat_locks) >= MAX_TRACKED_CHATS:
+                self._prune_chats()
+            self._chat_locks[chat_id] = asyncio.Lock()
+            self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self._chat_locks[chat_id], self._chat_buckets[chat_id]
+
+    def _prune_chats(self):
+        for chat_id in list(self._chat_locks):
+            if (chat_id not in self._outboxes and not self._chat_locks[chat_id].locked()
+                    and self._chat_buckets[chat_id].idle):
+                del self._chat_locks[chat_id]
+                del self._chat_buckets[chat_id]
+
+    def _schedule(self, chat_id: int):
+        """إضافة المحادثة لطابور الجاهزة بأولوية أهم رسالة فيها"""
+        self._timers.pop(chat_id, None)
+        outbox = self._outboxes.get(chat_id)
+        if outbox and self._ready is not None:
+            priority = min(message.priority for message in outbox)
+            self._ready.put_nowait((priority, next(self._sequence), chat_id))
+
+    def _defer(self, chat_id: int, delay: float):
+        """إعادة المحادثة لطابور الجاهزة بعد delay ثانية دون حجز عامل"""
+        self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._schedule, chat_id)
+
+    async def _attempt(self, chat_id: int, kwargs: dict, chat_bucket: Optional[TokenBucket],
+                       method: str, attempt: int) -> Tuple[bool, object, float]:
+        """
+        محاولة إرسال واحدة
+
+        Returns:
+            tuple: (انتهت الرسالة بنجاح أو فشل نهائي، نتيجة الاستدعاء، مدة الانتظار قبل إعادة المحاولة)
+        """
+        wait = self._global_bucket.reserve()
+        if chat_bucket is not None:
+            wait = max(wait, chat_bucket.reserve())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        started = time.perf_counter()
+        try:
+            result = await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+            self._send_time.observe(time.perf_counter() - started)
+            return True, result, 0.0
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            delay = retry_after + random.uniform(0, 1)
+            # حد تليجرام يشمل البوت كله: كل العمال يتوقفون عن الإرسال حتى انتهاء retry_after
+            self._global_bucket.pause(retry_after)
+            logger.warning(f"Flood control for chat {chat_id}, pausing all sends for {retry_after:.1f}s")
+        except TimedOut as e:
+            if method not in RETRY_ON_TIMEOUT:
+                # الطلب ربما وصل لتليجرام قبل انتهاء المهلة: إعادته قد ترسل الرسالة مرتين
+                self._timeouts.inc()
+                logger.warning(f"Timed out sending {self.name} message to {chat_id}, not retrying: {e}")
+                return True, None, 0.0
+            delay = min(30.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5)
+            logger.warning(f"Timed out on {method} for {chat_id}, retrying in {delay:.1f}s")
+        except NetworkError as e:
+            delay = min(30.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5)
+            logger.warning(f"Network error sending to {chat_id} ({e}), retrying in {delay:.1f}s")
+        except TelegramError as e:
+            # أخطاء غير قابلة لإعادة المحاولة (مستخدم حظر البوت، رسالة غير صالحة...)
+            self._failed.inc()
+            logger.error(f"Failed to send {self.name} message to {chat_id}: {e}")
+            return True, None, 0.0
+
+        if attempt >= self.max_retries:
+            self._failed.inc()
+            logger.error(f"Failed to send {self.name} message to {chat_id}: retries exhausted")
+            return True, None, 0.0
+        self._retries.inc()
+        return False, None, delay
+
+    async def _deliver(self, chat_id: int, kwargs: dict, chat_bucket: Optional[TokenBucket] = None,
+                       method: str = "send_message"):
+        """إرسال مباشر (أو تعديل) مع احترام الحدود وإعادة المحاولة، للمستدعي الذي ينتظر النتيجة"""
+        for attempt in range(self.max_retries + 1):
+            done, result, delay = await self._attempt(chat_id, kwargs, chat_bucket, method, attempt)
+            if done:
+                return result
+            await asyncio.sleep(delay)
+        return None
+
+    async def _serve(self, chat_id: int):
+        """محاولة إرسال أول رسالة في طابور المحادثة، أو تأجيل المحادثة إذا لم تكن جاهزة"""
+        outbox = self._outboxes[chat_id]
+        lock, chat_bucket = self._chat_state(chat_id)
+        wait = chat_bucket.wait_time()
+        if lock.locked():
+            wait = max(wait, LOCK_RETRY_DELAY)
+        if wait > 0:
+            self._defer(chat_id, wait)
+            return
+
+        message = outbox[0]
+        if message.attempt == 0:
+            self._delay_time.observe(time.perf_counter() - message.enqueued_at)
+        # القفل يمنع تداخل send_and_wait لنفس المحادثة أثناء الإرسال
+        async with lock:
+            done, _, delay = await self._attempt(chat_id, message.kwargs, chat_bucket, "send_message", message.attempt)
+        if not done:
+            # الرسالة تبقى أول الطابور، فلا تتجاوزها رسائل لاحقة لنفس المحادثة
+            message.attempt += 1
+            self._defer(chat_id, delay)
+            return
+        self._finish(chat_id)
+
+    def _finish(self, chat_id: int):
+        """حذف أول رسالة وإعادة جدولة المحادثة إذا بقيت فيها رسائل"""
+        outbox = self._outboxes[chat_id]
+        outbox.popleft()
+        self._pending -= 1
+        self._depth.set(self._pending)
+        if outbox:
+            self._schedule(chat_id)
+        else:
+            del self._outboxes[chat_id]
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self._ready.get()
+            try:
+                await self._serve(chat_id)
+            except Exception as e:
+                self._failed.inc()
+                logger.error(f"Send scheduler '{self.name}' error for chat {chat_id}: {e}")
+                if chat_id in self._outboxes:
+                    self._finish(chat_id)
+            finally:
+                self._ready.task_done()
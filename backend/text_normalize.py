@@ -0,0 +1,40 @@
+"""
+Text Normalization - تطبيع النصوص العربية واللاتينية
+تطبيع موحد لمقارنة ما يكتبه المستخدم مع الأوامر وأسماء المنتجات
+
+- حالة الأحرف اللاتينية (casefold)
+- حذف التشكيل والتطويل (ـ)
+- توحيد أشكال الألف (أ إ آ ٱ -> ا) والياء (ى -> ي) والتاء المربوطة (ة -> ه)
+- تحويل الأرقام العربية والفارسية إلى 0-9
+"""
+import re
+from typing import List
+
+_ARABIC_MARKS = (
+    [chr(code) for code in range(0x0610, 0x061B)]
+    + [chr(code) for code in range(0x064B, 0x0660)]
+    + ["ٰ", "ـ"]
+    + [chr(code) for code in range(0x06D6, 0x06EE)]
+)
+
+_NORMALIZE_TABLE = str.maketrans({
+    **{mark: None for mark in _ARABIC_MARKS},
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+})
+
+_WHITESPACE = re.compile(r"\s+")
+_TOKEN_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """تطبيع النص للمقارنة مع توحيد المسافات"""
+    return _WHITESPACE.sub(" ", text.strip()).casefold().translate(_NORMALIZE_TABLE)
+
+
+def tokenize(text: str) -> List[str]:
+    """تقسيم النص بعد تطبيعه إلى كلمات (الرموز وعلامات الترقيم فواصل)"""
+    return [token for token in _TOKEN_SEPARATORS.split(normalize(text)) if token]
@@ -0,0 +1,101 @@
+"""
+Update Deduplication - منع تكرار تحديثات تليجرام
+عند إعادة إرسال تليجرام لنفس التحديث (update_id) يتم تجاهله قبل Update.de_json وأي وصول لقاعدة البيانات
+
+الوضع الافتراضي ذاكرة محلية (LRU + TTL) لكل بوت. عند ضبط UPDATE_DEDUP_BACKEND=mongo
+تتم مشاركة السجل بين كل العمليات عبر مجموعة processed_updates (مع فهرس TTL)
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('UPDATE_DEDUP_SIZE', '10000'))
+DEFAULT_TTL_SECONDS = float(os.environ.get('UPDATE_DEDUP_TTL', '3600'))
+DEDUP_BACKEND = os.environ.get('UPDATE_DEDUP_BACKEND', 'memory')
+
+# مجموعة السجل المشترك (وضع mongo)
+PROCESSED_UPDATES_COLLECTION = "processed_updates"
+
+
+class UpdateDeduplicator:
+    """سجل update_id التي تمت رؤيتها مؤخراً لبوت واحد"""
+
+    def __init__(self, bot_name: str, db=None, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.bot_name = bot_name
+        # عند تمرير db يتم استخدام السجل المشترك في MongoDB بالإضافة للذاكرة المحلية
+        self.db = db
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self.ttl_seconds = DEFAULT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+        self._hits = metrics.counter("update_dedup_total", bot=bot_name, result="hit")
+        self._misses = metrics.counter("update_dedup_total", bot=bot_name, result="miss")
+
+    def _purge_expired(self, now: float):
+        # العناصر مرتبة حسب وقت الإضافة، لذلك نتوقف عند أول عنصر غير منتهي
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl_seconds:
+                break
+            self._seen.popitem(last=False)
+
+    def _check_local(self, update_id: int) -> bool:
+        """True إذا كان التحديث مكرراً، وإلا يتم تسجيله"""
+        now = time.monotonic()
+        self._purge_expired(now)
+
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+
+        self._seen[update_id] = now
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """
+        فحص التحديث وتسجيله كمُستلم
+
+        Returns:
+            bool: True إذا تمت رؤية التحديث من قبل ويجب تجاهله
+        """
+        duplicate = self._check_local(update_id)
+
+        if not duplicate and self.db is not None:
+            try:
+                await self.db[PROCESSED_UPDATES_COLLECTION].insert_one({
+                    "_id": f"{self.bot_name}:{update_id}",
+                    "bot": self.bot_name,
+                    "update_id": update_id,
+                    "created_at": datetime.now(timezone.utc)
+                })
+            except DuplicateKeyError:
+                duplicate = True
+            except Exception as e:
+                # عند تعذر الوصول للسجل المشترك نكتفي بالذاكرة المحلية
+                logger.error(f"Update dedup store error: {e}")
+
+        if duplicate:
+            self._hits.inc()
+        else:
+            self._misses.inc()
+        return duplicate
+
+    async def forget(self, update_id: int):
+        """إزالة التحديث من السجل (مثلاً عند رفضه بسبب امتلاء الطابور ليُقبل عند إعادة المحاولة)"""
+        self._seen.pop(update_id, None)
+        if self.db is not None:
+            try:
+                await self.db[PROCESSED_UPDATES_COLLECTION].delete_one({"_id": f"{self.bot_name}:{update_id}"})
+            except Exception as e:
+                logger.error(f"Update dedup store error: {e}")
@@ -0,0 +1,190 @@
+"""
+Update Queue - طابور تحديثات تليجرام
+استلام التحديثات من الـ webhook وإرجاع الرد فوراً، ثم معالجتها في الخلفية
+
+التحديثات تُوزع على مسارات (lanes) حسب chat_id: المحادثات المختلفة تُعالج بالتوازي،
+وتحديثات نفس المحادثة تُعالج بالترتيب دائماً لأنها تمر بنفس المسار الذي يملك عاملاً واحداً
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# الإعدادات الافتراضية (قابلة للتعديل من متغيرات البيئة)
+# عدد المسارات = أقصى عدد محادثات تُعالج بالتوازي
+DEFAULT_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+# مدة انتظار مكان في الطابور قبل رفض التحديث (يعيد تليجرام المحاولة لاحقاً)
+DEFAULT_ENQUEUE_TIMEOUT = float(os.environ.get('WEBHOOK_ENQUEUE_TIMEOUT', '2'))
+# إغلاق المسار بعد هذه المدة بدون تحديثات
+DEFAULT_LANE_IDLE_TIMEOUT = float(os.environ.get('WEBHOOK_LANE_IDLE_TIMEOUT', '30'))
+
+
+def extract_chat_id(update_data: dict) -> int:
+    """استخراج chat_id من التحديث الخام (بدون Update.de_json)"""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = update_data.get(key)
+        if message and message.get("chat"):
+            return message["chat"]["id"]
+
+    callback_query = update_data.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message")
+        if message and message.get("chat"):
+            return message["chat"]["id"]
+        if callback_query.get("from"):
+            return callback_query["from"]["id"]
+
+    for key in ("inline_query", "pre_checkout_query", "shipping_query", "my_chat_member"):
+        payload = update_data.get(key)
+        if payload and payload.get("from"):
+            return payload["from"]["id"]
+
+    # تحديث بدون محادثة معروفة - لا يهم ترتيبه
+    return update_data.get("update_id", 0)
+
+
+class UpdateDispatcher:
+    """توزيع تحديثات بوت واحد على مسارات مرتبة حسب المحادثة"""
+
+    def __init__(self, name: str, handler: Callable[[dict], Awaitable[None]],
+                 workers: Optional[int] = None, maxsize: Optional[int] = None,
+                 enqueue_timeout: Optional[float] = None, lane_idle_timeout: Optional[float] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers or DEFAULT_WORKERS
+        self.maxsize = maxsize or DEFAULT_QUEUE_SIZE
+        self.enqueue_timeout = DEFAULT_ENQUEUE_TIMEOUT if enqueue_timeout is None else enqueue_timeout
+        self.lane_idle_timeout = DEFAULT_LANE_IDLE_TIMEOUT if lane_idle_timeout is None else lane_idle_timeout
+
+        self._running = False
+        self._lanes: Dict[int, asyncio.Queue] = {}
+        self._lane_tasks: Dict[int, asyncio.Task] = {}
+        # السعة الإجمالية لكل المسارات معاً
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+        self._drained: Optional[asyncio.Event] = None
+
+        self._depth = metrics.gauge("webhook_queue_depth", bot=name)
+        self._active_lanes = metrics.gauge("webhook_active_lanes", bot=name)
+        self._wait_time = metrics.histogram("webhook_queue_wait_seconds", bot=name)
+        self._processing_time = metrics.histogram("webhook_processing_seconds", bot=name)
+        self._rejected = metrics.counter("webhook_updates_rejected_total", bot=name)
+        self._failed = metrics.counter("webhook_updates_failed_total", bot=name)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def active_lanes(self) -> int:
+        return len(self._lane_tasks)
+
+    async def start(self):
+        """تجهيز الموزع (المسارات تُنشأ عند الحاجة)"""
+        if self._running:
+            return
+        self._capacity = asyncio.Semaphore(self.maxsize)
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._running = True
+        logger.info(f"Update dispatcher '{self.name}' started: {self.workers} lanes, queue size {self.maxsize}")
+
+    async def stop(self, timeout: float = 10.0):
+        """إيقاف الموزع بعد تفريغ المسارات (بحد أقصى timeout ثانية)"""
+        if not self._running:
+            return
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update dispatcher '{self.name}': {self._pending} updates dropped on shutdown")
+        self._running = False
+        tasks = list(self._lane_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._lanes.clear()
+        self._lane_tasks.clear()
+        self._active_lanes.set(0)
+
+    def lane_for(self, update_data: dict) -> int:
+        """رقم المسار الخاص بمحادثة التحديث"""
+        return hash(extract_chat_id(update_data)) % self.workers
+
+    async def submit(self, update_data: dict) -> bool:
+        """
+        إضافة تحديث لمسار محادثته
+
+        Returns:
+            bool: False إذا بقي الطابور ممتلئاً طوال مدة الانتظار (ضغط عكسي)
+        """
+        if not self._running:
+            # لم يتم تشغيل الموزع (مثلاً خارج دورة حياة التطبيق) - معالجة مباشرة
+            await self._process(update_data, time.perf_counter())
+            return True
+
+        enqueued_at = time.perf_counter()
+        if self._capacity.locked():
+            try:
+                await asyncio.wait_for(self._capacity.acquire(), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self._rejected.inc()
+                logger.warning(f"Update dispatcher '{self.name}' queue full, rejecting update {update_data.get('update_id')}")
+                return False
+        else:
+            await self._capacity.acquire()
+
+        lane_id = self.lane_for(update_data)
+        lane = self._lanes.get(lane_id)
+        if lane is None:
+            lane = asyncio.Queue()
+            self._lanes[lane_id] = lane
+            self._lane_tasks[lane_id] = asyncio.create_task(self._lane_worker(lane_id, lane), name=f"{self.name}-lane-{lane_id}")
+            self._active_lanes.set(len(self._lane_tasks))
+
+        lane.put_nowait((enqueued_at, update_data))
+        self._pending += 1
+        self._drained.clear()
+        self._depth.set(self._pending)
+        return True
+
+    async def _process(self, update_data: dict, enqueued_at: float):
+        started = time.perf_counter()
+        self._wait_time.observe(started - enqueued_at)
+        try:
+            await self.handler(update_data)
+        except Exception as e:
+            self._failed.inc()
+            logger.error(f"Update dispatcher '{self.name}' failed on update {update_data.get('update_id')}: {e}")
+        finally:
+            self._processing_time.observe(time.perf_counter() - started)
+
+    async def _lane_worker(self, lane_id: int, lane: asyncio.Queue):
+        try:
+            while True:
+                try:
+                    enqueued_at, update_data = await asyncio.wait_for(lane.get(), self.lane_idle_timeout)
+                except asyncio.TimeoutError:
+                    # لا توجد نقطة انتظار بين الفحص والحذف، لذلك لا يمكن أن يضيع تحديث هنا
+                    if lane.empty():
+                        break
+                    continue
+
+                try:
+                    await self._process(update_data, enqueued_at)
+                finally:
+                    self._pending -= 1
+                    self._capacity.release()
+                    self._depth.set(self._pending)
+                    if self._pending == 0:
+                        self._drained.set()
+        finally:
+            if self._lanes.get(lane_id) is lane:
+                del self._lanes[lane_id]
+                del self._lane_tasks[lane_id]
+                self._active_lanes.set(len(self._lane_tasks))
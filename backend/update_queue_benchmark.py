@@ -0,0 +1,78 @@
+"""
+اختبار أداء طابور التحديثات - Update Queue Benchmark
+يقيس سرعة معالجة التحديثات حسب عدد المسارات، ويتحقق من الحفاظ على ترتيب كل محادثة
+
+الاستخدام:
+    python update_queue_benchmark.py [عدد_التحديثات] [عدد_المحادثات]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from update_queue import UpdateDispatcher
+
+# زمن المعالجة الوهمي لكل تحديث (استعلامات Mongo + إرسال تليجرام)
+HANDLER_LATENCY = (0.005, 0.02)
+LANE_COUNTS = [1, 2, 4, 8, 16, 32]
+
+
+def generate_updates(count: int, chats: int):
+    """إنشاء تحديثات وهمية موزعة عشوائياً على المحادثات"""
+    updates = []
+    for update_id in range(count):
+        chat_id = 9000000000 + random.randrange(chats)
+        updates.append({
+            "update_id": update_id,
+            "message": {"message_id": update_id, "chat": {"id": chat_id}, "text": "/start"}
+        })
+    return updates
+
+
+async def run_benchmark(lanes: int, updates):
+    """تشغيل الموزع بعدد مسارات محدد وقياس الإنتاجية"""
+    processed = {}
+
+    async def handler(update_data):
+        chat_id = update_data["message"]["chat"]["id"]
+        await asyncio.sleep(random.uniform(*HANDLER_LATENCY))
+        processed.setdefault(chat_id, []).append(update_data["update_id"])
+
+    dispatcher = UpdateDispatcher(f"bench-{lanes}", handler, workers=lanes, maxsize=len(updates))
+    await dispatcher.start()
+
+    start = time.perf_counter()
+    for update_data in updates:
+        await dispatcher.submit(update_data)
+    await dispatcher.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+
+    # التحقق من أن تحديثات كل محادثة عولجت بترتيب وصولها
+    in_order = all(ids == sorted(ids) for ids in processed.values())
+    return elapsed, in_order
+
+
+async def main(count: int = 2000, chats: int = 200):
+    print("="*50)
+    print("🚀 اختبار أداء طابور التحديثات")
+    print(f"📨 عدد التحديثات: {count}")
+    print(f"👥 عدد المحادثات: {chats}")
+    print("="*50)
+
+    updates = generate_updates(count, chats)
+    baseline = None
+
+    for lanes in LANE_COUNTS:
+        elapsed, in_order = await run_benchmark(lanes, updates)
+        throughput = count / elapsed
+        baseline = baseline or throughput
+        order_status = "✅" if in_order else "❌"
+        print(f"🛣️  {lanes:>3} مسار: {throughput:8.1f} تحديث/ثانية  (x{throughput / baseline:.1f})  الترتيب: {order_status}")
+
+    print("="*50)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
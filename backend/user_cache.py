@@ -0,0 +1,101 @@
+"""
+User Cache - ذاكرة مؤقتة لبيانات المستخدمين
+قراءة مستند المستخدم (الرصيد، الحظر...) من الذاكرة بدلاً من MongoDB في كل تحديث
+
+- ذاكرة لكل عملية (LRU + TTL) مفتاحها telegram_id، تُبطل صراحة عند كل كتابة
+- ذاكرة خاصة بكل تحديث (request scope) تضمن عدم تحميل نفس المستخدم مرتين في نفس التحديث
+"""
+import copy
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import metrics
+
+DEFAULT_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('USER_CACHE_SIZE', '20000'))
+
+# ذاكرة التحديث الحالي (None خارج نطاق أي تحديث)
+_request_memo: ContextVar[Optional[dict]] = ContextVar("user_cache_request_memo", default=None)
+
+
+@contextmanager
+def request_scope():
+    """نطاق تحديث واحد: كل قراءات المستخدم داخله تُحمّل مرة واحدة فقط"""
+    token = _request_memo.set({})
+    try:
+        yield
+    finally:
+        _request_memo.reset(token)
+
+
+class UserCache:
+    """ذاكرة مؤقتة لمجموعة users حسب telegram_id"""
+
+    def __init__(self, collection, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.collection = collection
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # يزداد مع كل إبطال، لمنع تخزين قراءة بدأت قبل الكتابة
+        self._generation = 0
+
+        self._memo_hits = metrics.counter("user_cache_total", result="memo")
+        self._hits = metrics.counter("user_cache_total", result="hit")
+        self._misses = metrics.counter("user_cache_total", result="miss")
+
+    async def get(self, telegram_id: int) -> Optional[dict]:
+        """مستند المستخدم (نسخة) أو None إذا لم يكن مسجلاً"""
+        memo = _request_memo.get()
+        if memo is not None and telegram_id in memo:
+            self._memo_hits.inc()
+            return copy.copy(memo[telegram_id])
+
+        cached = self._entries.get(telegram_id)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            self._entries.move_to_end(telegram_id)
+            self._hits.inc()
+            user = cached[0]
+        else:
+            self._misses.inc()
+            generation = self._generation
+            user = await self.collection.find_one({"telegram_id": telegram_id})
+            if generation == self._generation:
+                self._entries[telegram_id] = (user, time.monotonic())
+                self._entries.move_to_end(telegram_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if memo is not None:
+            memo[telegram_id] = user
+        return copy.copy(user)
+
+    def invalidate(self, telegram_id: int):
+        """إبطال المستخدم بعد أي كتابة (رصيد، حظر، تسجيل جديد)"""
+        self._generation += 1
+        self._entries.pop(telegram_id, None)
+        memo = _request_memo.get()
+        if memo is not None:
+            memo.pop(telegram_id, None)
+
+    def clear(self):
+        """إبطال كل المستخدمين (بعد عمليات جماعية)"""
+        self._generation += 1
+        self._entries.clear()
+        memo = _request_memo.get()
+        if memo is not None:
+            memo.clear()
+
+    def stats(self) -> dict:
+        """نسبة الإصابة وعدد الرحلات الموفرة لقاعدة البيانات"""
+        memo_hits, hits, misses = self._memo_hits.value, self._hits.value, self._misses.value
+        total = memo_hits + hits + misses
+        return {
+            "entries": len(self._entries),
+            "hit_ratio": round((memo_hits + hits) / total, 4) if total else 0.0,
+            "saved_round_trips": memo_hits + hits,
+            "db_reads": misses
+        }
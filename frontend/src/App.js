@@ -26,6 +26,7 @@ function App() {
   const [orders, setOrders] = useState([]);
   const [pendingOrders, setPendingOrders] = useState([]);
   const [codesStats, setCodesStats] = useState([]);
+  const [dashboardStats, setDashboardStats] = useState(null);
   const [loading, setLoading] = useState(false);
   const [webhooksSet, setWebhooksSet] = useState(false);
 
@@ -35,13 +36,14 @@ function App() {
 
   const fetchData = async () => {
     try {
-      const [productsRes, categoriesRes, usersRes, ordersRes, pendingOrdersRes, codesStatsRes] = await Promise.all([
+      const [productsRes, categoriesRes, usersRes, ordersRes, pendingOrdersRes, codesStatsRes, dashboardStatsRes] = await Promise.all([
         axios.get(`${API}/products`),
         axios.get(`${API}/categories`),
         axios.get(`${API}/users`),
         axios.get(`${API}/orders`),
         axios.get(`${API}/pending-orders`),
-        axios.get(`${API}/codes-stats`)
+        axios.get(`${API}/codes-stats`),
+        axios.get(`${API}/dashboard-stats`)
       ]);
       
       setProducts(productsRes.data);
@@ -50,6 +52,7 @@ function App() {
       setOrders(ordersRes.data);
       setPendingOrders(pendingOrdersRes.data);
       setCodesStats(codesStatsRes.data);
+      setDashboardStats(dashboardStatsRes.data);
     } catch (error) {
       console.error('خطأ في جلب البيانات:', error);
       toast.error('فشل في تحميل البيانات');
@@ -81,6 +84,7 @@ function App() {
             orders={orders}
             pendingOrders={pendingOrders}
             codesStats={codesStats}
+            dashboardStats={dashboardStats}
             setupWebhooks={setupWebhooks}
             loading={loading}
             webhooksSet={webhooksSet}
@@ -92,10 +96,12 @@ function App() {
   );
 }
 
-const Dashboard = ({ products, categories, users, orders, pendingOrders, codesStats, setupWebhooks, loading, webhooksSet, refreshData }) => {
-  const totalRevenue = orders
-    .filter(order => order.status === 'completed')
-    .reduce((sum, order) => sum + order.price, 0);
+const Dashboard = ({ products, categories, users, orders, pendingOrders, codesStats, dashboardStats, setupWebhooks, loading, webhooksSet, refreshData }) => {
+  const totalRevenue = dashboardStats
+    ? dashboardStats.total_revenue
+    : orders
+      .filter(order => order.status === 'completed')
+      .reduce((sum, order) => sum + order.price, 0);
     
   const totalBalance = users.reduce((sum, user) => sum + user.balance, 0);
   
@@ -144,7 +150,7 @@ const Dashboard = ({ products, categories, users, orders, pendingOrders, codesSt
               <Users className="h-4 w-4 text-blue-400" />
             </CardHeader>
             <CardContent>
-              <div className="text-2xl font-bold text-white">{users.length}</div>
+              <div className="text-2xl font-bold text-white">{dashboardStats ? dashboardStats.total_users : users.length}</div>
             </CardContent>
           </Card>
 
@@ -164,7 +170,7 @@ const Dashboard = ({ products, categories, users, orders, pendingOrders, codesSt
               <ShoppingCart className="h-4 w-4 text-purple-400" />
             </CardHeader>
             <CardContent>
-              <div className="text-2xl font-bold text-white">{orders.length}</div>
+              <div className="text-2xl font-bold text-white">{dashboardStats ? dashboardStats.total_orders : orders.length}</div>
             </CardContent>
           </Card>
 
@@ -174,7 +180,7 @@ const Dashboard = ({ products, categories, users, orders, pendingOrders, codesSt
               <ShoppingCart className="h-4 w-4 text-orange-400" />
             </CardHeader>
             <CardContent>
-              <div className="text-2xl font-bold text-white">{pendingOrders.length}</div>
+              <div className="text-2xl font-bold text-white">{dashboardStats ? dashboardStats.pending_orders : pendingOrders.length}</div>
               <p className="text-xs text-orange-400 mt-1">
                 {lowStockAlerts > 0 && `${lowStockAlerts} أكواد منخفضة`}
               </p>